@@ -4,7 +4,12 @@ function print_help {
    Options:
    -n, --num-login-attempts The number of login/logout cycles to attempt
    -z, --login-attempt-wait-time-secs   How long to wait between each login attempt
+   -c, --concurrency   The number of virtual users to run at the same time (default: 1)
+   -m, --user-mode   'browser' (default) or 'http'; whether each virtual user uses its own browser
+                     or its own HTTP session
    -ip, --idp-ip   (Optional) A strict IP to send all idp requests through.
+   -H, --idp-hosts (Optional) A comma-separated list of IdP nodes (e.g., idp11,idp12,idp13)
+                   to spread the virtual users across; results are reported for each node.
    -b, --build     If used, will build a new image to run the test
    -h, --help      Show this message and exit
    -g, --debug     Show commands as they are executing
@@ -13,6 +18,8 @@ EOF
 
 num_login_attempts=1
 sleep_time=5
+concurrency=1
+user_mode=browser
 image=ghcr.io/uwit-iam/idp-web-tests:lb-test
 
 function parse_args {
@@ -31,6 +38,18 @@ function parse_args {
         shift
         sleep_time="$1"
         ;;
+      -c|--concurrency)
+        shift
+        concurrency="$1"
+        ;;
+      -m|--user-mode)
+        shift
+        user_mode="$1"
+        ;;
+      -H|--idp-hosts)
+        shift
+        idp_hosts="$1"
+        ;;
       -ip|--idp-ip)
         shift
         idp_ip="$1"
@@ -62,10 +81,18 @@ then
   docker tag ${image} ghcr.io/uwit-iam/idp-web-tests:build
 fi
 
+if [[ "${user_mode}" == "browser" ]] && [[ "${concurrency}" -gt "${SELENIUM_MAX_SESSIONS:-2}" ]]
+then
+  # Each virtual user needs its own browser session.
+  export SELENIUM_MAX_SESSIONS=${concurrency}
+fi
+
 ./scripts/run-tests.sh \
   --env prod \
   $(test -z "${idp_ip}" || echo "--strict-ip ${idp_ip}") \
   $(test -n "${force_build}" || echo "--no-build") \
   +- --skip-test-service-provider-start --skip-test-service-provider-stop \
   --lb-num-loops ${num_login_attempts} --lb-sleep-time ${sleep_time} \
+  --lb-concurrency ${concurrency} --lb-user-mode ${user_mode} \
+  $(test -z "${idp_hosts}" || echo "--lb-idp-hosts ${idp_hosts// /}") \
   tests/test_generate_requests.py
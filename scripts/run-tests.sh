@@ -16,6 +16,9 @@ function print_help {
                   /etc/hosts entry on the chrome container for the IdP URL.
    --source-tag   You may define a different image other than `latest`
                   for the base UWIT-IAM/poetry image
+   --workers      Distribute the tests across this many worker processes.
+                  The selenium node will be configured to allow at least
+                  this many concurrent browser sessions.
    -- [...]       All input after `--` will be sent to pytest as CLI arguments.
    +- [...]       All input after `+-` will be appended to default pytest CLI arguments.
 EOF
@@ -64,6 +67,10 @@ function parse_args() {
         shift
         STRICT_IP=$1
         ;;
+      --workers)
+        shift
+        WORKERS=$1
+        ;;
       --)
         shift
         export PYTEST_ARGS="$@"
@@ -145,6 +152,16 @@ function sanitize_pytest_args() {
   then
     PYTEST_ARGS="$PYTEST_ARGS --env $IDP_ENV"
   fi
+  if [[ -n "${WORKERS}" ]] && [[ "${WORKERS}" -gt "0" ]]
+  then
+    # loadgroup keeps tests that share a class browser on the same worker;
+    # see pytest_collection_modifyitems in tests/conftest.py
+    PYTEST_ARGS="$PYTEST_ARGS -n $WORKERS --dist loadgroup"
+    if [[ "${WORKERS}" -gt "${SELENIUM_MAX_SESSIONS:-2}" ]]
+    then
+      export SELENIUM_MAX_SESSIONS=$WORKERS
+    fi
+  fi
 }
 
 validate_env
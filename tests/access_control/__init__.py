@@ -1,10 +1,17 @@
 from typing import Callable, NoReturn
 
 import pytest
-from webdriver_recorder.browser import BrowserRecorder
+from webdriver_recorder.browser import BrowserError, BrowserRecorder, By, Locator
 
 from tests.helpers import WebTestUtils
 from tests.models import ServiceProviderInstance
+from tests.sso_sessions import PASSWORD, TWO_FACTOR, SsoSessionCache
+
+# Where a restored SSO session ends up: the SP (if the IdP accepted it), or the sign-in page (if not).
+SSO_SESSION_OUTCOME_LOCATOR = Locator(
+    search_method=By.XPATH,
+    search_value="//h2[contains(., 'sign-in success!')] | //p[contains(., 'Please sign in.')]",
+)
 
 
 class AccessControlTestBase:
@@ -24,6 +31,7 @@ class AccessControlTestBase:
     enter_duo_passcode: Callable[..., NoReturn]
     log_in_netid: Callable[..., NoReturn]
     sp_shib_url: Callable[..., str]
+    sso_sessions: SsoSessionCache
 
     @pytest.fixture(autouse=True)
     def initialize_base(
@@ -36,6 +44,7 @@ class AccessControlTestBase:
             enter_duo_passcode,
             log_in_netid,
             sp_shib_url,
+            sso_sessions,
             fresh_browser,
     ):
         self.browser = fresh_browser
@@ -47,3 +56,31 @@ class AccessControlTestBase:
         self.enter_duo_passcode = enter_duo_passcode
         self.log_in_netid = log_in_netid
         self.sp_shib_url = sp_shib_url
+        self.sso_sessions = sso_sessions
+
+    def establish_sso_session(self, sp: ServiceProviderInstance, netid: str, two_factor: bool = False):
+        """
+        Signs the netid in to the SP, with a password (and Duo, if two_factor is set), so that
+        the browser has an existing SSO session. If an earlier test already did that, its
+        session is reused instead; see tests/sso_sessions.py.
+        """
+        url = self.sp_shib_url(sp, append='mfa' if two_factor else '')
+
+        def sign_in():
+            self.browser.get(url)
+            if two_factor:
+                self.log_in_netid(self.browser, netid, assert_success=False)
+                self.enter_duo_passcode(self.browser, match_service_provider=sp)
+            else:
+                self.log_in_netid(self.browser, netid, match_service_provider=sp)
+
+        def verify() -> bool:
+            self.browser.get(url)
+            try:
+                outcome = self.browser.wait_for(SSO_SESSION_OUTCOME_LOCATOR)
+            except BrowserError:
+                return False
+            return outcome.tag_name == 'h2' and self.sp_domain(sp) in outcome.text
+
+        with self.utils.using_test_sp(sp):
+            self.sso_sessions.establish(self.browser, netid, TWO_FACTOR if two_factor else PASSWORD, sign_in, verify)
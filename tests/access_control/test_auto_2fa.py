@@ -19,10 +19,7 @@ class TestAuto2fa(AccessControlTestBase):
         AC-1 Part B
         """
         # b. Prompted for 2FA only on diafine7.
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp))
-            self.log_in_netid(self.browser, netid3, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, netid3)
 
         sp = ServiceProviderInstance.diafine7
         with self.utils.using_test_sp(sp):
@@ -52,11 +49,7 @@ class TestAuto2fa(AccessControlTestBase):
         AC-1 Part D
         """
         # d. No prompts on diafine7.
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp, append='mfa'))
-            self.log_in_netid(self.browser, netid3, match_service_provider=sp, assert_success=False)
-            self.enter_duo_passcode(self.browser, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, netid3, two_factor=True)
 
         sp = ServiceProviderInstance.diafine7
         with self.utils.using_test_sp(sp):
@@ -68,11 +61,7 @@ class TestAuto2fa(AccessControlTestBase):
         AC-1 Part E
         """
         # Prompted for pwd then 2FA on diafine7.
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp, append='mfa'))
-            self.log_in_netid(self.browser, netid3, match_service_provider=sp, assert_success=False)
-            self.enter_duo_passcode(self.browser, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, netid3, two_factor=True)
 
         sp = ServiceProviderInstance.diafine7
         with self.utils.using_test_sp(sp):
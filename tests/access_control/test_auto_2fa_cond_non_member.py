@@ -29,10 +29,7 @@ class TestAuto2faCondAccessNonMember(AccessControlTestBase):
         """
          b. Prompted for 2FA then access denied on diafine10.  Access error URL returned.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp))
-            self.log_in_netid(self.browser, self.netid, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid)
 
         sp = ServiceProviderInstance.diafine10
         with self.utils.using_test_sp(sp):
@@ -45,10 +42,7 @@ class TestAuto2faCondAccessNonMember(AccessControlTestBase):
         """
         c. Prompted for pwd, then 2FA, then access denied on diafine10.  Access error URL returned.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp))
-            self.log_in_netid(self.browser, self.netid, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid)
 
         sp = ServiceProviderInstance.diafine10
         with self.utils.using_test_sp(sp):
@@ -62,11 +56,7 @@ class TestAuto2faCondAccessNonMember(AccessControlTestBase):
         """
         d. Access denied on diafine10. Access error URL returned.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp, append='mfa'))
-            self.log_in_netid(self.browser, self.netid, assert_success=False)
-            self.enter_duo_passcode(self.browser, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid, two_factor=True)
 
         sp = ServiceProviderInstance.diafine10
         with self.utils.using_test_sp(sp):
@@ -78,11 +68,7 @@ class TestAuto2faCondAccessNonMember(AccessControlTestBase):
         """
          e. Prompted for pwd, then 2FA, then access denied on diafine10. Access error URL returned.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp, append='mfa'))
-            self.log_in_netid(self.browser, self.netid, assert_success=False)
-            self.enter_duo_passcode(self.browser, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid, two_factor=True)
 
         sp = ServiceProviderInstance.diafine10
         with self.utils.using_test_sp(sp):
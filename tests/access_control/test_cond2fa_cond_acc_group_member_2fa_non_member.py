@@ -26,10 +26,7 @@ class TestCond2faAccGroupNonMember2fa(AccessControlTestBase):
         """
         b. No prompt on diafine11.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp))
-            self.log_in_netid(self.browser, self.netid, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid)
 
         sp = ServiceProviderInstance.diafine11
         with self.utils.using_test_sp(sp):
@@ -40,10 +37,7 @@ class TestCond2faAccGroupNonMember2fa(AccessControlTestBase):
         """
         c. Prompted for pwd on diafine11.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp))
-            self.log_in_netid(self.browser, self.netid, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid)
 
         sp = ServiceProviderInstance.diafine11
         with self.utils.using_test_sp(sp):
@@ -54,11 +48,7 @@ class TestCond2faAccGroupNonMember2fa(AccessControlTestBase):
         """
         d. No prompt on diafine11.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp, append='mfa'))
-            self.log_in_netid(self.browser, self.netid, assert_success=False)
-            self.enter_duo_passcode(self.browser, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid, two_factor=True)
 
         sp = ServiceProviderInstance.diafine11
         with self.utils.using_test_sp(sp):
@@ -69,11 +59,7 @@ class TestCond2faAccGroupNonMember2fa(AccessControlTestBase):
         """
         e. Prompted for pwd, then 2FA,  on diafine11.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp, append='mfa'))
-            self.log_in_netid(self.browser, self.netid, assert_success=False)
-            self.enter_duo_passcode(self.browser, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid, two_factor=True)
 
         sp = ServiceProviderInstance.diafine11
         with self.utils.using_test_sp(sp):
@@ -27,10 +27,7 @@ class TestCond2faCondGroupMemberBoth(AccessControlTestBase):
         """
         b. Prompted for 2FA only on diafine11.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp))
-            self.log_in_netid(self.browser, self.netid, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid)
 
         sp = ServiceProviderInstance.diafine11
         with self.utils.using_test_sp(sp):
@@ -41,10 +38,7 @@ class TestCond2faCondGroupMemberBoth(AccessControlTestBase):
         """
          c. Prompted for pwd then 2FA on diafine11.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp))
-            self.log_in_netid(self.browser, self.netid, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid)
 
         sp = ServiceProviderInstance.diafine11
         with self.utils.using_test_sp(sp):
@@ -56,11 +50,7 @@ class TestCond2faCondGroupMemberBoth(AccessControlTestBase):
         """
         d. No prompts on diafine11.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp, append='mfa'))
-            self.log_in_netid(self.browser, self.netid, assert_success=False)
-            self.enter_duo_passcode(self.browser, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid, two_factor=True)
 
         sp = ServiceProviderInstance.diafine11
         with self.utils.using_test_sp(sp):
@@ -71,11 +61,7 @@ class TestCond2faCondGroupMemberBoth(AccessControlTestBase):
         """
         e. Prompted for pwd then 2FA on diafine11.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp, append='mfa'))
-            self.log_in_netid(self.browser, self.netid, assert_success=False)
-            self.enter_duo_passcode(self.browser, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid, two_factor=True)
 
         sp = ServiceProviderInstance.diafine11
         with self.utils.using_test_sp(sp):
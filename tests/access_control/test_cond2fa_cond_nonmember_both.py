@@ -27,10 +27,7 @@ class TestCond2faNonMemberBoth(AccessControlTestBase):
         """
         b. Access denied on diafine11. Access error URL returned.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp))
-            self.log_in_netid(self.browser, self.netid, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid)
 
         sp = ServiceProviderInstance.diafine11
         with self.utils.using_test_sp(sp):
@@ -41,11 +38,7 @@ class TestCond2faNonMemberBoth(AccessControlTestBase):
         """
         c. Prompted for pwd, then access denied on diafine11. Access error URL returned.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp))
-            self.log_in_netid(self.browser, self.netid)
-            self.browser.wait_for_tag('h2', f'{self.sp_domain(sp)} sign-in success!')
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid)
 
         sp = ServiceProviderInstance.diafine11
         with self.utils.using_test_sp(sp):
@@ -57,11 +50,7 @@ class TestCond2faNonMemberBoth(AccessControlTestBase):
         """
         d. Access denied on diafine11. Access error URL returned.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp, append='mfa'))
-            self.log_in_netid(self.browser, self.netid, assert_success=False)
-            self.enter_duo_passcode(self.browser, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid, two_factor=True)
 
         sp = ServiceProviderInstance.diafine11
         with self.utils.using_test_sp(sp):
@@ -72,11 +61,7 @@ class TestCond2faNonMemberBoth(AccessControlTestBase):
         """
         e. Prompted for pwd, then 2FA, then access denied on diafine11.  Access error URL returned.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp, append='mfa'))
-            self.log_in_netid(self.browser, self.netid, assert_success=False)
-            self.enter_duo_passcode(self.browser, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid, two_factor=True)
 
         sp = ServiceProviderInstance.diafine11
         with self.utils.using_test_sp(sp):
@@ -22,10 +22,7 @@ class TestCond2faGroupMember(AccessControlTestBase):
         """
         No prompts on diafine8.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp))
-            self.log_in_netid(self.browser, self.netid, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid)
 
         sp = ServiceProviderInstance.diafine8
         with self.utils.using_test_sp(sp):
@@ -36,10 +33,7 @@ class TestCond2faGroupMember(AccessControlTestBase):
         """
         c. Prompted for pwd only on diafine8.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp))
-            self.log_in_netid(self.browser, self.netid, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid)
 
         sp = ServiceProviderInstance.diafine8
         with self.utils.using_test_sp(sp):
@@ -50,11 +44,7 @@ class TestCond2faGroupMember(AccessControlTestBase):
         """
         d. No prompts on diafine8.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp, append='mfa'))
-            self.log_in_netid(self.browser, self.netid, assert_success=False)
-            self.enter_duo_passcode(self.browser, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid, two_factor=True)
 
         sp = ServiceProviderInstance.diafine8
         with self.utils.using_test_sp(sp):
@@ -65,11 +55,7 @@ class TestCond2faGroupMember(AccessControlTestBase):
         """
         e. Prompted for pwd then 2FA on diafine8.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp, append='mfa'))
-            self.log_in_netid(self.browser, self.netid, assert_success=False)
-            self.enter_duo_passcode(self.browser, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid, two_factor=True)
 
         sp = ServiceProviderInstance.diafine8
         with self.utils.using_test_sp(sp):
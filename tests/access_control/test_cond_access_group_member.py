@@ -27,10 +27,7 @@ class TestCondAccessGroupMember(AccessControlTestBase):
         """
         b. No prompts on diafine9.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp))
-            self.log_in_netid(self.browser, self.netid, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid)
 
         sp = ServiceProviderInstance.diafine9
         with self.utils.using_test_sp(sp):
@@ -41,10 +38,7 @@ class TestCondAccessGroupMember(AccessControlTestBase):
         """
         c. Prompted for pwd on diafine9.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp))
-            self.log_in_netid(self.browser, self.netid, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid)
 
         sp = ServiceProviderInstance.diafine9
         with self.utils.using_test_sp(sp):
@@ -28,10 +28,7 @@ class TestCondAccessNonMember(AccessControlTestBase):
         """
         b. Access denied on diafine9. Access error URL returned.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp))
-            self.log_in_netid(self.browser, self.netid, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid)
 
         sp = ServiceProviderInstance.diafine9
         with self.utils.using_test_sp(sp):
@@ -43,10 +40,7 @@ class TestCondAccessNonMember(AccessControlTestBase):
         """
         c. Prompted for pwd, then access denied on diafine9. Access error URL returned.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp))
-            self.log_in_netid(self.browser, self.netid, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid)
 
         sp = ServiceProviderInstance.diafine9
         with self.utils.using_test_sp(sp):
@@ -59,11 +53,7 @@ class TestCondAccessNonMember(AccessControlTestBase):
         """
         d. Access denied on diafine9. Access error URL returned.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp, append='mfa'))
-            self.log_in_netid(self.browser, self.netid, assert_success=False)
-            self.enter_duo_passcode(self.browser, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid, two_factor=True)
 
         sp = ServiceProviderInstance.diafine9
         with self.utils.using_test_sp(sp):
@@ -75,11 +65,7 @@ class TestCondAccessNonMember(AccessControlTestBase):
         """
         e. Prompted for pwd, then 2FA, then access denied on diafine9. Access error URL returned.
         """
-        sp = ServiceProviderInstance.diafine6
-        with self.utils.using_test_sp(sp):
-            self.browser.get(self.sp_shib_url(sp, append='mfa'))
-            self.log_in_netid(self.browser, self.netid, assert_success=False)
-            self.enter_duo_passcode(self.browser, match_service_provider=sp)
+        self.establish_sso_session(ServiceProviderInstance.diafine6, self.netid, two_factor=True)
 
         sp = ServiceProviderInstance.diafine9
         with self.utils.using_test_sp(sp):
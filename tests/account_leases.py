@@ -0,0 +1,160 @@
+"""
+Test account leases, so that tests running in parallel never step on each other's
+IdP or Duo state for the same netid.
+
+A test holds a lease on each account it uses (via the `netid*` fixtures) for as long as it runs.
+The leases are taken all at once, before the test's other fixtures are set up, and always in the same
+(sorted) order, so that two tests can never each hold an account that the other is waiting for.
+Tests that go through Duo hold an exclusive lease, because Duo keeps state per account
+(device trust, remember-me, failed passcode attempts); all other tests hold a shared lease.
+You can override this for a test with `@pytest.mark.account_lease('exclusive')` or
+`@pytest.mark.account_lease('shared')`.
+
+Tests in a class that uses `fresh_class_browser` share the browser, and so its IdP and Duo state
+for their accounts; the class holds the leases on all of its tests' accounts (exclusive, if any of
+its tests needs that) from its first test until its last, and its tests don't lease them again.
+
+Leases are implemented with file locks, so they are honored across pytest-xdist workers.
+"""
+from __future__ import annotations
+
+import fcntl
+import logging
+import os
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Dict, Iterable, Iterator, List, Set
+
+import pytest
+
+from .metrics import METRICS
+from .models import AccountNetid
+from .run_dirs import run_dir
+
+logger = logging.getLogger(__name__)
+
+# Maps each account fixture to the account it provides.
+ACCOUNT_FIXTURES: Dict[str, AccountNetid] = {
+    'netid': AccountNetid.sptest01,
+    'netid2': AccountNetid.sptest02,
+    'netid3': AccountNetid.sptest03,
+    'netid4': AccountNetid.sptest04,
+    'netid5': AccountNetid.sptest05,
+    'netid6': AccountNetid.sptest06,
+    'netid7': AccountNetid.sptest07,
+    'netid8': AccountNetid.sptest08,
+    'netid10': AccountNetid.sptest10,
+}
+
+EXCLUSIVE = 'exclusive'
+SHARED = 'shared'
+
+
+def lease_mode(item: pytest.Item) -> str:
+    marker = item.get_closest_marker('account_lease')
+    if marker:
+        return marker.args[0]
+    if 'enter_duo_passcode' in item.fixturenames:
+        return EXCLUSIVE
+    return SHARED
+
+
+def accounts_of(item: pytest.Item) -> Set[AccountNetid]:
+    """The accounts the test uses, by way of its `netid*` fixtures."""
+    return {account for name, account in ACCOUNT_FIXTURES.items() if name in item.fixturenames}
+
+
+def exclusive_accounts(item: pytest.Item) -> Set[AccountNetid]:
+    if lease_mode(item) != EXCLUSIVE:
+        return set()
+    return accounts_of(item)
+
+
+def schedule_for_concurrency(items: List[pytest.Item], num_workers: int) -> List[pytest.Item]:
+    """
+    Reorders the tests so that tests needing an exclusive lease on the same account are not
+    dispatched next to each other, where they would be likely to run at the same time on
+    different workers and wait on each other's leases. Tests in the same xdist_group are
+    kept together and in order.
+    """
+    units: List[List[pytest.Item]] = []
+    group_units = {}
+    for item in items:
+        marker = item.get_closest_marker('xdist_group')
+        if marker:
+            group = marker.kwargs.get('name', marker.args[0] if marker.args else 'default')
+            if group not in group_units:
+                group_units[group] = []
+                units.append(group_units[group])
+            group_units[group].append(item)
+        else:
+            units.append([item])
+
+    unit_accounts = [set().union(*(exclusive_accounts(item) for item in unit)) for unit in units]
+    remaining = list(range(len(units)))
+    recent: List[Set[AccountNetid]] = []
+    scheduled = []
+    while remaining:
+        busy = set().union(*recent) if recent else set()
+        choice = next((i for i in remaining if not unit_accounts[i] & busy), remaining[0])
+        remaining.remove(choice)
+        scheduled.extend(units[choice])
+        recent = (recent + [unit_accounts[choice]])[-(num_workers - 1):] if num_workers > 1 else []
+    return scheduled
+
+
+class AccountLeaseManager:
+    def __init__(self, lock_dir: str):
+        self._lock_dir = lock_dir
+        # The accounts leased by the class that is running, which its tests must not lease again.
+        self._class_accounts: Set[AccountNetid] = set()
+        os.makedirs(lock_dir, exist_ok=True)
+
+    @classmethod
+    def for_test_run(cls) -> AccountLeaseManager:
+        # All xdist workers in a test run share a run id, and so share a lock directory.
+        return cls(run_dir('account-leases'))
+
+    @contextmanager
+    def hold_for_test(self, item: pytest.Item) -> Iterator[None]:
+        """Leases every account the test uses (except those its class already holds), until the block exits."""
+        with self.hold_accounts(accounts_of(item) - self._class_accounts, lease_mode(item)):
+            yield
+
+    @contextmanager
+    def hold_for_class(self, items: Iterable[pytest.Item]) -> Iterator[None]:
+        """Leases every account used by the tests of a class, for as long as the class runs."""
+        items = list(items)
+        mode = EXCLUSIVE if any(lease_mode(item) == EXCLUSIVE for item in items) else SHARED
+        accounts = set().union(*(accounts_of(item) for item in items))
+        with self.hold_accounts(accounts, mode):
+            self._class_accounts = accounts
+            try:
+                yield
+            finally:
+                self._class_accounts = set()
+
+    @contextmanager
+    def hold_accounts(self, accounts: Iterable[AccountNetid], mode: str = SHARED) -> Iterator[None]:
+        """Leases the given accounts until the block exits, for tests that pick their own accounts."""
+        with ExitStack() as stack:
+            # Always in the same order, so that two holders can't each hold an account the other is waiting for.
+            for account in sorted(set(accounts), key=lambda a: a.value):
+                stack.enter_context(self._lease(account, mode))
+            yield
+
+    @contextmanager
+    def _lease(self, account: AccountNetid, mode: str) -> Iterator[None]:
+        lock_type = fcntl.LOCK_EX if mode == EXCLUSIVE else fcntl.LOCK_SH
+        with open(os.path.join(self._lock_dir, f'{account.value}.lock'), 'a') as lock_file:
+            start = time.perf_counter()
+            fcntl.flock(lock_file, lock_type)
+            waited = time.perf_counter() - start
+            METRICS.record('account_lease.wait_seconds', waited)
+            if waited > 1:
+                logger.info(f"Waited {waited:.1f}s for {mode} lease on {account.value}")
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
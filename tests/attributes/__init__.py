@@ -1,24 +1,65 @@
 import json
 import logging
-from typing import Callable, NoReturn, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, NoReturn, Dict, FrozenSet, Iterable, List, Optional, Tuple
 
 import pytest
-from webdriver_recorder.browser import BrowserRecorder
+from webdriver_recorder.browser import BrowserRecorder, XPathWithSubstringLocator
 
+from tests.dom_waits import DOM_WAITS, VISIBLE, DomWaitMixin, page_lookup
 from tests.helpers import WebTestUtils
+from tests.http_saml import HttpSamlClient, HttpSamlEngine
+from tests.models import AttributeMode, ServiceProviderInstance, WaitEngine
+from tests.snap_policy import SNAPSHOTS
+
+ATTRIBUTE_DATA_LOCATOR = XPathWithSubstringLocator(tag='pre', displayed_substring='cn')
+
+
+class AttributeData(dict):
+    """
+    The attributes released to an SP, as {name: value}. Multi-valued attributes are released
+    as a single value separated by ';'; `values_of` has them already split.
+    """
+    def __init__(self, pairs: Iterable[Tuple[str, str]]):
+        super().__init__(pairs)
+        self._value_sets = {key: frozenset(value.split(';')) for key, value in self.items()}
+
+    def values_of(self, key: str) -> FrozenSet[str]:
+        return self._value_sets.get(key, frozenset({''}))
+
+
+class AttributeTarget:
+    """
+    An attribute to read from an SP, for `AttributeReleaseTestBase._fan_out`. `attribute` is the same
+    as `test_attributes` for `_find_attributes`. Targets for the same netid share a sign-in session,
+    unless `isolated` is True, which gives the target a session of its own (e.g., to compare what two
+    separate sign-ins are given).
+    """
+    def __init__(self, sp: ServiceProviderInstance, netid: str, attribute, assert_success: Optional[bool] = None,
+                 isolated: bool = False):
+        self.sp = sp
+        self.netid = netid
+        self.attribute = attribute
+        self.assert_success = assert_success
+        self.isolated = isolated
 
 
 class AttributeReleaseTestBase:
     # These are just type declarations.
     # Do not set values on these fields!
-    fresh_browser: BrowserRecorder
     login: str
     utils: WebTestUtils
     sp_shib_url: Callable[..., str]
+    sp_domain: Callable[..., str]
     test_env: str
     enter_duo_passcode: Callable[..., NoReturn]
     log_in_netid: Callable[..., NoReturn]
     idp_env: str
+    attribute_mode: str
+    http_saml_engine: HttpSamlEngine
+    fan_out_concurrency: int
+    # Attribute data already read in this test, by (SP, netid, browser session)
+    _attribute_cache: Dict[Tuple[ServiceProviderInstance, str, str], AttributeData]
 
     @pytest.fixture(autouse=True)
     def initialize_base(
@@ -26,78 +67,175 @@ class AttributeReleaseTestBase:
             netid,
             utils,
             sp_shib_url,
+            sp_domain,
             test_env,
             log_in_netid,
             enter_duo_passcode,
+            settings,
+            secrets,
+            http_saml_engine,
+            request,
     ):
         self.login = netid
         self.utils = utils
         self.sp_shib_url = sp_shib_url
+        self.sp_domain = sp_domain
         self.log_in_netid = log_in_netid
         self.enter_duo_passcode = enter_duo_passcode
+        self.attribute_mode = settings.test_options.attribute_mode
+        self.fan_out_concurrency = settings.test_options.attribute_fan_out_concurrency
+        self.http_saml_engine = http_saml_engine
+        self._password = secrets.test_accounts.password.get_secret_value()
+        self._request = request
+        self._attribute_cache = {}
 
         self.idp_env = ''
         if test_env == "eval":
             self.idp_env = ":eval"
 
+    @property
+    def fresh_browser(self) -> BrowserRecorder:
+        # Only leased when it is first used, so that tests running in HTTP mode never need a browser.
+        return self._request.getfixturevalue('fresh_browser')
+
+    def _uses_browser(self, assert_success: Optional[bool] = None) -> bool:
+        # assert_success=False means the sign-in goes on to Duo, which needs a browser.
+        return self.attribute_mode == AttributeMode.browser.value or assert_success is False
+
     def _parse_line(self, line):
         parts = line.split('= ', maxsplit=1)
         if len(parts) == 1:
             parts.append('')
         return tuple(map(lambda p: p.strip(), parts))
 
-    def _get_attribute_data(self, url, new_browser: Optional[BrowserRecorder] = None) -> Dict[str, str]:
+    def _get_attribute_data(self, url, new_browser: Optional[BrowserRecorder] = None) -> AttributeData:
         if new_browser is not None:
             browser = new_browser
         else:
             browser = self.fresh_browser
 
         browser.get(f'{url}/server-vars.aspx')
-        content: List[str] = list(
-            filter(bool, browser.wait_for_tag('pre', 'cn').text.split("\n"))
-        )
+        if not isinstance(browser, DomWaitMixin) or DOM_WAITS.engine is not WaitEngine.observe:
+            return self._parse_attribute_text(browser.wait_for(ATTRIBUTE_DATA_LOCATOR).text)
+        # Waits for the attribute data and reads it in a single command.
+        with browser.wrap_exception(ATTRIBUTE_DATA_LOCATOR.description):
+            text = DOM_WAITS.observe(browser, page_lookup(ATTRIBUTE_DATA_LOCATOR), VISIBLE,
+                                     browser.default_wait, return_text=True)
+        if browser.autocapture:
+            browser.snap(caption=f'Wait for {ATTRIBUTE_DATA_LOCATOR.description}')
+        return self._parse_attribute_text(text)
+
+    def _get_attribute_data_http(self, test_sp, url, test_netid,
+                                 client: Optional[HttpSamlClient] = None) -> AttributeData:
+        client = client or self.http_saml_engine.new_client()
+        page = client.log_in(url, test_netid, self._password)
+        expected_heading = f'{self.sp_domain(test_sp)} sign-in success!'
+        assert expected_heading in page.headings, f'Expected "{expected_heading}" at {page.url}, got {page.headings}'
+        page = client.get(f'{url}/server-vars.aspx')
+        text = next((block for block in page.pre_blocks if 'cn' in block), None)
+        assert text is not None, f'No attribute data found at {page.url}'
+        return self._parse_attribute_text(text)
 
-        attribute_data = {  # Key-value dict of all attributes...
-            k.strip(): v.strip() for k, v in map(self._parse_line, content)
-        }
+    def _parse_attribute_text(self, text: str) -> AttributeData:
+        content: List[str] = list(filter(bool, text.split("\n")))
+
+        attribute_data = AttributeData(  # Key-value dict of all attributes...
+            (k.strip(), v.strip()) for k, v in map(self._parse_line, content)
+        )
         logging.debug(f"Parsed attribute data: {json.dumps(attribute_data, indent=4)}")
         return attribute_data
 
-    def _find_attributes(self, test_sp, test_netid, test_attributes, new_browser: Optional = None, assert_success: Optional[bool] = None, undefined_order_keys: Optional = None):
+    def _find_attributes(self, test_sp, test_netid, test_attributes, new_browser: Optional = None, assert_success: Optional[bool] = None, undefined_order_keys: Optional = None,
+                         http_client: Optional[HttpSamlClient] = None):
         """
         For test_attributes, a string type means there is only one attribute to check,
-        anything else is treated like one or more attributes to check
+        anything else is treated like one or more attributes to check.
+        In HTTP mode, `http_client` is the session to sign in with; by default, a new one.
         """
-        if new_browser is not None:
-            browser = new_browser
-        else:
-            browser = self.fresh_browser
-
         with self.utils.using_test_sp(test_sp):
-            browser.set_window_size(1024, 768)
             # go to url to check saml properties
             # https://diafineX.sandbox.iam.s.uw.edu/shib{test_env}/server-vars.aspx
             url = self.sp_shib_url(test_sp)
-            browser.get(url)
+            if self._uses_browser(assert_success):
+                browser = new_browser if new_browser is not None else self.fresh_browser
+                cache_key = (test_sp, test_netid, browser.session_id)
+                actual_data = self._attribute_cache.get(cache_key)
+                if actual_data is None:
+                    browser.set_window_size(1024, 768)
+                    browser.get(url)
 
-            self.log_in_netid(browser, test_netid, assert_success=assert_success)
-            if assert_success is False:
-                self.enter_duo_passcode(browser, match_service_provider=test_sp)
+                    self.log_in_netid(browser, test_netid, assert_success=assert_success)
+                    if assert_success is False:
+                        self.enter_duo_passcode(browser, match_service_provider=test_sp)
+                    actual_data = self._attribute_cache[cache_key] = self._get_attribute_data(url, browser)
+            else:
+                actual_data = self._get_attribute_data_http(test_sp, url, test_netid, client=http_client)
 
             if isinstance(test_attributes, str):
-                actual_data = self._get_attribute_data(url, browser)
                 key = test_attributes
                 actual = actual_data.get(key)
                 return actual
             else:
-                actual_data = self._get_attribute_data(url, browser)
                 for key, value in test_attributes.items():
                     if undefined_order_keys is not None and key in undefined_order_keys:
                         target_values = set(value.split(';'))
-                        found_values = set(actual_data.get(key, '').split(';'))
+                        found_values = actual_data.values_of(key)
                         assert found_values == target_values, \
                             f'For key {key}, expected values: {target_values} but found {found_values}'
                     else:
                         actual = actual_data.get(key)
                         assert actual == value, f'For key {key}, expected value "{value}" but got "{actual}"'
 
+    def _run_targets(self, get_fresh_browser, targets: List[Tuple[int, AttributeTarget]], results: List[Any]):
+        if not any(self._uses_browser(target.assert_success) for _, target in targets):
+            client = self.http_saml_engine.new_client()
+            for i, target in targets:
+                results[i] = self._find_attributes(target.sp, target.netid, target.attribute,
+                                                   assert_success=target.assert_success, http_client=client)
+            return
+        with get_fresh_browser() as browser, SNAPSHOTS.blame_on_failure(browser):
+            for i, target in targets:
+                results[i] = self._find_attributes(target.sp, target.netid, target.attribute, new_browser=browser,
+                                                   assert_success=target.assert_success)
+
+    def _run_lane(self, get_fresh_browser, lane: List[List[Tuple[int, AttributeTarget]]], results: List[Any]):
+        for targets in lane:
+            self._run_targets(get_fresh_browser, targets, results)
+
+    def _fan_out(self, get_fresh_browser, *targets: AttributeTarget) -> List[Any]:
+        """
+        Reads attributes for all the targets at once, each group of targets in its own browser (or
+        HTTP session), and returns what `_find_attributes` returned for each target, in order. At
+        most `--attribute-fan-out-concurrency` browsers are used at the same time.
+
+        Groups that go through Duo run one after the other for the same netid, because Duo keeps
+        state per account (see tests/account_leases.py); the rest run alongside them.
+        """
+        groups: List[List[Tuple[int, AttributeTarget]]] = []
+        shared: Dict[str, List[Tuple[int, AttributeTarget]]] = {}
+        for i, target in enumerate(targets):
+            if target.isolated:
+                groups.append([(i, target)])
+            elif target.netid in shared:
+                shared[target.netid].append((i, target))
+            else:
+                shared[target.netid] = [(i, target)]
+                groups.append(shared[target.netid])
+        lanes: List[List[List[Tuple[int, AttributeTarget]]]] = []
+        duo_lanes: Dict[str, List[List[Tuple[int, AttributeTarget]]]] = {}
+        for group in groups:
+            duo_netid = next((target.netid for _, target in group if target.assert_success is False), None)
+            if duo_netid is None:
+                lanes.append([group])
+            elif duo_netid in duo_lanes:
+                duo_lanes[duo_netid].append(group)
+            else:
+                duo_lanes[duo_netid] = [group]
+                lanes.append(duo_lanes[duo_netid])
+        results: List[Any] = [None] * len(targets)
+        with ThreadPoolExecutor(max_workers=max(1, min(len(lanes), self.fan_out_concurrency)),
+                                thread_name_prefix='attribute-fan-out') as executor:
+            futures = [executor.submit(self._run_lane, get_fresh_browser, lane, results) for lane in lanes]
+            for future in futures:
+                future.result()
+        return results
@@ -8,8 +8,6 @@ NID-3 thru NID-5.
 
 from tests.attributes import AttributeReleaseTestBase
 
-import pytest
-
 from tests.models import ServiceProviderInstance
 from webdriver_recorder.browser import Chrome
 
@@ -17,10 +15,6 @@ from webdriver_recorder.browser import Chrome
 class TestAttributes(AttributeReleaseTestBase):
     browser: Chrome
 
-    @pytest.fixture(autouse=True)
-    def initialize(self, fresh_browser):
-        self.fresh_browser = fresh_browser
-
     def test_nameid_eppn_attributes(self):
         sp = ServiceProviderInstance.diafine8
 
@@ -5,25 +5,14 @@ https://wiki.cac.washington.edu/display/SMW/IAM+Team+Wiki
 
 NID-1 thru NID-2.
 """
-from typing import Optional
-
 from tests.models import ServiceProviderInstance
 from webdriver_recorder.browser import Chrome
-from tests.attributes import AttributeReleaseTestBase
+from tests.attributes import AttributeReleaseTestBase, AttributeTarget
 
 
 class TestUniqueAttributes(AttributeReleaseTestBase):
     browser: Chrome
 
-    def check_attribute(self, get_fresh_browser, test_sp, test_netid, attribute_to_test,
-                              assert_success: Optional[bool] = None):
-        with get_fresh_browser() as new_browser:
-            self.attribute_value = self._find_attributes(test_sp, test_netid,
-                                                         attribute_to_test,
-                                                         new_browser=new_browser,
-                                                         assert_success=assert_success)
-            return self.attribute_value
-
     def test_unique_transientid(self, netid, get_fresh_browser):
         """
         NameID release NID-1, transientid unique every time
@@ -31,8 +20,11 @@ class TestUniqueAttributes(AttributeReleaseTestBase):
         sp = ServiceProviderInstance.diafine6
         attribute_to_test = 'MappingNameID-transient'
 
-        unique_transientid1 = self.check_attribute(get_fresh_browser, sp, netid, attribute_to_test)
-        unique_transientid2 = self.check_attribute(get_fresh_browser, sp, netid, attribute_to_test)
+        unique_transientid1, unique_transientid2 = self._fan_out(
+            get_fresh_browser,
+            AttributeTarget(sp, netid, attribute_to_test, isolated=True),
+            AttributeTarget(sp, netid, attribute_to_test, isolated=True),
+        )
 
         assert not (unique_transientid1 == unique_transientid2)
 
@@ -44,9 +36,12 @@ class TestUniqueAttributes(AttributeReleaseTestBase):
         sp12 = ServiceProviderInstance.diafine12
         attribute_to_test = 'MappingNameID-persistent'
 
-        persistentid_sp7_1 = self.check_attribute(get_fresh_browser, sp7, netid3, attribute_to_test, assert_success=False)
-        persistentid_sp7_2 = self.check_attribute(get_fresh_browser, sp7, netid3, attribute_to_test, assert_success=False)
-        persistentid_sp12 = self.check_attribute(get_fresh_browser, sp12, netid3, attribute_to_test)
+        persistentid_sp7_1, persistentid_sp7_2, persistentid_sp12 = self._fan_out(
+            get_fresh_browser,
+            AttributeTarget(sp7, netid3, attribute_to_test, assert_success=False, isolated=True),
+            AttributeTarget(sp7, netid3, attribute_to_test, assert_success=False, isolated=True),
+            AttributeTarget(sp12, netid3, attribute_to_test),
+        )
 
         assert (persistentid_sp7_1 == persistentid_sp7_2)
         assert not (persistentid_sp12 == persistentid_sp7_1)
@@ -0,0 +1,478 @@
+"""
+A local stand-in for the EC2 and Route53 calls that the test SP orchestration makes, and for the DNS
+lookups it waits on, so that the orchestration path can be run (and timed; see
+`tests/orchestration_benchmark.py`) without touching AWS.
+
+The stand-in keeps a fleet of instances and the A records of one hosted zone. Everything takes
+time the way it does in AWS, as set by `StandInLatencies`: every call takes a round trip, instances
+take a while to boot (and get a new public IP address each time they do), record changes take a
+while to sync, and the local resolver keeps answering with a record's old address until the new one
+has propagated. Waiters poll, like boto3's do, at their own interval.
+
+Use:
+    stand_in = AwsStandIn(settings.aws_hosted_zone, StandInLatencies(boot_seconds=5))
+    stand_in.add_service_providers(*ServiceProviderInstance)
+    utils = WebTestUtils(settings, secrets, aws_clients=stand_in.clients(),
+                         resolver_factory=stand_in.resolver)
+
+`stand_in.lookup_domain_ip` can be used in place of `helpers.lookup_domain_ip`; `stand_in.calls`
+counts the calls made to each AWS operation, and `stand_in.record_changes` lists the names of the
+records in each change batch.
+"""
+from __future__ import annotations
+
+import itertools
+import math
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import dns.resolver
+from botocore.exceptions import ClientError, WaiterError
+
+from .models import AWSEC2InstanceStateName, HostedZoneSettings, ServiceProviderInstance
+
+# The stand-in's name server has an address from the documentation range (192.0.2.0/24); its instances
+# get theirs from the benchmarking range (198.18.0.0/15).
+NAME_SERVER = 'ns-1.aws-standin.invalid'
+NAME_SERVER_ADDRESS = '192.0.2.53'
+
+_STATE_CODES = {
+    AWSEC2InstanceStateName.PENDING: 0,
+    AWSEC2InstanceStateName.RUNNING: 16,
+    AWSEC2InstanceStateName.SHUTTING_DOWN: 32,
+    AWSEC2InstanceStateName.TERMINATED: 48,
+    AWSEC2InstanceStateName.STOPPING: 64,
+    AWSEC2InstanceStateName.STOPPED: 80,
+}
+
+
+class StandInLatencies:
+    """
+    How long things take, in seconds. The defaults are much shorter than in AWS (where instances take
+    30-60s to boot, and boto3's waiters poll every 15s for EC2 and every 30s for Route53), so that a
+    benchmark finishes quickly; only their proportions are realistic.
+    """
+    def __init__(self, api_seconds: float = 0.05, boot_seconds: float = 4.0, stop_seconds: float = 2.0,
+                 change_sync_seconds: float = 2.0, propagation_seconds: float = 3.0,
+                 ec2_waiter_seconds: float = 1.0, route53_waiter_seconds: float = 2.0):
+        self.api_seconds = api_seconds
+        self.boot_seconds = boot_seconds
+        self.stop_seconds = stop_seconds
+        self.change_sync_seconds = change_sync_seconds
+        self.propagation_seconds = propagation_seconds
+        self.ec2_waiter_seconds = ec2_waiter_seconds
+        self.route53_waiter_seconds = route53_waiter_seconds
+
+
+class _Instance:
+    def __init__(self, instance_id: str, tags: Dict[str, str], state: AWSEC2InstanceStateName,
+                 public_ip: Optional[str]):
+        self.instance_id = instance_id
+        self.tags = tags
+        self._state = state
+        self._next_state: Optional[AWSEC2InstanceStateName] = None
+        self._transition_at = 0.0
+        self._public_ip = public_ip
+
+    def state(self, now: float) -> AWSEC2InstanceStateName:
+        if self._next_state and now >= self._transition_at:
+            self._state, self._next_state = self._next_state, None
+        return self._state
+
+    def public_ip(self, now: float) -> Optional[str]:
+        return self._public_ip if self.state(now) == AWSEC2InstanceStateName.RUNNING else None
+
+    def transition(self, now: float, via: AWSEC2InstanceStateName, to: AWSEC2InstanceStateName, seconds: float,
+                   public_ip: Optional[str] = None):
+        self._state, self._next_state, self._transition_at = via, to, now + seconds
+        if public_ip:
+            self._public_ip = public_ip
+
+
+class _Record:
+    """An A record, as the zone's name servers and the local resolver see it."""
+    def __init__(self, name: str, value: str, ttl: int):
+        self.name = name
+        self.ttl = ttl
+        self._value = value
+        self._previous: Optional[str] = None
+        self._synced_at = 0.0
+        self._propagated_at = 0.0
+
+    def update(self, value: str, ttl: int, synced_at: float, propagated_at: float):
+        self._previous, self._value = self._value, value
+        self.ttl = ttl
+        self._synced_at, self._propagated_at = synced_at, propagated_at
+
+    def value(self, now: float) -> Optional[str]:
+        """The value the zone's name servers answer with."""
+        return self._value if now >= self._synced_at else self._previous
+
+    def local_answer(self, now: float) -> Tuple[Optional[str], int]:
+        """(The value the local resolver answers with, how long until it changes, or its TTL)."""
+        if now >= self._propagated_at:
+            return self._value, self.ttl
+        return self._previous, max(0, min(self.ttl, math.ceil(self._propagated_at - now)))
+
+
+class _Answer(list):
+    """Looks enough like a dnspython answer for `tests/dns_propagation.py`."""
+    def __init__(self, records: List[Any], ttl: int):
+        super().__init__(records)
+        self.rrset = type('RRset', (), {'ttl': ttl})()
+
+
+class _A:
+    def __init__(self, address: str):
+        self.address = address
+
+
+class _NS:
+    def __init__(self, target: str):
+        self.target = target
+
+
+class AwsStandIn:
+    def __init__(self, hosted_zone: HostedZoneSettings, latencies: Optional[StandInLatencies] = None,
+                 describe_page_size: Optional[int] = None):
+        """
+        :param describe_page_size: If set, `describe_instances` returns at most this many instances
+            at a time (with a NextToken), even if MaxResults is larger or wasn't given.
+        """
+        self.zone = hosted_zone
+        self.latencies = latencies or StandInLatencies()
+        self.describe_page_size = describe_page_size
+        self.calls = Counter()
+        self.record_changes: List[List[str]] = []
+        self._lock = threading.RLock()
+        self._instances: Dict[str, _Instance] = {}
+        self._records: Dict[str, _Record] = {}
+        self._changes: Dict[str, float] = {}
+        self._ids = itertools.count(1)
+        self._addresses = itertools.count(1)
+
+    def _call(self, operation: str):
+        self.calls[operation] += 1
+        time.sleep(self.latencies.api_seconds)
+
+    def _new_address(self) -> str:
+        n = next(self._addresses)
+        return f'198.{18 + n // 65024 % 2}.{n // 254 % 256}.{n % 254 + 1}'
+
+    def _domain(self, name: str) -> str:
+        return str(name).rstrip('.').lower()
+
+    def add_instance(self, tags: Dict[str, str],
+                     state: AWSEC2InstanceStateName = AWSEC2InstanceStateName.STOPPED) -> str:
+        with self._lock:
+            instance_id = f'i-{next(self._ids):017x}'
+            public_ip = self._new_address() if state == AWSEC2InstanceStateName.RUNNING else None
+            self._instances[instance_id] = _Instance(instance_id, dict(tags), state, public_ip)
+            return instance_id
+
+    def add_service_providers(self, *service_providers: ServiceProviderInstance,
+                              state: AWSEC2InstanceStateName = AWSEC2InstanceStateName.STOPPED,
+                              dns_up_to_date: bool = False, use_case: str = 'idp-web-tests',
+                              replicas: int = 1):
+        """
+        Adds an instance for each service provider, tagged the way `docs/test-service-providers.md`
+        describes, and its A record. Unless dns_up_to_date, the record has an old address. With
+        replicas > 1, the SP gets more instances with the same tags (the record is for the first).
+        """
+        now = time.monotonic()
+        for sp in service_providers:
+            instance_id = self.add_instance({'use_case': use_case, 'test_ref': sp.value}, state)
+            for _ in range(replicas - 1):
+                self.add_instance({'use_case': use_case, 'test_ref': sp.value}, state)
+            address = self._instances[instance_id].public_ip(now) if dns_up_to_date else None
+            domain = f'{sp.value}.{self._domain(self.zone.name)}'
+            self._records[domain] = _Record(domain, address or self._new_address(), 60)
+
+    def clients(self) -> Dict[str, Any]:
+        """The `aws_clients` for ServiceProviderAWSOperations (or WebTestUtils)."""
+        return {'ec2': StandInEC2Client(self), 'route53': StandInRoute53Client(self)}
+
+    # EC2
+
+    def _matches(self, instance: _Instance, filters: List[Dict[str, Any]], now: float) -> bool:
+        for f in filters:
+            name, values = f['Name'], [str(v) for v in f.get('Values', [])]
+            if name.startswith('tag:'):
+                actual = [instance.tags.get(name[len('tag:'):])]
+            elif name == 'tag-key':
+                actual = list(instance.tags.keys())
+            elif name == 'tag-value':
+                actual = list(instance.tags.values())
+            elif name == 'instance-state-name':
+                actual = [instance.state(now).value]
+            elif name == 'instance-id':
+                actual = [instance.instance_id]
+            else:
+                raise NotImplementedError(f"The AWS stand-in does not support the {name} filter")
+            if not any(value in values for value in actual):
+                return False
+        return True
+
+    def describe_instances(self, Filters: Optional[List[Dict]] = None, InstanceIds: Optional[List[str]] = None,
+                           MaxResults: Optional[int] = None, NextToken: Optional[str] = None,
+                           DryRun: bool = False) -> Dict[str, Any]:
+        self._call('ec2.describe_instances')
+        self._check_dry_run('DescribeInstances', DryRun)
+        with self._lock:
+            now = time.monotonic()
+            self._check_instance_ids('DescribeInstances', InstanceIds or [])
+            instances = [
+                instance for instance in self._instances.values()
+                if (not InstanceIds or instance.instance_id in InstanceIds)
+                and self._matches(instance, Filters or [], now)
+            ]
+            start = int(NextToken or 0)
+            page_size = min(size for size in (MaxResults, self.describe_page_size, len(instances) or 1) if size)
+            page = instances[start:start + page_size]
+            response = {'Reservations': [
+                # As in EC2, each instance launched on its own is in its own reservation.
+                {'ReservationId': f'r-{instance.instance_id[2:]}', 'Instances': [self._describe(instance, now)]}
+                for instance in page
+            ]}
+            if start + page_size < len(instances):
+                response['NextToken'] = str(start + page_size)
+            return response
+
+    @staticmethod
+    def _describe(instance: _Instance, now: float) -> Dict[str, Any]:
+        state = instance.state(now)
+        described = {
+            'InstanceId': instance.instance_id,
+            'InstanceType': 't3.micro',
+            'State': {'Code': _STATE_CODES[state], 'Name': state.value},
+            'Tags': [{'Key': key, 'Value': value} for key, value in instance.tags.items()],
+        }
+        if instance.public_ip(now):
+            described['PublicIpAddress'] = instance.public_ip(now)
+        return described
+
+    @staticmethod
+    def _check_dry_run(operation: str, dry_run: bool):
+        if dry_run:
+            raise ClientError({'Error': {'Code': 'DryRunOperation',
+                                         'Message': 'Request would have succeeded, but DryRun flag is set.'}},
+                              operation)
+
+    def _check_instance_ids(self, operation: str, instance_ids: List[str]):
+        unknown = [i for i in instance_ids if i not in self._instances]
+        if unknown:
+            raise ClientError({'Error': {'Code': 'InvalidInstanceID.NotFound',
+                                         'Message': f"The instance IDs '{', '.join(unknown)}' do not exist"}},
+                              operation)
+
+    def _lifecycle(self, operation: str, instance_ids: List[str], dry_run: bool,
+                   from_state: AWSEC2InstanceStateName, via: AWSEC2InstanceStateName,
+                   to: AWSEC2InstanceStateName, seconds: float) -> List[Dict]:
+        self._call(f'ec2.{operation}')
+        with self._lock:
+            self._check_instance_ids(operation, instance_ids)
+            self._check_dry_run(operation, dry_run)
+            now = time.monotonic()
+            changes = []
+            for instance_id in instance_ids:
+                instance = self._instances[instance_id]
+                previous = instance.state(now)
+                if previous == from_state:
+                    instance.transition(now, via, to, seconds,
+                                        public_ip=self._new_address() if to == AWSEC2InstanceStateName.RUNNING
+                                        else None)
+                changes.append({
+                    'InstanceId': instance_id,
+                    'CurrentState': {'Code': _STATE_CODES[instance.state(now)], 'Name': instance.state(now).value},
+                    'PreviousState': {'Code': _STATE_CODES[previous], 'Name': previous.value},
+                })
+            return changes
+
+    def start_instances(self, InstanceIds: List[str], DryRun: bool = False, **_) -> Dict[str, Any]:
+        return {'StartingInstances': self._lifecycle(
+            'StartInstances', InstanceIds, DryRun, AWSEC2InstanceStateName.STOPPED,
+            AWSEC2InstanceStateName.PENDING, AWSEC2InstanceStateName.RUNNING, self.latencies.boot_seconds)}
+
+    def stop_instances(self, InstanceIds: List[str], DryRun: bool = False, **_) -> Dict[str, Any]:
+        return {'StoppingInstances': self._lifecycle(
+            'StopInstances', InstanceIds, DryRun, AWSEC2InstanceStateName.RUNNING,
+            AWSEC2InstanceStateName.STOPPING, AWSEC2InstanceStateName.STOPPED, self.latencies.stop_seconds)}
+
+    def instance_states(self, instance_ids: List[str]) -> List[AWSEC2InstanceStateName]:
+        with self._lock:
+            now = time.monotonic()
+            return [self._instances[i].state(now) for i in instance_ids]
+
+    # Route53
+
+    @staticmethod
+    def _sort_key(name: str, record_type: str = '') -> Tuple:
+        # Route53 lists records in the order of their names' labels, reversed (i.e., by zone, then subdomain).
+        return tuple(reversed(name.split('.'))), record_type
+
+    def _check_zone(self, operation: str, zone_id: str):
+        if zone_id.split('/')[-1] != self.zone.id:
+            raise ClientError({'Error': {'Code': 'NoSuchHostedZone', 'Message': f'No hosted zone found with ID: '
+                                                                               f'{zone_id}'}}, operation)
+
+    def list_resource_record_sets(self, HostedZoneId: str, StartRecordName: Optional[str] = None,
+                                  StartRecordType: Optional[str] = None, MaxItems: Optional[str] = None,
+                                  **_) -> Dict[str, Any]:
+        self._call('route53.list_resource_record_sets')
+        self._check_zone('ListResourceRecordSets', HostedZoneId)
+        max_items = int(MaxItems or 300)
+        with self._lock:
+            now = time.monotonic()
+            records = sorted(self._records.values(), key=lambda r: self._sort_key(r.name, 'A'))
+            if StartRecordName:
+                start = self._sort_key(self._domain(StartRecordName), StartRecordType or '')
+                records = [r for r in records if self._sort_key(r.name, 'A') >= start]
+            page = [
+                {'Name': f'{r.name}.', 'Type': 'A', 'TTL': r.ttl, 'ResourceRecords': [{'Value': r.value(now)}]}
+                for r in records[:max_items]
+            ]
+        response = {'ResourceRecordSets': page, 'IsTruncated': len(records) > max_items, 'MaxItems': str(max_items)}
+        if len(records) > max_items:
+            response['NextRecordName'] = f'{records[max_items].name}.'
+            response['NextRecordType'] = 'A'
+        return response
+
+    def change_resource_record_sets(self, HostedZoneId: str, ChangeBatch: Dict[str, Any]) -> Dict[str, Any]:
+        self._call('route53.change_resource_record_sets')
+        self._check_zone('ChangeResourceRecordSets', HostedZoneId)
+        with self._lock:
+            now = time.monotonic()
+            synced_at = now + self.latencies.change_sync_seconds
+            for change in ChangeBatch['Changes']:
+                if change['Action'] != 'UPSERT' or change['ResourceRecordSet'].get('Type', 'A') != 'A':
+                    raise NotImplementedError("The AWS stand-in only supports upserting A records")
+                record_set = change['ResourceRecordSet']
+                domain = self._domain(record_set['Name'])
+                value = record_set['ResourceRecords'][0]['Value']
+                ttl = int(record_set.get('TTL', 300))
+                if domain not in self._records:
+                    self._records[domain] = _Record(domain, value, ttl)
+                self._records[domain].update(value, ttl, synced_at,
+                                             synced_at + self.latencies.propagation_seconds)
+            self.record_changes.append([self._domain(c['ResourceRecordSet']['Name']) for c in ChangeBatch['Changes']])
+            change_id = f'/change/C{next(self._ids):013X}'
+            self._changes[change_id] = synced_at
+        return {'ChangeInfo': {'Id': change_id, 'Status': 'PENDING'}}
+
+    def change_is_synced(self, change_id: str) -> bool:
+        with self._lock:
+            return time.monotonic() >= self._changes[change_id]
+
+    # DNS
+
+    def resolver(self, nameservers: Optional[List[str]] = None) -> StandInResolver:
+        """A `resolver_factory` for tests/dns_propagation.py."""
+        return StandInResolver(self, authoritative=bool(nameservers))
+
+    def lookup_domain_ip(self, domain: str) -> Optional[str]:
+        """Like helpers.lookup_domain_ip, but for the stand-in's records."""
+        with self._lock:
+            record = self._records.get(self._domain(domain))
+            return record.local_answer(time.monotonic())[0] if record else None
+
+    def resolve(self, domain: str, record_type: str, authoritative: bool) -> _Answer:
+        domain = self._domain(domain)
+        with self._lock:
+            now = time.monotonic()
+            if record_type == 'NS' and domain == self._domain(self.zone.name):
+                return _Answer([_NS(f'{NAME_SERVER}.')], 172800)
+            if record_type == 'A' and domain == NAME_SERVER:
+                return _Answer([_A(NAME_SERVER_ADDRESS)], 172800)
+            record = self._records.get(domain)
+            if record_type != 'A' or not record:
+                raise dns.resolver.NXDOMAIN()
+            value, ttl = (record.value(now), record.ttl) if authoritative else record.local_answer(now)
+            if not value:
+                raise dns.resolver.NXDOMAIN()
+            return _Answer([_A(value)], ttl)
+
+
+class StandInResolver:
+    """Answers like the zone's name servers (if authoritative) or the local resolver."""
+    def __init__(self, stand_in: AwsStandIn, authoritative: bool):
+        self._stand_in = stand_in
+        self._authoritative = authoritative
+
+    async def resolve(self, qname, rdtype='A', lifetime: Optional[float] = None) -> _Answer:
+        return self._stand_in.resolve(str(qname), str(rdtype), self._authoritative)
+
+
+class _Waiter:
+    def __init__(self, name: str, delay: float, done):
+        self._name = name
+        self._delay = delay
+        self._done = done
+
+    def wait(self, WaiterConfig: Optional[Dict[str, Any]] = None, **kwargs):
+        config = WaiterConfig or {}
+        delay = config.get('Delay', self._delay)
+        for _ in range(config.get('MaxAttempts', 40)):
+            if self._done(**kwargs):
+                return
+            time.sleep(delay)
+        raise WaiterError(self._name, 'Max attempts exceeded', {})
+
+
+class _Paginator:
+    def __init__(self, stand_in: AwsStandIn):
+        self._stand_in = stand_in
+
+    def paginate(self, HostedZoneId: str, **kwargs) -> Iterator[Dict[str, Any]]:
+        while True:
+            page = self._stand_in.list_resource_record_sets(HostedZoneId, **kwargs)
+            yield page
+            if not page['IsTruncated']:
+                return
+            kwargs['StartRecordName'], kwargs['StartRecordType'] = page['NextRecordName'], page['NextRecordType']
+
+
+class StandInEC2Client:
+    """The EC2 client methods that ServiceProviderAWSOperations uses."""
+    def __init__(self, stand_in: AwsStandIn):
+        self._stand_in = stand_in
+        self.describe_instances = stand_in.describe_instances
+        self.start_instances = stand_in.start_instances
+        self.stop_instances = stand_in.stop_instances
+
+    def _in_state(self, state: AWSEC2InstanceStateName):
+        def done(InstanceIds: List[str]) -> bool:
+            self._stand_in.describe_instances(InstanceIds=InstanceIds)
+            return all(s == state for s in self._stand_in.instance_states(InstanceIds))
+        return done
+
+    def get_waiter(self, name: str) -> _Waiter:
+        states = {'instance_running': AWSEC2InstanceStateName.RUNNING,
+                  'instance_stopped': AWSEC2InstanceStateName.STOPPED}
+        if name not in states:
+            raise NotImplementedError(f"The AWS stand-in does not support the {name} waiter")
+        return _Waiter(name, self._stand_in.latencies.ec2_waiter_seconds, self._in_state(states[name]))
+
+
+class StandInRoute53Client:
+    """The Route53 client methods that ServiceProviderAWSOperations uses."""
+    def __init__(self, stand_in: AwsStandIn):
+        self._stand_in = stand_in
+        self.list_resource_record_sets = stand_in.list_resource_record_sets
+        self.change_resource_record_sets = stand_in.change_resource_record_sets
+
+    def _change_synced(self, Id: str) -> bool:
+        self._stand_in.calls['route53.get_change'] += 1
+        time.sleep(self._stand_in.latencies.api_seconds)
+        return self._stand_in.change_is_synced(Id)
+
+    def get_paginator(self, name: str) -> _Paginator:
+        if name != 'list_resource_record_sets':
+            raise NotImplementedError(f"The AWS stand-in does not support the {name} paginator")
+        return _Paginator(self._stand_in)
+
+    def get_waiter(self, name: str) -> _Waiter:
+        if name != 'resource_record_sets_changed':
+            raise NotImplementedError(f"The AWS stand-in does not support the {name} waiter")
+        return _Waiter(name, self._stand_in.latencies.route53_waiter_seconds, self._change_synced)
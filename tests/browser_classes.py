@@ -0,0 +1,20 @@
+"""
+Builds the browser classes that `get_fresh_browser` uses: the browser class (e.g., Chrome or
+Remote) with the suite's mixins (the wait engine, the screenshot policy, ...) in front of it.
+"""
+from typing import Dict, Tuple, Type
+
+from webdriver_recorder.browser import BrowserRecorder
+
+_classes: Dict[Tuple[type, ...], type] = {}
+
+
+def compose_browser_class(browser_cls: Type[BrowserRecorder], *mixins: type) -> Type[BrowserRecorder]:
+    """
+    Returns a subclass of the browser class with the mixins in front of it, first one first in
+    the method resolution order. The same arguments always return the same class.
+    """
+    key = (browser_cls, *mixins)
+    if key not in _classes:
+        _classes[key] = type(browser_cls.__name__, (*mixins, browser_cls), {})
+    return _classes[key]
@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Set
+from urllib.parse import urlsplit
+
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.remote.command import Command
+from webdriver_recorder.browser import BrowserRecorder
+
+from .grid_admission import GRID_ADMISSION
+from .metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# How often the pool checks whether anyone is waiting for a grid slot that one of its idle sessions holds.
+GRID_WAITER_POLL_SECONDS = 1.0
+
+
+def execute_cdp_command(browser: BrowserRecorder, command: str, params: Optional[dict] = None):
+    """
+    Runs a Chrome DevTools Protocol command. Local Chrome instances support this natively;
+    Remote instances don't expose it in selenium, but the grid will still forward
+    the chromedriver endpoint if we tell the executor about it.
+    """
+    params = params or {}
+    if hasattr(browser, 'execute_cdp_cmd'):
+        return browser.execute_cdp_cmd(command, params)
+    commands = browser.command_executor._commands
+    if 'executeCdpCommand' not in commands:
+        commands['executeCdpCommand'] = ('POST', '/session/$sessionId/goog/cdp/execute')
+    return browser.execute('executeCdpCommand', {'cmd': command, 'params': params})['value']
+
+
+def _origin(url: str) -> Optional[str]:
+    parts = urlsplit(url)
+    return f'{parts.scheme}://{parts.netloc}' if parts.scheme in ('http', 'https') and parts.netloc else None
+
+
+class VisitedOriginsMixin:
+    """
+    Remembers the origins the browser was sent to with `get`, so that a reset without devtools
+    only has to visit those. Origins reached by redirects (e.g., Duo's) must be added with
+    `record_current_origin`.
+    """
+    def execute(self, driver_command, params=None):
+        if driver_command == Command.GET and params:
+            origin = _origin(params.get('url', ''))
+            if origin:
+                self.visited_origins.add(origin)
+        return super().execute(driver_command, params)
+
+    @property
+    def visited_origins(self) -> Set[str]:
+        if '_visited_origins' not in self.__dict__:
+            self._visited_origins = set()
+        return self._visited_origins
+
+
+def record_current_origin(browser: BrowserRecorder):
+    """Adds the origin of the page the browser is on (e.g., the Duo prompt) to those its reset clears."""
+    origin = _origin(browser.current_url)
+    if origin and isinstance(browser, VisitedOriginsMixin):
+        browser.visited_origins.add(origin)
+
+
+class BrowserPool:
+    """
+    Keeps warm browser sessions around so that tests don't have to pay for creating
+    (and quitting) a new session every time they need a clean browser. Between leases, each
+    session is reset: extra tabs are closed, cookies are cleared, storage is cleared for the given
+    origins and for every origin the session visited (including Duo's, so that no Duo state
+    carries over to the next test), and the window is restored to its default size.
+
+    At most `max_size` idle sessions are kept. If more sessions are leased at once than that,
+    the extras are created on demand and quit when they are returned. Sessions are
+    recycled after `max_leases` uses, as soon as they fail a health check, or when `is_stale`
+    says they were created with settings that no longer apply.
+
+    Each session holds a selenium grid slot (see tests/grid_admission.py). While the pool has idle
+    sessions, a background thread checks whether anyone in the run is waiting for a slot, and if so,
+    quits the idle sessions to free theirs.
+    """
+    def __init__(self,
+                 build_browser: Callable[[], BrowserRecorder],
+                 max_size: int,
+                 max_leases: int,
+                 origins: List[str],
+                 is_stale: Optional[Callable[[BrowserRecorder], bool]] = None):
+        self._build_browser = build_browser
+        self._is_stale = is_stale
+        self._max_size = max_size
+        self._max_leases = max_leases
+        self._origins = origins
+        self._idle: List[BrowserRecorder] = []
+        self._lease_counts = {}
+        self._lock = threading.Lock()
+        self.create_times: List[float] = []
+        self.reset_times: List[float] = []
+        self.num_recycled = 0
+        self._closed = threading.Event()
+        self._waiter_watch: Optional[threading.Thread] = None
+
+    @contextmanager
+    def lease(self) -> BrowserRecorder:
+        browser = self._acquire()
+        try:
+            yield browser
+        finally:
+            self._release(browser)
+
+    def _create(self) -> BrowserRecorder:
+        start = time.perf_counter()
+        browser = self._build_browser()
+        elapsed = time.perf_counter() - start
+        METRICS.record('browser_pool.create_seconds', elapsed)
+        with self._lock:
+            self.create_times.append(elapsed)
+            self._lease_counts[browser.session_id] = 0
+        return browser
+
+    def _acquire(self) -> BrowserRecorder:
+        while True:
+            with self._lock:
+                browser = self._idle.pop() if self._idle else None
+            if browser is None:
+                return self._create()
+            if self._is_stale and self._is_stale(browser):
+                logger.info(f"Discarding stale browser session {browser.session_id}")
+                with self._lock:
+                    self.num_recycled += 1
+            elif self.is_healthy(browser):
+                return browser
+            else:
+                logger.info(f"Discarding unhealthy browser session {browser.session_id}")
+            self._quit(browser)
+
+    def _release(self, browser: BrowserRecorder):
+        session_id = browser.session_id
+        # Don't keep an idle session on the grid while someone else is waiting for a slot.
+        has_waiters = GRID_ADMISSION.has_waiters()
+        with self._lock:
+            self._lease_counts[session_id] = self._lease_counts.get(session_id, 0) + 1
+            recycle = (len(self._idle) >= self._max_size or self._lease_counts[session_id] >= self._max_leases
+                       or has_waiters)
+            if recycle:
+                self.num_recycled += 1
+        if recycle:
+            self._quit(browser)
+            return
+        try:
+            with METRICS.timer('browser_pool.reset_seconds'):
+                start = time.perf_counter()
+                self.reset(browser)
+                elapsed = time.perf_counter() - start
+            with self._lock:
+                self.reset_times.append(elapsed)
+        except WebDriverException as e:
+            logger.info(f"Could not reset browser session {session_id}, it will not be reused: {e}")
+            self._quit(browser)
+            return
+        with self._lock:
+            self._idle.append(browser)
+            if GRID_ADMISSION.enabled and self._waiter_watch is None:
+                self._waiter_watch = threading.Thread(target=self._watch_grid_waiters, name='browser-pool-watch',
+                                                      daemon=True)
+                self._waiter_watch.start()
+
+    def _watch_grid_waiters(self):
+        while not self._closed.wait(GRID_WAITER_POLL_SECONDS):
+            try:
+                if self._idle and GRID_ADMISSION.has_waiters():
+                    evicted = self.evict_idle()
+                    if evicted:
+                        logger.info(f"Quit {evicted} idle browser sessions to free their grid slots")
+            except Exception as e:
+                logger.debug(f"Could not check for grid slot waiters: {e}")
+
+    def evict_idle(self) -> int:
+        """Quits the idle sessions (e.g., to give their grid slots to someone who is waiting); returns how many."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self.num_recycled += len(idle)
+        for browser in idle:
+            self._quit(browser)
+        return len(idle)
+
+    @staticmethod
+    def _history_origins(browser: BrowserRecorder) -> Set[str]:
+        """The origins in the current tab's history, including those it was redirected to (e.g., Duo's)."""
+        history = execute_cdp_command(browser, 'Page.getNavigationHistory')
+        return {origin for origin in (_origin(entry['url']) for entry in history['entries']) if origin}
+
+    def reset(self, browser: BrowserRecorder):
+        visited: Set[str] = set(getattr(browser, 'visited_origins', ()))
+        devtools = True
+        handles = browser.window_handles
+        for handle in reversed(handles):
+            browser.switch_to.window(handle)
+            if devtools:
+                try:
+                    visited |= self._history_origins(browser)
+                except WebDriverException:
+                    devtools = False
+            if handle != handles[0]:
+                browser.close()
+        browser.switch_to.window(handles[0])
+        browser.get('about:blank')
+        try:
+            if not devtools:
+                raise WebDriverException('devtools are not available')
+            execute_cdp_command(browser, 'Network.clearBrowserCookies')
+            for origin in sorted(set(self._origins) | visited):
+                execute_cdp_command(browser, 'Storage.clearDataForOrigin',
+                                    {'origin': origin, 'storageTypes': 'all'})
+        except WebDriverException:
+            # Without devtools, we have to visit an origin to clear its data; only the ones this session used.
+            for origin in sorted(visited):
+                browser.get(origin)
+                browser.delete_all_cookies()
+                browser.execute_script('window.localStorage.clear(); window.sessionStorage.clear();')
+            browser.get('about:blank')
+        if isinstance(browser, VisitedOriginsMixin):
+            browser.visited_origins.clear()
+        browser.maximize_window()
+        browser.autocapture = True
+
+    @staticmethod
+    def is_healthy(browser: BrowserRecorder) -> bool:
+        try:
+            return bool(browser.window_handles)
+        except WebDriverException:
+            return False
+
+    def _quit(self, browser: BrowserRecorder):
+        with self._lock:
+            self._lease_counts.pop(browser.session_id, None)
+        try:
+            browser.quit()
+        except WebDriverException as e:
+            logger.debug(f"Ignoring error while quitting browser session: {e}")
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for browser in idle:
+            self._quit(browser)
+        if self.create_times:
+            mean_create = sum(self.create_times) / len(self.create_times)
+            mean_reset = sum(self.reset_times) / len(self.reset_times) if self.reset_times else 0
+            logger.info(
+                f"Browser pool created {len(self.create_times)} sessions (mean {mean_create:.2f}s) "
+                f"and reused sessions {len(self.reset_times)} times (mean reset {mean_reset:.2f}s); "
+                f"{self.num_recycled} sessions were recycled. "
+                f"Estimated time saved: {len(self.reset_times) * (mean_create - mean_reset):.1f}s"
+            )
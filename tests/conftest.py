@@ -4,16 +4,30 @@ import copy
 import logging
 
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from typing import Callable, NoReturn, Optional
 
 import pytest
-from webdriver_recorder.browser import BrowserRecorder, Chrome, Remote
-
-from tests.helpers import Locators, WebTestUtils, load_settings
+from webdriver_recorder.browser import BrowserRecorder, Chrome, Locator, Remote
+
+from tests.account_leases import AccountLeaseManager, schedule_for_concurrency
+from tests.browser_classes import compose_browser_class
+from tests.browser_pool import BrowserPool, VisitedOriginsMixin, record_current_origin
+from tests.dom_waits import DOM_WAITS, DomWaitMixin
+from tests.fixture_profiler import FixtureProfiler
+from tests.grid_admission import GRID_ADMISSION, GridSlotMixin, capacity_report
+from tests.helpers import Locators, WebTestUtils, load_settings, required_service_providers
+from tests.http_saml import HttpSamlEngine
+from tests.metrics import METRICS
 from tests.models import AccountNetid, ServiceProviderInstance, TestOptions, TestSecrets, WebTestSettings
+from tests.report_stream import REPORT_STREAM
+from tests.run_dirs import end_test_run, start_test_run
+from tests.screenshot_store import SCREENSHOT_STORE, ScreenshotStore
 from tests.secret_manager import SecretManager
+from tests.snap_policy import SNAPSHOTS, SnapPolicyMixin
+from tests.sp_bootstrap import ReadyFirstScheduler, ServiceProviderBootstrap, join_test_run_bootstrap
+from tests.sso_sessions import SsoSessionCache
+from tests.tracing import TRACER, TracingPlugin
 
 
 def pytest_addoption(parser):
@@ -28,25 +42,143 @@ def pytest_addoption(parser):
     group.addoption('--lb-sleep-time', default=60,
                     help="The number of seconds to sleep between login attempts when running login request "
                          "generator.")
-
+    group.addoption('--lb-concurrency', default=1, type=int,
+                    help="The number of virtual users the login request generator runs at the same time.")
+    group.addoption('--lb-user-mode', default='browser', choices=['browser', 'http'],
+                    help="Whether each login request generator virtual user signs in with its own browser, "
+                         "or with its own HTTP session.")
+    group.addoption('--lb-idp-hosts', default='',
+                    help="A comma-separated list of IdP nodes (e.g., idp11,idp12, IP addresses, or idp11=<ip>) to "
+                         "spread the login request generator's virtual users across. Results are reported for each "
+                         "node.")
+    group.addoption('--lb-accounts', default='sptest01',
+                    help="A comma-separated list of the test accounts the login request generator's virtual users "
+                         "sign in as, in turn. They must be password-only accounts (no Duo, no CRN selection).")
+    group.addoption('--lb-max-error-rate', default=None, type=float,
+                    help="If set, the login request generator fails if more than this fraction of its login cycles "
+                         "fail.")
+
+    group.addoption('--profile-fixtures', action='store_true', default=False,
+                    help="Time the setup and teardown of every fixture, and summarize the cost at the end of the "
+                         "session. See tests/fixture_profiler.py")
+    group.addoption('--trace-file', default=None,
+                    help="Write trace spans for the session to this file, in the Jaeger JSON format. "
+                         "See tests/tracing.py")
     TestOptions.apply_to_parser(group)
 
 
+def pytest_configure(config):
+    if not hasattr(config, 'workerinput'):
+        start_test_run(config)
+    config.pluginmanager.register(METRICS, 'idp_metrics')
+    config.pluginmanager.register(SNAPSHOTS, 'idp_snapshots')
+    config.pluginmanager.register(SCREENSHOT_STORE, 'idp_screenshot_store')
+    config.pluginmanager.register(REPORT_STREAM, 'idp_report_stream')
+    # Don't hold on to the image data of long-running tests (e.g., test_generate_requests.py) until they end.
+    SNAPSHOTS.on_capture(SCREENSHOT_STORE.add)
+    if not hasattr(config, 'workerinput'):
+        # Screenshots are written as the tests run, so the workers must not clean up after they start.
+        ScreenshotStore.clean(config.getoption('report_dir'))
+    if config.getoption('profile_fixtures'):
+        config.pluginmanager.register(FixtureProfiler(), 'idp_fixture_profiler')
+    if config.getoption('trace_file'):
+        config.pluginmanager.register(TracingPlugin(config.getoption('trace_file')), 'idp_tracing')
+    config.addinivalue_line(
+        'markers', "account_lease(mode): 'exclusive' or 'shared'; overrides the default lease mode "
+                   "for the test's accounts. See tests/account_leases.py")
+    config.addinivalue_line(
+        'markers', "service_providers(*sps): the test service providers a test needs, if they "
+                   "can't be determined from its source.")
+    METRICS.report_per_test('account_lease.wait_seconds', 'sp_gate.wait_seconds', 'snap.count', 'snap.capture_seconds',
+                            'wait.commands', 'grid.queue_wait_seconds')
+
+
+def pytest_unconfigure(config):
+    if not hasattr(config, 'workerinput'):
+        # The workers have all finished by now.
+        end_test_run()
+
+
+def pytest_report_header(config):
+    """Says how many workers the selenium grid (if there is one) can support."""
+    try:
+        selenium_server = settings_from_config(config).test_options.selenium_server
+    except Exception as e:
+        logging.debug(f"Not checking the selenium grid's capacity: {e}")
+        return None
+    if not (selenium_server and selenium_server.strip()):
+        return None
+    num_workers = getattr(config.option, 'numprocesses', None)
+    return capacity_report(selenium_server.strip(), num_workers if isinstance(num_workers, int) else 1)
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_collection_modifyitems(config, items):
+    """
+    Tests in a class that uses 'fresh_class_browser' depend on the state left behind by
+    the tests before them, so they must not be split up when running in parallel
+    (`-n <workers> --dist loadgroup`). This must run before pytest-xdist applies
+    the group names to the test node ids.
+
+    When running in parallel, tests are also reordered so that tests which need
+    the same account to themselves are spread apart.
+    """
+    for item in items:
+        if item.cls and 'fresh_class_browser' in item.fixturenames:
+            item.add_marker(pytest.mark.xdist_group(name=f'{item.module.__name__}.{item.cls.__name__}'))
+
+    worker_input = getattr(config, 'workerinput', None)
+    if worker_input:
+        items[:] = schedule_for_concurrency(items, worker_input['workercount'])
+
+
 @pytest.fixture(scope='session')
 def selenium_server(settings) -> str:
     return settings.test_options.selenium_server
 
 
+def settings_from_config(config) -> WebTestSettings:
+    filename = config.getoption('--settings-file')
+    settings_env = config.getoption('--settings-profile')
+    test_options = TestOptions.parse_overrides(config)
+    return load_settings(filename, settings_env, option_overrides=test_options)
+
+
 @pytest.fixture(scope='session')
 def settings(request) -> WebTestSettings:
-    filename = request.config.getoption('--settings-file')
-    settings_env = request.config.getoption('--settings-profile')
-    test_options = TestOptions.parse_overrides(request.config)
-    settings = load_settings(filename, settings_env, option_overrides=test_options)
+    settings = settings_from_config(request.config)
     logging.debug(f'Derived settings: {settings.dict()}')
     return settings
 
 
+@pytest.fixture(scope='session')
+def clean_screenshots():
+    """Replaces webdriver_recorder's fixture; the old screenshots are removed in pytest_configure instead."""
+
+
+@pytest.fixture(scope='session', autouse=True)
+def screenshot_store(settings, report_dir) -> ScreenshotStore:
+    options = settings.test_options
+    SCREENSHOT_STORE.start(report_dir, options.screenshot_format, options.screenshot_quality, options.screenshot_hash)
+    try:
+        yield SCREENSHOT_STORE
+    finally:
+        SCREENSHOT_STORE.flush()
+
+
+@pytest.fixture(scope='session', autouse=True)
+def report_stream(report_generator, test_report, report_dir, settings, screenshot_store):
+    """
+    Depends on report_generator so that it is torn down first, and on screenshot_store so that
+    results are written after their screenshots are stored.
+    """
+    REPORT_STREAM.start(report_dir, test_report, settings.test_options.report_refresh_seconds)
+    try:
+        yield REPORT_STREAM
+    finally:
+        REPORT_STREAM.finish()
+
+
 @pytest.fixture(scope='session')
 def report_title(settings) -> str:
     return settings.test_options.report_title
@@ -58,21 +190,43 @@ def utils(settings: WebTestSettings, secrets: TestSecrets) -> WebTestUtils:
 
 
 @pytest.fixture(scope='session', autouse=True)
-def manage_test_service_providers(settings, utils):
+def manage_test_service_providers(settings, utils, request):
     if not settings.test_options.skip_test_service_provider_start:
-        logging.info("Starting all test service provider instances.")
-        utils.sp_aws_operations.start_instances()
-        record_sets = utils.sp_aws_operations.record_sets
-        service_providers = utils.sp_aws_operations.service_providers.keys()
+        known_service_providers = utils.sp_aws_operations.service_providers.keys()
+        items = request.session.items
+        required = {item.nodeid: required_service_providers([item]) for item in items}
         service_providers = [
-            sp for sp in service_providers if
-            utils.sp_aws_operations.dns_record_requires_update(record_sets, sp)
+            sp for sp in ServiceProviderInstance
+            if any(sp in sps for sps in required.values()) and sp in known_service_providers
         ]
-        if service_providers:
-            utils.sp_aws_operations.update_instance_a_records(*service_providers)
-            utils.sp_aws_operations.wait_for_ip_propagation(*service_providers)
+        if not service_providers:
+            logging.info("None of the selected tests need a test service provider.")
+            yield
+            return
+        logging.info(f"Starting the {len(service_providers)} of {len(known_service_providers)} test service "
+                     f"providers needed by the selected tests: {', '.join(sp.value for sp in service_providers)}")
+        if hasattr(request.config, 'workerinput'):
+            # Only one worker brings them up, for all of them.
+            bootstrap = join_test_run_bootstrap(utils.sp_aws_operations, service_providers,
+                                                pin_hosts=utils.pins_sp_hosts)
+        else:
+            bootstrap = ServiceProviderBootstrap(utils.sp_aws_operations, service_providers,
+                                                 pin_hosts=utils.pins_sp_hosts)
+            bootstrap.start()
+        utils.sp_bootstrap = bootstrap
+        scheduler = None
+        if not hasattr(request.config, 'workerinput'):
+            # Under xdist, the controller decides what each worker runs next.
+            scheduler = ReadyFirstScheduler(bootstrap, required)
+            request.config.pluginmanager.register(scheduler, 'sp_ready_first_scheduler')
+        yield
+        if scheduler:
+            request.config.pluginmanager.unregister(scheduler)
+        utils.sp_bootstrap = None
+        bootstrap.shutdown()
     else:
         logging.info("Service provider instances will be started as-needed.")
+        yield
 
 
 @pytest.fixture(scope='session')
@@ -81,6 +235,13 @@ def sp_url(utils) -> Callable[[ServiceProviderInstance], str]:
     return utils.service_provider_url
 
 
+@pytest.fixture(scope='session')
+def http_saml_engine(utils) -> HttpSamlEngine:
+    engine = HttpSamlEngine(pins=utils.sp_host_pins if utils.pins_sp_hosts else None)
+    yield engine
+    engine.close()
+
+
 @pytest.fixture(scope='session')
 def sp_domain(utils) -> Callable[[ServiceProviderInstance], str]:
     return utils.service_provider_domain
@@ -124,6 +285,29 @@ def test_env(settings):
     return env
 
 
+@pytest.fixture(scope='session')
+def sso_sessions(settings, test_env) -> SsoSessionCache:
+    """IdP SSO sessions that access control tests have set up, for later tests to reuse."""
+    idp_origin = 'https://idp-eval.u.washington.edu' if test_env == 'eval' else 'https://idp.u.washington.edu'
+    cache = SsoSessionCache(idp_origin, max_age=settings.test_options.sso_session_max_age)
+    try:
+        yield cache
+    finally:
+        cache.close()
+
+
+@pytest.fixture(scope='session')
+def account_leases() -> AccountLeaseManager:
+    return AccountLeaseManager.for_test_run()
+
+
+@pytest.fixture(autouse=True)
+def account_lease(account_leases, request):
+    """Holds the leases on the accounts of the test's `netid*` fixtures while it runs."""
+    with account_leases.hold_for_test(request.node):
+        yield
+
+
 @pytest.fixture
 def netid() -> str:
     return AccountNetid.sptest01.value
@@ -169,12 +353,21 @@ def netid10() -> str:
     return AccountNetid.sptest10.value
 
 
+def wait_for_element(current_browser: Chrome, xpath: str, condition=EC.element_to_be_clickable, timeout: int = 10):
+    """
+    Waits for the element without taking a screenshot (unless it never shows up).
+    See tests/dom_waits.py
+    """
+    with current_browser.autocapture_off():
+        return current_browser.wait_until(Locator(search_method=By.XPATH, search_value=xpath), condition,
+                                          timeout=timeout)
+
+
 def duo_push(current_browser: Chrome):
     """
     Select the other duo option, to get to the bypass code option
     """
-    wait = WebDriverWait(current_browser, 10)
-    wait.until(EC.element_to_be_clickable((By.XPATH, "//a[contains(text(), 'Other options')]")))
+    wait_for_element(current_browser, "//a[contains(text(), 'Other options')]")
     current_browser.wait_for_tag('a', 'Other options').click()
     current_browser.wait_for_tag('b', 'Other options to log in')
 
@@ -240,45 +433,50 @@ def enter_duo_passcode(secrets, sp_domain, test_env) -> Callable[..., NoReturn]:
         if assert_failure is None:
             assert_failure = not passcode_matches_default
 
-        if select_duo_push:
-            duo_push(current_browser)
-
-        wait = WebDriverWait(current_browser, 10)
-        if retry:
-            element = wait.until(EC.element_to_be_clickable((By.XPATH,
-                                                             "//input[contains(@id, 'passcode-input')]")))
-        else:
-            element = wait.until(EC.visibility_of_element_located((By.XPATH,
-                                                                   "//div[contains(text(), 'Bypass code') and "
-                                                                   "contains(@class, 'row') and contains(@class, "
-                                                                   "'display-flex')]")))
-
-        current_browser.snap()
-        element.click()
-        current_browser.snap()
-        if retry:
-            clear_passcode(current_browser, element)
-        current_browser.send_inputs(passcode)
-        current_browser.snap()
-        current_browser.wait_for_tag('button', 'Verify').click()
-
-        if is_this_your_device_screen:
-            if select_this_is_my_device:
-                element = wait.until(EC.element_to_be_clickable((By.XPATH, "//button[@id='trust-browser-button']")))
-            else:
-                element = wait.until(
-                    EC.element_to_be_clickable((By.XPATH, "//button[@id='dont-trust-browser-button' "
-                                                          "and text()='No, other people use this "
-                                                          "device']")))
-
-            element.click()
-        current_browser.snap()
-
-        if assert_success:
-            sp = sp_domain(match_service_provider) if match_service_provider else ''
-            current_browser.wait_for_tag('h2', f'{sp} sign-in success!')
-        elif assert_failure:
-            current_browser.wait_for_tag('span', 'Invalid passcode')
+        with TRACER.span('enter_duo_passcode', retry=retry):
+            if select_duo_push:
+                with TRACER.span('enter_duo_passcode.duo_push'):
+                    duo_push(current_browser)
+
+            with TRACER.span('enter_duo_passcode.wait_for_passcode_entry'):
+                if retry:
+                    element = wait_for_element(current_browser, "//input[contains(@id, 'passcode-input')]")
+                else:
+                    element = wait_for_element(current_browser,
+                                               "//div[contains(text(), 'Bypass code') and "
+                                               "contains(@class, 'row') and contains(@class, 'display-flex')]",
+                                               condition=EC.visibility_of_element_located)
+
+            # The Duo prompt is reached by a redirect; its data must be cleared before the browser is reused.
+            record_current_origin(current_browser)
+
+            with TRACER.span('enter_duo_passcode.submit'):
+                current_browser.snap()
+                element.click()
+                current_browser.snap()
+                if retry:
+                    clear_passcode(current_browser, element)
+                current_browser.send_inputs(passcode)
+                current_browser.snap()
+                current_browser.wait_for_tag('button', 'Verify').click()
+
+            if is_this_your_device_screen:
+                with TRACER.span('enter_duo_passcode.is_this_your_device'):
+                    if select_this_is_my_device:
+                        element = wait_for_element(current_browser, "//button[@id='trust-browser-button']")
+                    else:
+                        element = wait_for_element(current_browser, "//button[@id='dont-trust-browser-button' "
+                                                                    "and text()='No, other people use this device']")
+
+                    element.click()
+            current_browser.snap()
+
+            with TRACER.span('enter_duo_passcode.wait_for_result'):
+                if assert_success:
+                    sp = sp_domain(match_service_provider) if match_service_provider else ''
+                    current_browser.wait_for_tag('h2', f'{sp} sign-in success!')
+                elif assert_failure:
+                    current_browser.wait_for_tag('span', 'Invalid passcode')
 
     return inner
 
@@ -295,16 +493,20 @@ def log_in_netid(secrets: TestSecrets, sp_domain) -> Callable[..., NoReturn]:
         if assert_success is None:
             assert_success = password == default_password
         match_service_provider = sp_domain(match_service_provider) if match_service_provider else ''
-        current_browser.wait_for_tag('p', 'Please sign in.')
-        current_browser.send_inputs(netid, password)
-        current_browser.click(Locators.submit_button)
-        if assert_success:
-            current_browser.wait_for_tag('h2', f'{match_service_provider} sign-in success!')
+        with TRACER.span('log_in_netid', netid=netid):
+            with TRACER.span('log_in_netid.wait_for_sign_in_page'):
+                current_browser.wait_for_tag('p', 'Please sign in.')
+            with TRACER.span('log_in_netid.submit'):
+                current_browser.send_inputs(netid, password)
+                current_browser.click(Locators.submit_button)
+            if assert_success:
+                with TRACER.span('log_in_netid.wait_for_success'):
+                    current_browser.wait_for_tag('h2', f'{match_service_provider} sign-in success!')
     return inner
 
 
 @pytest.fixture(scope='session')
-def get_fresh_browser(selenium_server, chrome_options, settings) -> Callable[..., BrowserRecorder]:
+def get_fresh_browser(selenium_server, chrome_options, settings, utils) -> Callable[..., BrowserRecorder]:
     """
     This is a fixture function that creates a fresh browser instance
     based on the current environment configuration.
@@ -320,9 +522,23 @@ def get_fresh_browser(selenium_server, chrome_options, settings) -> Callable[...
     the instance created by the function is self-contained and will share the scope of
     whatever test/fixture calls it.
 
+    Any arguments are added to the Chrome command line of that browser only
+    (e.g., `get_fresh_browser('--host-resolver-rules=...')`).
+
     For local (`Chrome`) instances, we add the 'detach' option in order to
     reuse a single chromedriver instance, which speeds things up a bit.
+
+    Screenshots taken by these browsers follow the `--snap-policy` option, and their waits
+    use the `--wait-engine` option. Remote sessions wait for a free slot on the grid first;
+    see tests/grid_admission.py.
+
+    With `--pin-sp-hosts`, each browser resolves the test SPs that are running when it is created
+    to their instances' IP addresses (these rules are combined with any `--host-resolver-rules`
+    argument), which are saved as its `host_pins`.
     """
+    SNAPSHOTS.configure(settings.test_options.snap_policy)
+    DOM_WAITS.configure(settings.test_options.wait_engine)
+    GRID_ADMISSION.configure(selenium_server, settings.test_options.grid_max_sessions)
     options = copy.deepcopy(chrome_options)
     args = dict(options=options)
     if selenium_server and selenium_server.strip():
@@ -332,25 +548,85 @@ def get_fresh_browser(selenium_server, chrome_options, settings) -> Callable[...
         browser_cls = Chrome
         options.add_experimental_option('detach', True)
         args['port'] = settings.test_options.reuse_chromedriver
-    return lambda: browser_cls(**args)
+    browser_cls = compose_browser_class(browser_cls, GridSlotMixin, VisitedOriginsMixin, SnapPolicyMixin, DomWaitMixin)
+
+    def build(*chrome_arguments: str) -> BrowserRecorder:
+        build_args = args
+        host_pins = utils.sp_host_pins()
+        if host_pins:
+            # Chrome only honors the last --host-resolver-rules argument, so the rules are combined.
+            rules = [f'MAP {host} {ip}' for host, ip in sorted(host_pins.items())]
+            rules.extend(
+                argument.split('=', 1)[1] for argument in chrome_arguments
+                if argument.startswith('--host-resolver-rules=')
+            )
+            chrome_arguments = tuple(
+                argument for argument in chrome_arguments if not argument.startswith('--host-resolver-rules=')
+            ) + (f"--host-resolver-rules={', '.join(rules)}",)
+        if chrome_arguments:
+            build_options = copy.deepcopy(options)
+            for argument in chrome_arguments:
+                build_options.add_argument(argument)
+            build_args = dict(args, options=build_options)
+        slot = GRID_ADMISSION.acquire()
+        try:
+            browser = browser_cls(**build_args)
+        except BaseException:
+            if slot:
+                slot.release()
+            raise
+        browser.grid_slot = slot
+        browser.host_pins = host_pins
+        return browser
+    return build
 
 
-@pytest.fixture(scope='class')
-def fresh_class_browser(get_fresh_browser, request):
-    request.cls.browser = get_fresh_browser()
+@pytest.fixture(scope='session')
+def browser_pool(get_fresh_browser, settings, utils) -> BrowserPool:
+    """
+    Warm browser sessions shared by the `fresh_browser` and `fresh_class_browser` fixtures.
+    Sessions are cleaned up between leases instead of being re-created (unless their SP host
+    pins have changed since they were created).
+    """
+    zone = settings.aws_hosted_zone.name
+    origins = ['https://idp.u.washington.edu', 'https://idp-eval.u.washington.edu']
+    origins.extend(f'https://{sp.value}.{zone}' for sp in ServiceProviderInstance)
+    pool = BrowserPool(
+        get_fresh_browser,
+        max_size=settings.test_options.browser_pool_size,
+        max_leases=settings.test_options.browser_pool_max_leases,
+        origins=origins,
+        is_stale=(lambda browser: browser.host_pins != utils.sp_host_pins()) if utils.pins_sp_hosts else None,
+    )
     try:
-        yield
+        yield pool
     finally:
-        request.cls.browser.quit()
+        pool.close()
+
+
+@pytest.fixture(scope='class')
+def fresh_class_browser(browser_pool, utils, account_leases, request):
+    """
+    The tests of the class share the browser, and so its IdP and Duo state; the class holds the
+    leases on their accounts until its last test is done.
+    """
+    class_items = [item for item in request.session.items if item.cls is request.cls]
+    with account_leases.hold_for_class(class_items):
+        if utils.pins_sp_hosts:
+            # The browser can only be pinned to SPs that are already running.
+            utils.ensure_test_sps_ready(*required_service_providers(class_items))
+        with browser_pool.lease() as browser:
+            request.cls.browser = browser
+            yield
 
 
 @pytest.fixture
-def fresh_browser(get_fresh_browser):
-    browser = get_fresh_browser()
-    try:
+def fresh_browser(browser_pool, utils, request):
+    if utils.pins_sp_hosts:
+        # The browser can only be pinned to SPs that are already running.
+        utils.ensure_test_sps_ready(*required_service_providers([request.node]))
+    with browser_pool.lease() as browser:
         yield browser
-    finally:
-        browser.quit()
 
 
 @pytest.fixture()
@@ -0,0 +1,140 @@
+"""
+Caches the results of read-only AWS calls (describing the test SP instances, reading their DNS
+records) for `--aws-cache-seconds`, so that they aren't made again and again by the same test run,
+or by `sp_manager.py` and a test run started right after it.
+
+Results are kept in a JSON state file shared by every process on the machine (all pytest-xdist
+workers, and the CLI), and are dropped as soon as we change what they describe (e.g., by starting
+instances or updating records). Set `--aws-cache-seconds 0` to always ask AWS.
+
+Every invalidation bumps a generation number. A value fetched before an invalidation of its key is
+not stored when the fetch returns (see `generation` and the `since` arguments), so a slow read that
+started before a change can't put what it saw before the change back into the cache.
+"""
+from __future__ import annotations
+
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from .metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_FILE = os.path.join(tempfile.gettempdir(), 'uw-idp-web-tests', 'control-plane-cache.json')
+# Where the state file keeps the generation, and the generation at which each prefix was last invalidated.
+_INVALIDATIONS_KEY = '__invalidations__'
+
+
+class ControlPlaneCache:
+    def __init__(self, ttl_seconds: float, state_file: str = DEFAULT_STATE_FILE):
+        self._ttl_seconds = ttl_seconds
+        self._state_file = state_file
+        self._lock = threading.Lock()
+        if ttl_seconds > 0:
+            os.makedirs(os.path.dirname(state_file), exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self._ttl_seconds > 0
+
+    @contextmanager
+    def _state(self) -> Iterator[Dict[str, Dict[str, Any]]]:
+        """The entries in the state file, locked against other threads and processes; changes are saved."""
+        with self._lock, open(f'{self._state_file}.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self._state_file) as f:
+                        state = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    state = {}
+                before = json.dumps(state, sort_keys=True)
+                yield state
+                if json.dumps(state, sort_keys=True) != before:
+                    temp_filename = f'{self._state_file}.{os.getpid()}.tmp'
+                    with open(temp_filename, 'w') as f:
+                        json.dump(state, f)
+                    os.replace(temp_filename, self._state_file)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _invalidated_since(state: Dict[str, Any], key: str, since: Optional[int]) -> bool:
+        if since is None:
+            return False
+        prefixes = state.get(_INVALIDATIONS_KEY, {}).get('prefixes', {})
+        return any(key.startswith(prefix) and generation > since for prefix, generation in prefixes.items())
+
+    def _fresh_entry(self, state: Dict[str, Any], key: str) -> Optional[Dict[str, Any]]:
+        entry = state.get(key)
+        if entry and time.time() - entry['fetched_at'] < self._ttl_seconds:
+            return entry
+        return None
+
+    def generation(self) -> int:
+        """Take this before reading from AWS, and pass it as `since` when saving what was read."""
+        if not self.enabled:
+            return 0
+        with self._state() as state:
+            return state.get(_INVALIDATIONS_KEY, {}).get('generation', 0)
+
+    def get(self, key: str, fetch: Callable[[], Any]) -> Any:
+        """The cached value for the key, if it is fresh; otherwise calls `fetch`, which must return JSON data."""
+        if not self.enabled:
+            return fetch()
+        with self._state() as state:
+            entry = self._fresh_entry(state, key)
+            if entry:
+                METRICS.record('aws_cache.hit', 1)
+                return entry['value']
+            since = state.get(_INVALIDATIONS_KEY, {}).get('generation', 0)
+        METRICS.record('aws_cache.hit', 0)
+        value = fetch()
+        self.put(key, value, since=since)
+        return value
+
+    def put(self, key: str, value: Any, since: Optional[int] = None):
+        """
+        Saves a value that was just read from AWS (e.g., after waiting for a change to finish), unless
+        the key was invalidated after generation `since`, when the read started.
+        """
+        if not self.enabled:
+            return
+        with self._state() as state:
+            if self._invalidated_since(state, key, since):
+                logger.debug(f"Not caching {key}; it was invalidated while it was being read")
+                return
+            state[key] = {'fetched_at': time.time(), 'value': value}
+
+    def update(self, key: str, values: Dict[str, Any], since: Optional[int] = None):
+        """
+        Updates some of the items of a cached dict (e.g., the instances that were just described),
+        leaving the rest, and the time the dict was fetched, as they are. Nothing is saved if the dict
+        isn't cached (or is no longer fresh), or if the key was invalidated after generation `since`.
+        """
+        if not self.enabled:
+            return
+        with self._state() as state:
+            entry = self._fresh_entry(state, key)
+            if entry and not self._invalidated_since(state, key, since):
+                entry['value'].update(values)
+
+    def invalidate(self, *prefixes: str):
+        """Drops the values whose keys start with any of the prefixes; call this after changing them."""
+        if not self.enabled:
+            return
+        with self._state() as state:
+            invalidations = state.setdefault(_INVALIDATIONS_KEY, {'generation': 0, 'prefixes': {}})
+            invalidations['generation'] += 1
+            for prefix in prefixes:
+                invalidations['prefixes'][prefix] = invalidations['generation']
+            for key in [key for key in state if key != _INVALIDATIONS_KEY and key.startswith(prefixes)]:
+                logger.debug(f"Invalidating cached {key}")
+                del state[key]
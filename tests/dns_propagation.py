@@ -0,0 +1,141 @@
+"""
+Waits for the A records of several test service providers to propagate, all at the same time.
+
+For each domain, the zone's authoritative name servers are asked directly until they answer
+with the new address (i.e., Route53 is serving the change); then the local resolver, which is
+what the tests' browsers will use, is asked until it has let go of the old one. Each of the two
+has the TTL (plus 10%) to get there: the local resolver can keep the old answer for a whole TTL
+after the authoritative name servers started serving the new one. While the
+local resolver still has the old address cached, the next lookup waits for the TTL left on
+that answer, instead of a fixed interval. All domains are looked up concurrently, in one
+event loop, so the total wait is that of the slowest domain rather than the sum of them.
+
+Use:
+    seconds = wait_for_propagation({'diafine6.sandbox.iam.s.uw.edu': '1.2.3.4'},
+                                   zone='sandbox.iam.s.uw.edu', ttl=300)
+
+To look up records somewhere other than DNS (e.g., in `tests/aws_standin.py`), pass a
+`resolver_factory`; it is called with a list of name server addresses (or None, for the local
+resolver) and must return an object with dnspython's async `resolve` method.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import dns.asyncresolver
+import dns.exception
+import dns.resolver
+
+logger = logging.getLogger(__name__)
+
+# The first retry comes this soon; later retries back off, up to the zone's TTL / 10.
+_MIN_RETRY_SECONDS = 1.0
+_QUERY_LIFETIME_SECONDS = 5.0
+
+ResolverFactory = Callable[[Optional[List[str]]], Any]
+
+_nameserver_cache: Dict[Tuple[str, ResolverFactory], List[str]] = {}
+_nameserver_lock = threading.Lock()
+
+
+def dns_resolver(nameservers: Optional[List[str]] = None) -> dns.asyncresolver.Resolver:
+    """The default resolver factory: the local resolver, or one that only asks the given name servers."""
+    if nameservers is None:
+        return dns.asyncresolver.Resolver()
+    resolver = dns.asyncresolver.Resolver(configure=False)
+    resolver.nameservers = nameservers
+    return resolver
+
+
+async def _authoritative_nameservers(zone: str, resolver_factory: ResolverFactory) -> List[str]:
+    """
+    The addresses of the zone's authoritative name servers, or [] if they can't be found. Only
+    addresses that were found are cached; after a failure, the next call asks again.
+    """
+    with _nameserver_lock:
+        if (zone, resolver_factory) in _nameserver_cache:
+            return _nameserver_cache[zone, resolver_factory]
+    resolver = resolver_factory(None)
+    addresses = []
+    try:
+        answer = await resolver.resolve(zone, 'NS', lifetime=_QUERY_LIFETIME_SECONDS)
+        for name_server in answer:
+            ns_answer = await resolver.resolve(name_server.target, 'A', lifetime=_QUERY_LIFETIME_SECONDS)
+            addresses.extend(record.address for record in ns_answer)
+    except dns.exception.DNSException as e:
+        logger.warning(f"Could not find the authoritative name servers for {zone}; "
+                       f"only the local resolver will be checked: {e}")
+    if addresses:
+        with _nameserver_lock:
+            _nameserver_cache[zone, resolver_factory] = addresses
+    return addresses
+
+
+async def _lookup(resolver: dns.asyncresolver.Resolver, domain: str):
+    """Returns (the addresses the domain resolves to, how long that answer is good for, in seconds)."""
+    try:
+        answer = await resolver.resolve(domain, 'A', lifetime=_QUERY_LIFETIME_SECONDS)
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer, dns.resolver.NoNameservers, dns.exception.Timeout):
+        return set(), None
+    return {record.address for record in answer}, answer.rrset.ttl
+
+
+async def _wait_for_domain(domain: str, ip: str, local, authoritative,
+                           phase_seconds: float, max_retry_seconds: float) -> float:
+    start = time.monotonic()
+    checks = [('authoritative', authoritative), ('local', local)] if authoritative else [('local', local)]
+    for name, resolver in checks:
+        deadline = time.monotonic() + phase_seconds
+        retry_seconds = _MIN_RETRY_SECONDS
+        while True:
+            addresses, ttl = await _lookup(resolver, domain)
+            if ip in addresses:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"IP address for {domain} never updated to {ip} "
+                                   f"({name} name servers say {sorted(addresses) or 'nothing'})")
+            # A cached answer won't change until its TTL runs out, so don't ask again before then.
+            delay = ttl + 0.5 if ttl is not None and name == 'local' else retry_seconds
+            await asyncio.sleep(min(delay, remaining))
+            retry_seconds = min(retry_seconds * 2, max_retry_seconds)
+    elapsed = time.monotonic() - start
+    logger.info(f"{domain} resolves to {ip} after {elapsed:.1f}s")
+    return elapsed
+
+
+async def _wait_for_all(targets: Dict[str, str], zone: str, ttl: float,
+                        resolver_factory: ResolverFactory) -> Dict[str, float]:
+    # Each check gets as long as the TTL, plus 10% to account for edge cases with polling and TTL cycles.
+    phase_seconds = ttl * 1.1
+    name_servers = await _authoritative_nameservers(zone, resolver_factory)
+    authoritative = resolver_factory(name_servers) if name_servers else None
+    max_retry_seconds = max(_MIN_RETRY_SECONDS, ttl / 10)
+    domains = list(targets)
+    results = await asyncio.gather(
+        *(_wait_for_domain(domain, targets[domain], resolver_factory(None), authoritative, phase_seconds,
+                           max_retry_seconds)
+          for domain in domains),
+        return_exceptions=True,
+    )
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        raise TimeoutError('; '.join(str(error) for error in errors))
+    return dict(zip(domains, results))
+
+
+def wait_for_propagation(targets: Dict[str, str], zone: str, ttl: float,
+                         resolver_factory: ResolverFactory = dns_resolver) -> Dict[str, float]:
+    """
+    Blocks until every domain in `targets` resolves to its IP address, both at the zone's
+    authoritative name servers and locally. Returns the number of seconds each domain took,
+    or raises a TimeoutError naming the domains that didn't resolve, at either, within the TTL
+    (plus 10%) of starting to check there.
+    """
+    if not targets:
+        return {}
+    return asyncio.run(_wait_for_all(targets, zone, ttl, resolver_factory))
@@ -0,0 +1,251 @@
+"""
+Waits for elements from inside the page, instead of polling for them over the wire.
+
+Selenium's WebDriverWait (which `wait_for`, `wait_for_tag`, `click_tag`, and the rest of
+BrowserRecorder's waits use) checks for the element every half second, and every check is
+at least one WebDriver command, i.e., a round trip to the grid. With `--wait-engine observe`
+(the default), a single `execute_async_script` command installs a MutationObserver in the
+page instead; the command returns as soon as the element shows up (or is visible, or
+clickable), or the wait times out.
+
+Waits that can't be done in the page (e.g., by link text, or for other conditions) still poll.
+If the page navigates while waiting, the observer goes away with it; the wait then starts
+over in the new page, with whatever time it has left.
+
+The number of WebDriver commands used by each wait (`wait.commands`), the time each wait
+took (`wait.seconds`), and the time between the element appearing and the wait noticing
+(`wait.detection_lag_seconds`) are included in the `idp test metrics` summary. Run with
+`--wait-engine poll` to compare them with polling; in that mode, measuring the detection
+lag costs two extra commands for each wait, which are not included in `wait.commands`.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from typing import Dict, Optional
+
+from selenium.common.exceptions import JavascriptException, TimeoutException, WebDriverException
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.wait import WebDriverWait
+from webdriver_recorder.browser import BrowserError, By, Locator
+
+from .metrics import METRICS
+from .models import WaitEngine
+
+logger = logging.getLogger(__name__)
+
+PRESENT = 'present'
+VISIBLE = 'visible'
+CLICKABLE = 'clickable'
+
+_CONDITION_STATES = {
+    EC.presence_of_element_located: PRESENT,
+    EC.visibility_of_element_located: VISIBLE,
+    EC.element_to_be_clickable: CLICKABLE,
+}
+
+# How to find an element in the page with each search method: ('xpath' or 'css', a function of the search value).
+_PAGE_LOOKUPS = {
+    By.XPATH: ('xpath', lambda value: value),
+    By.CSS_SELECTOR: ('css', lambda value: value),
+    By.ID: ('css', lambda value: f'[id="{value}"]'),
+    By.NAME: ('css', lambda value: f'[name="{value}"]'),
+    By.TAG_NAME: ('css', lambda value: value),
+    By.CLASS_NAME: ('css', lambda value: f'.{value}'),
+}
+
+FIND_ELEMENT_JS = """
+function idpFindElement(lookup, state) {
+    var element = lookup.xpath
+        ? document.evaluate(lookup.xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue
+        : document.querySelector(lookup.css);
+    if (!element || state === 'present') {
+        return element;
+    }
+    if (!element.getClientRects().length || window.getComputedStyle(element).visibility === 'hidden') {
+        return null;
+    }
+    return state === 'clickable' && element.disabled ? null : element;
+}
+"""
+
+_OBSERVE_JS = FIND_ELEMENT_JS + """
+var lookup = arguments[0], state = arguments[1], timeoutMs = arguments[2], returnText = arguments[3];
+var done = arguments[arguments.length - 1];
+var start = performance.now(), checks = 0, finished = false, observer, timer, interval;
+function finish(element) {
+    finished = true;
+    if (observer) { observer.disconnect(); }
+    clearTimeout(timer);
+    clearInterval(interval);
+    done({
+        found: !!element,
+        element: returnText ? null : element,
+        text: returnText && element ? element.innerText : null,
+        checks: checks,
+        appeared_ms: element ? performance.now() - start : null
+    });
+}
+function check() {
+    if (finished) { return; }
+    checks++;
+    var element = idpFindElement(lookup, state);
+    if (element) { finish(element); }
+}
+check();
+if (!finished) {
+    observer = new MutationObserver(check);
+    observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    // Visibility can also change without a mutation (e.g., at the end of a CSS transition).
+    interval = setInterval(check, 250);
+    timer = setTimeout(function () { if (!finished) { finish(null); } }, timeoutMs);
+}
+"""
+
+_PROBE_JS = FIND_ELEMENT_JS + """
+var lookup = arguments[0], state = arguments[1];
+var probe = window.__idpWaitProbe = {start: performance.now(), appeared_ms: null};
+function check() {
+    if (probe.appeared_ms === null && idpFindElement(lookup, state)) {
+        probe.appeared_ms = performance.now() - probe.start;
+        observer.disconnect();
+    }
+}
+var observer = new MutationObserver(check);
+observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+check();
+"""
+
+_READ_PROBE_JS = "return window.__idpWaitProbe ? window.__idpWaitProbe.appeared_ms : null;"
+
+# Room for the round trip, on top of the wait's own timeout, before the async script times out.
+SCRIPT_TIMEOUT_MARGIN_SECONDS = 5
+
+
+def page_lookup(locator: Locator) -> Optional[Dict[str, str]]:
+    """How to find the locator's element from inside the page, or None if it can't be."""
+    if locator.search_method not in _PAGE_LOOKUPS:
+        return None
+    kind, to_query = _PAGE_LOOKUPS[locator.search_method]
+    return {kind: to_query(locator.payload[1])}
+
+
+class DomWaits:
+    def __init__(self):
+        self.engine = WaitEngine.observe
+
+    def configure(self, engine: str):
+        self.engine = WaitEngine(engine)
+
+    def _record(self, commands: int, seconds: float, appeared_seconds: Optional[float]):
+        METRICS.record('wait.commands', commands)
+        METRICS.record('wait.seconds', seconds)
+        if appeared_seconds is not None:
+            METRICS.record('wait.detection_lag_seconds', max(0.0, seconds - appeared_seconds))
+
+    def observe(self, browser: DomWaitMixin, lookup: Dict[str, str], state: str, timeout: float,
+                return_text: bool = False):
+        """
+        Waits for the element in the page; returns it (or, with return_text, its text, so that
+        reading it doesn't take another command), or raises a TimeoutException.
+        """
+        browser.ensure_script_timeout(timeout + SCRIPT_TIMEOUT_MARGIN_SECONDS)
+        start = time.perf_counter()
+        commands_before = browser.command_count
+        deadline = start + timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            started = time.perf_counter()
+            try:
+                result = browser.execute_async_script(
+                    _OBSERVE_JS, lookup, state, int(remaining * 1000), return_text)
+            except JavascriptException as e:
+                # The page navigated away while waiting (or was still loading); wait in the new page.
+                logger.debug(f"Waiting for {lookup} again after: {e.msg}")
+                time.sleep(0.1)
+                continue
+            if result and result.get('found'):
+                elapsed = time.perf_counter() - start
+                self._record(browser.command_count - commands_before, elapsed,
+                             started - start + result['appeared_ms'] / 1000)
+                return result['text'] if return_text else result['element']
+            break
+        self._record(browser.command_count - commands_before, time.perf_counter() - start, None)
+        raise TimeoutException(f"Timed out after {timeout}s waiting for {lookup} to be {state}")
+
+    def poll(self, browser: DomWaitMixin, lookup: Optional[Dict[str, str]], state: Optional[str], until,
+             timeout: float):
+        """Polls with WebDriverWait, measuring the commands it uses and (if possible) its detection lag."""
+        probe_start = None
+        if lookup and state:
+            try:
+                browser.execute_script(_PROBE_JS, lookup, state)
+                probe_start = time.perf_counter()
+            except WebDriverException:
+                pass
+        start = time.perf_counter()
+        commands_before = browser.command_count
+        try:
+            element = until(WebDriverWait(browser, timeout))
+        except Exception:
+            self._record(browser.command_count - commands_before, time.perf_counter() - start, None)
+            raise
+        elapsed = time.perf_counter() - start
+        commands = browser.command_count - commands_before
+        appeared_seconds = None
+        if probe_start is not None:
+            try:
+                appeared_ms = browser.execute_script(_READ_PROBE_JS)
+                if appeared_ms is not None:
+                    appeared_seconds = probe_start - start + appeared_ms / 1000
+            except WebDriverException:
+                pass
+        self._record(commands, elapsed, appeared_seconds)
+        return element
+
+
+DOM_WAITS = DomWaits()
+
+
+class DomWaitMixin:
+    """Counts the WebDriver commands a browser sends, and makes its waits use the wait engine."""
+    command_count = 0
+    _script_timeout = None
+
+    def execute(self, driver_command, params=None):
+        self.command_count += 1
+        return super().execute(driver_command, params)
+
+    def ensure_script_timeout(self, seconds: float):
+        if self._script_timeout is None or self._script_timeout < seconds:
+            self.set_script_timeout(seconds)
+            self._script_timeout = seconds
+
+    def wait_until(self, locator: Locator, condition, timeout: Optional[int] = None, capture_delay: int = 0,
+                   caption: Optional[str] = None, is_error: Optional[bool] = False, **kwargs):
+        """Replaces BrowserRecorder.wait_until (and its Waiter); screenshots and errors are the same."""
+        timeout = self._resolve_timeout(timeout)
+        state = _CONDITION_STATES.get(condition)
+        lookup = page_lookup(locator)
+        with self.wrap_exception(locator.description):
+            found = False
+            error = None
+            try:
+                if DOM_WAITS.engine is WaitEngine.observe and state and lookup and not kwargs:
+                    element = DOM_WAITS.observe(self, lookup, state, timeout)
+                else:
+                    element = DOM_WAITS.poll(
+                        self, lookup, state, lambda wait: wait.until(condition(locator.payload), **kwargs), timeout)
+                found = True
+            except Exception as e:
+                error = BrowserError(self, str(e))
+                error.orig = e
+                raise error from None
+            finally:
+                if self.autocapture or error:
+                    if capture_delay:
+                        time.sleep(capture_delay)
+                    self.snap(caption=caption or '', is_error=not found)
+            return element
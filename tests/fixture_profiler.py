@@ -0,0 +1,156 @@
+"""
+Times the setup and teardown of every fixture, for every test, and summarizes where the time went
+at the end of the session. Enable it with `--profile-fixtures`.
+
+Like tests/metrics.py, timings are attached to the `user_properties` of the test that is running,
+so that they make it back from pytest-xdist workers to the controlling process.
+
+The summary also points out function-scoped fixtures that produced an identical value every time
+they were set up; those are candidates for a wider scope. Values are compared by their pickled
+contents, so fixtures returning things that can't be pickled (browsers, closures) are never flagged.
+Nor are fixtures with a teardown (a `yield` or a finalizer), such as the `netid*` account leases:
+their value may be the same every time, but what they hold while the test runs is not.
+"""
+from __future__ import annotations
+
+import hashlib
+import pickle
+import time
+from typing import Dict, List, Optional
+
+import pytest
+
+FIXTURE_PROPERTY_PREFIX = 'idp_fixture:'
+SETUP = 'setup'
+TEARDOWN = 'teardown'
+
+
+def fingerprint(value) -> Optional[str]:
+    """A digest of the value's contents, or None if it can't be pickled."""
+    try:
+        return hashlib.sha1(pickle.dumps(value)).hexdigest()
+    except Exception:
+        return None
+
+
+class FixtureStats:
+    def __init__(self, name: str, scope: str):
+        self.name = name
+        self.scope = scope
+        self.setups = 0
+        self.setup_seconds = 0.0
+        self.teardown_seconds = 0.0
+        self.fingerprints = set()
+        self.dependencies = set()
+        self.has_teardown = False
+
+    @property
+    def total_seconds(self) -> float:
+        return self.setup_seconds + self.teardown_seconds
+
+    @property
+    def always_identical(self) -> bool:
+        return self.setups > 1 and len(self.fingerprints) == 1 and None not in self.fingerprints
+
+    @property
+    def could_widen(self) -> bool:
+        return self.scope == 'function' and self.always_identical and not self.has_teardown
+
+
+class FixtureProfiler:
+    def __init__(self):
+        self._current_item: Optional[pytest.Item] = None
+        self._teardown_started: Dict[int, float] = {}
+
+    def _record(self, phase: str, fixturedef, seconds: float, value_fingerprint: Optional[str] = None,
+                has_teardown: bool = False):
+        if self._current_item is not None:
+            self._current_item.user_properties.append((
+                f'{FIXTURE_PROPERTY_PREFIX}{phase}',
+                (fixturedef.argname, fixturedef.scope, seconds, value_fingerprint, tuple(fixturedef.argnames),
+                 has_teardown),
+            ))
+
+    @pytest.hookimpl(hookwrapper=True, tryfirst=True)
+    def pytest_runtest_protocol(self, item):
+        self._current_item = item
+        try:
+            yield
+        finally:
+            self._current_item = None
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef, request):
+        start = time.perf_counter()
+        outcome = yield
+        elapsed = time.perf_counter() - start
+        value_fingerprint = None if outcome.excinfo else fingerprint(outcome.get_result())
+        # A fixture's own finalizers (including the rest of a yield fixture) are registered during its
+        # setup; those of the fixtures that depend on it aren't registered until they are set up.
+        has_teardown = bool(getattr(fixturedef, '_finalizers', None))
+        self._record(SETUP, fixturedef, elapsed, value_fingerprint, has_teardown)
+        key = id(fixturedef)
+        # Finalizers run last-in-first-out, so this runs right before the fixture's own teardown,
+        # and after the teardown of any fixtures that depend on it.
+        fixturedef.addfinalizer(lambda: self._teardown_started.__setitem__(key, time.perf_counter()))
+
+    def pytest_fixture_post_finalizer(self, fixturedef, request):
+        start = self._teardown_started.pop(id(fixturedef), None)
+        if start is not None:
+            self._record(TEARDOWN, fixturedef, time.perf_counter() - start)
+
+    @staticmethod
+    def collect(terminalreporter) -> Dict[str, FixtureStats]:
+        stats: Dict[str, FixtureStats] = {}
+        for reports in terminalreporter.stats.values():
+            for report in reports:
+                # Every phase's report carries all the properties recorded so far; the teardown
+                # report is the last one, so it has all of them.
+                if getattr(report, 'when', None) != 'teardown':
+                    continue
+                for key, value in getattr(report, 'user_properties', []):
+                    if not (isinstance(key, str) and key.startswith(FIXTURE_PROPERTY_PREFIX)):
+                        continue
+                    phase = key[len(FIXTURE_PROPERTY_PREFIX):]
+                    name, scope, seconds, value_fingerprint, dependencies, has_teardown = value
+                    fixture = stats.setdefault(name, FixtureStats(name, scope))
+                    fixture.dependencies.update(dependencies)
+                    fixture.has_teardown |= has_teardown
+                    if phase == SETUP:
+                        fixture.setups += 1
+                        fixture.setup_seconds += seconds
+                        fixture.fingerprints.add(value_fingerprint)
+                    else:
+                        fixture.teardown_seconds += seconds
+        return stats
+
+    def pytest_terminal_summary(self, terminalreporter):
+        stats = self.collect(terminalreporter)
+        if not stats:
+            return
+        ranked: List[FixtureStats] = sorted(stats.values(), key=lambda f: f.total_seconds, reverse=True)
+        terminalreporter.write_sep('=', 'fixture setup and teardown cost')
+        terminalreporter.write_line(
+            f'{"fixture":<36} {"scope":<8} {"setups":>6} {"setup":>9} {"teardown":>9} {"total":>9} {"mean":>8}')
+        for fixture in ranked[:25]:
+            if fixture.total_seconds < 0.01:
+                break
+            terminalreporter.write_line(
+                f'{fixture.name:<36} {fixture.scope:<8} {fixture.setups:>6} {fixture.setup_seconds:>9.2f} '
+                f'{fixture.teardown_seconds:>9.2f} {fixture.total_seconds:>9.2f} '
+                f'{fixture.total_seconds / max(fixture.setups, 1):>8.3f}'
+            )
+
+        candidates = [f for f in ranked if f.could_widen and f.total_seconds >= 0.01]
+        if candidates:
+            terminalreporter.write_line(
+                '\nThese function-scoped fixtures produced the same value every time; consider widening their scope:')
+            for fixture in candidates:
+                narrow_dependencies = sorted(
+                    d for d in fixture.dependencies
+                    if d in stats and stats[d].scope == 'function' and d != fixture.name
+                )
+                note = f' (also depends on function-scoped: {", ".join(narrow_dependencies)})' \
+                    if narrow_dependencies else ''
+                terminalreporter.write_line(
+                    f'  {fixture.name}: set up {fixture.setups} times, {fixture.total_seconds:.2f}s in total{note}')
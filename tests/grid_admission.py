@@ -0,0 +1,283 @@
+"""
+Keeps the suite from asking the Selenium grid for more browser sessions than it has slots for.
+
+When there are more session requests than the grid's nodes allow (`SE_NODE_MAX_SESSIONS`),
+the extra requests queue up inside the grid, where they look like a slow or hanging test,
+and eventually fail with a timeout. Instead, the run admits at most as many sessions at once
+as the grid has Chrome slots, less the sessions that other clients (or leftovers of earlier
+runs) hold, according to the grid's `/status` endpoint (or `--grid-max-sessions`, if it is set).
+This is checked again every `CAPACITY_REFRESH_SECONDS`, so that slots freed later are used.
+
+Admission is shared by all pytest-xdist workers (and threads) of the run: each session holds
+a slot, i.e., a file lock, from the time it is requested until it is quit, and requests that
+have to wait for a slot are served in the order they were made. The time spent waiting
+(`grid.queue_wait_seconds`) is included in the `idp test metrics` summary. While anyone is
+waiting, the browser pool quits sessions when they are returned instead of keeping them idle,
+and quits the ones it already has idle (see `BrowserPool`), so that idle sessions never keep a
+slot from a test that needs one.
+
+At the start of a run, `capacity_report` says how many workers the grid can support.
+"""
+from __future__ import annotations
+
+import fcntl
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+import requests
+
+from .metrics import METRICS
+from .run_dirs import run_dir
+from .tracing import TRACER
+
+logger = logging.getLogger(__name__)
+
+_POLL_SECONDS = 0.1
+_STATUS_TIMEOUT_SECONDS = 5
+# A request that waits this long is let through anyway (and queued by the grid), so that sessions
+# held for a whole test class can't keep other workers waiting forever. This is the grid's own
+# default session request timeout.
+MAX_QUEUE_WAIT_SECONDS = 300
+CAPACITY_REFRESH_SECONDS = 30
+
+
+class GridStatus:
+    def __init__(self, ready: bool, total_slots: int, free_slots: int):
+        self.ready = ready
+        self.total_slots = total_slots
+        self.free_slots = free_slots
+
+    @classmethod
+    def parse(cls, status: dict, browser_name: str = 'chrome') -> Optional[GridStatus]:
+        """Reads a Selenium 4 `/status` response; returns None if it doesn't describe the grid's slots."""
+        value = status.get('value') or {}
+        if 'nodes' not in value:
+            return None
+        total = free = 0
+        for node in value['nodes']:
+            if node.get('availability', 'UP') != 'UP':
+                continue
+            for slot in node.get('slots', []):
+                if (slot.get('stereotype') or {}).get('browserName', browser_name) != browser_name:
+                    continue
+                total += 1
+                if not slot.get('session'):
+                    free += 1
+        return cls(bool(value.get('ready')), total, free)
+
+    @classmethod
+    def fetch(cls, selenium_server: str) -> Optional[GridStatus]:
+        try:
+            response = requests.get(f'http://{selenium_server}/status', timeout=_STATUS_TIMEOUT_SECONDS)
+            response.raise_for_status()
+            return cls.parse(response.json())
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f"Could not get the status of the selenium grid at {selenium_server}: {e}")
+            return None
+
+
+def capacity_report(selenium_server: str, num_workers: int) -> List[str]:
+    """Lines for the start of the test run, saying how many workers the grid can support."""
+    status = GridStatus.fetch(selenium_server)
+    if not status:
+        return [f"selenium grid: {selenium_server} (its capacity is unknown)"]
+    lines = [f"selenium grid: {selenium_server}, {status.free_slots} of {status.total_slots} chrome slots free; "
+             f"it can support {status.free_slots} workers with one browser each"]
+    if num_workers > status.free_slots:
+        lines.append(f"selenium grid: {num_workers} workers will share {status.free_slots} slots; "
+                     f"tests will wait for browser sessions (see grid.queue_wait_seconds)")
+    return lines
+
+
+class GridSlot:
+    def __init__(self, lock_file):
+        self._lock_file = lock_file
+
+    def release(self):
+        if self._lock_file:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+
+class GridAdmission:
+    """
+    Configured by `get_fresh_browser`. Until it is configured with a selenium server, every
+    session is admitted right away.
+    """
+    def __init__(self):
+        self._selenium_server: Optional[str] = None
+        self._max_sessions = 0
+        self._run_dir: Optional[str] = None
+        self._capacity: Optional[int] = None
+        self._capacity_checked = 0.0
+        self._lock = threading.Lock()
+
+    def configure(self, selenium_server: Optional[str], max_sessions: int = 0):
+        selenium_server = (selenium_server or '').strip() or None
+        if selenium_server == self._selenium_server and max_sessions == self._max_sessions:
+            return
+        self._selenium_server = selenium_server
+        self._max_sessions = max_sessions
+        self._capacity = None
+        # All xdist workers in a test run share a run id, and so share the grid's slots.
+        self._run_dir = run_dir('grid-admission')
+        os.makedirs(os.path.join(self._run_dir, 'queue'), exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self._selenium_server is not None
+
+    @contextmanager
+    def _run_lock(self) -> Iterator[None]:
+        with open(os.path.join(self._run_dir, 'run.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @property
+    def capacity(self) -> int:
+        """
+        The most sessions the run may have at once, or 0 for no limit (if the grid's capacity is
+        unknown). Decided by whichever worker asks first, and again once it is out of date.
+        """
+        with self._lock:
+            if self._capacity is None or (
+                    not self._max_sessions
+                    and time.monotonic() - self._capacity_checked > CAPACITY_REFRESH_SECONDS):
+                self._capacity = self._decide_capacity()
+                self._capacity_checked = time.monotonic()
+            return self._capacity
+
+    def _held_slots(self) -> int:
+        """How many of the run's slots are held, i.e., how many of the grid's sessions are the run's."""
+        held = 0
+        for entry in os.listdir(self._run_dir):
+            if not (entry.startswith('slot-') and entry.endswith('.lock')):
+                continue
+            with open(os.path.join(self._run_dir, entry), 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    held += 1
+                else:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return held
+
+    def _decide_capacity(self) -> int:
+        filename = os.path.join(self._run_dir, 'capacity')
+        with self._run_lock():
+            previous = None
+            if os.path.exists(filename):
+                with open(filename) as f:
+                    previous = int(f.read())
+                if self._max_sessions or time.time() - os.path.getmtime(filename) <= CAPACITY_REFRESH_SECONDS:
+                    return previous
+            if self._max_sessions > 0:
+                capacity = self._max_sessions
+            else:
+                status = GridStatus.fetch(self._selenium_server)
+                if status:
+                    # Sessions that aren't the run's (another client's, or left over from an earlier run)
+                    # keep their slots; every other slot, free or not, is the run's to share.
+                    others = max(0, status.total_slots - status.free_slots - self._held_slots())
+                    capacity = max(1, status.total_slots - others)
+                else:
+                    capacity = 0
+            with open(filename, 'w') as f:
+                f.write(str(capacity))
+        if capacity == previous:
+            return capacity
+        if capacity:
+            logger.info(f"Admitting at most {capacity} browser sessions to the selenium grid at once")
+        else:
+            logger.info("The selenium grid's capacity is unknown; browser sessions will not wait for a slot")
+        return capacity
+
+    def _queue(self) -> List[str]:
+        """The waiting requests, oldest first, without the ones whose process is gone."""
+        queue_dir = os.path.join(self._run_dir, 'queue')
+        entries = sorted(os.listdir(queue_dir))
+        waiting = []
+        for entry in entries:
+            pid = int(entry.split('-')[1])
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                try:
+                    os.remove(os.path.join(queue_dir, entry))
+                except FileNotFoundError:
+                    pass
+                continue
+            except PermissionError:
+                pass
+            waiting.append(entry)
+        return waiting
+
+    def has_waiters(self) -> bool:
+        return self.enabled and bool(self._queue())
+
+    def _try_slots(self) -> Optional[GridSlot]:
+        # If the capacity went down, slots past it stay held until they are released, but no one takes them again.
+        for i in range(self.capacity):
+            lock_file = open(os.path.join(self._run_dir, f'slot-{i}.lock'), 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                continue
+            return GridSlot(lock_file)
+        return None
+
+    def acquire(self) -> Optional[GridSlot]:
+        """Waits for a free slot, behind any requests that were already waiting."""
+        if not self.enabled or not self.capacity:
+            return None
+        slot = self._try_slots() if not self._queue() else None
+        if slot:
+            METRICS.record('grid.queue_wait_seconds', 0)
+            return slot
+        entry = os.path.join(self._run_dir, 'queue', f'{time.time_ns():020d}-{os.getpid()}-{threading.get_ident()}')
+        open(entry, 'w').close()
+        start = time.perf_counter()
+        try:
+            with TRACER.span('grid.queue_wait'):
+                while time.perf_counter() - start < MAX_QUEUE_WAIT_SECONDS:
+                    # Only the requests at the front of the queue, one for each slot, try to take one.
+                    if self._queue().index(os.path.basename(entry)) < self.capacity:
+                        slot = self._try_slots()
+                        if slot:
+                            break
+                    time.sleep(_POLL_SECONDS)
+                else:
+                    logger.warning(f"No selenium grid slot was free for {MAX_QUEUE_WAIT_SECONDS}s; "
+                                   f"requesting a session anyway")
+        finally:
+            os.remove(entry)
+        waited = time.perf_counter() - start
+        METRICS.record('grid.queue_wait_seconds', waited)
+        if waited > 1:
+            logger.info(f"Waited {waited:.1f}s for a selenium grid slot")
+        return slot
+
+
+GRID_ADMISSION = GridAdmission()
+
+
+class GridSlotMixin:
+    """Holds the browser's grid slot until the browser is quit."""
+    grid_slot: Optional[GridSlot] = None
+
+    def quit(self):
+        try:
+            super().quit()
+        finally:
+            if self.grid_slot:
+                self.grid_slot.release()
+                self.grid_slot = None
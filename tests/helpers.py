@@ -1,8 +1,13 @@
 from __future__ import annotations
+import hashlib
+import inspect
+import json
 import logging
+import re
 import sys
+import threading
 from contextlib import contextmanager
-from typing import Dict, List, Tuple, Any, Union, Optional
+from typing import Dict, Iterable, List, Set, Tuple, Any, Union, Optional
 
 import boto3
 import yaml
@@ -10,11 +15,15 @@ from botocore.exceptions import ClientError
 from nslookup import Nslookup
 from selenium.webdriver.common.keys import Keys
 from typing_extensions import Literal
-from waiter import wait
 from webdriver_recorder.browser import Locator, By
 
+from .control_plane_cache import ControlPlaneCache
+from .dns_propagation import ResolverFactory, dns_resolver, wait_for_propagation
+from .metrics import METRICS
+from .sp_inventory import TEST_REF_TAG, is_usable, load_inventory
+from .tracing import TRACER
 from .models import ServiceProviderInstance, TestSecrets, WebTestSettings, HostedZoneSettings, \
-    StartInstancesRequest, StopInstancesRequest, DescribeInstancesRequest, DescribeInstancesResponse, \
+    StartInstancesRequest, StopInstancesRequest, DescribeInstancesRequest, \
     UpdateRoute53Record, AWSRoute53ChangeBatch, AWSRoute53RecordSetChange, AWSRoute53RecordSet, \
     AWSRoute53ResourceRecord, AWSEC2InstanceStateName, AWSEC2InstanceFilter, ServiceProviderConfig
 
@@ -51,6 +60,81 @@ def lookup_domain_ip(domain: str):
     return a_record_responses[0].split()[-1]
 
 
+def _service_providers_in(value) -> Set[ServiceProviderInstance]:
+    """The SPs that a value is, or (if it is a collection) contains."""
+    if isinstance(value, ServiceProviderInstance):
+        return {value}
+    if isinstance(value, dict):
+        return _service_providers_in(list(value.keys())) | _service_providers_in(list(value.values()))
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return {v for v in value if isinstance(v, ServiceProviderInstance)}
+    return set()
+
+
+def _referenced_service_providers(obj) -> Optional[Set[ServiceProviderInstance]]:
+    """
+    The SPs referenced in the source of a function, as `ServiceProviderInstance.<name>` (or through
+    an alias of ServiceProviderInstance), or through a module-level constant. None if the source
+    can't be found.
+    """
+    try:
+        source = inspect.getsource(obj)
+    except (OSError, TypeError):
+        return None
+    module_globals = getattr(inspect.unwrap(obj), '__globals__', {})
+    enum_names = {'ServiceProviderInstance'} | {
+        name for name, value in module_globals.items() if value is ServiceProviderInstance
+    }
+    reference = re.compile(rf"\b(?:{'|'.join(sorted(enum_names))})\.(\w+)")
+    referenced = {
+        ServiceProviderInstance[name] for name in reference.findall(source)
+        if name in ServiceProviderInstance.__members__
+    }
+    identifiers = set(re.findall(r'\b\w+\b', source))
+    for name, value in module_globals.items():
+        if name in identifiers:
+            referenced |= _service_providers_in(value)
+    return referenced
+
+
+def required_service_providers(items: Iterable) -> Set[ServiceProviderInstance]:
+    """
+    Works out which test service providers the given (collected) tests will need, so that
+    only those have to be started. A test needs an SP if it is declared using
+    `@pytest.mark.service_providers(...)`, passed in as a parameter, or referenced
+    in the source of the test or of its class (or the classes it inherits from).
+    If a test's source can't be found, it is assumed to need all of them.
+    """
+    required = set()
+    for item in items:
+        marker = item.get_closest_marker('service_providers')
+        if marker:
+            required.update(ServiceProviderInstance(sp) for sp in marker.args)
+            continue
+        callspec = getattr(item, 'callspec', None)
+        if callspec:
+            required.update(v for v in callspec.params.values() if isinstance(v, ServiceProviderInstance))
+        sources = [item.function]
+        if item.cls:
+            # Class fixtures and helpers (e.g., an 'initialize' that sets self.sp, or a base class's
+            # sign-in helper) apply to every test in the class; the other tests in the class do not.
+            for cls in inspect.getmro(item.cls):
+                if cls is object:
+                    continue
+                for name, member in vars(cls).items():
+                    if inspect.isfunction(member) and not name.startswith('test'):
+                        sources.append(member)
+                    elif not name.startswith('__'):
+                        required.update(_service_providers_in(member))
+        for source in sources:
+            referenced = _referenced_service_providers(source)
+            if referenced is None:
+                logger.info(f"Could not read the source of {item.nodeid}; it may need any test service provider")
+                return set(ServiceProviderInstance)
+            required.update(referenced)
+    return required
+
+
 def load_settings(filename: str, env: str,
                   option_overrides: Optional[Dict[str, Any]] = None, **kwargs) -> WebTestSettings:
     """Given the file name and the profile name, loads the YAML and returns the settings model."""
@@ -88,57 +172,154 @@ def dry_runnable_operation(dry_run=False):
 
 
 class ServiceProviderAWSOperations:
-    """Various functions to start and stop AWS EC2 instances."""
+    """
+    Various functions to start and stop AWS EC2 instances.
+
+    `aws_clients` ({'ec2': ..., 'route53': ...}) and `resolver_factory` replace the boto3 clients and
+    DNS lookups; see tests/aws_standin.py.
+    """
     def __init__(self,
                  test_secrets: TestSecrets,
                  service_provider_instance_filters: List[AWSEC2InstanceFilter],
-                 hosted_zone_settings: HostedZoneSettings, utils: WebTestUtils):
-        self._clients = {}
+                 hosted_zone_settings: HostedZoneSettings, utils: WebTestUtils,
+                 aws_clients: Optional[Dict[str, Any]] = None,
+                 resolver_factory: ResolverFactory = dns_resolver):
+        self._clients = dict(aws_clients or {})
+        self._resolver_factory = resolver_factory
+        self._client_lock = threading.Lock()
         self._sp_instance_filters = service_provider_instance_filters
         self._zone_settings = hosted_zone_settings
         self._utils = utils
         self._secrets = test_secrets.env
-        self.service_providers = self._build_sp_configs()
+        self._cache = ControlPlaneCache(utils.settings.test_options.aws_cache_seconds)
+        self.service_providers = self._load_sp_configs()
 
     def _get_lazy_cache_client(self, client: Literal['ec2', 'route53']):
-        if client not in self._clients:
-            self._clients[client] = boto3.client(
-                client,
-                aws_access_key_id=self._secrets['AWS_ACCESS_KEY_ID'].get_secret_value(),
-                aws_secret_access_key=self._secrets['AWS_SECRET_ACCESS_KEY'].get_secret_value()
-            )
+        # Clients are thread-safe once created, but creating them is not.
+        with self._client_lock:
+            if client not in self._clients:
+                self._clients[client] = boto3.client(
+                    client,
+                    aws_access_key_id=self._secrets['AWS_ACCESS_KEY_ID'].get_secret_value(),
+                    aws_secret_access_key=self._secrets['AWS_SECRET_ACCESS_KEY'].get_secret_value()
+                )
         return self._clients[client]
 
-    def _build_sp_configs(self) -> Dict[ServiceProviderInstance, ServiceProviderConfig]:
-        query = DescribeInstancesRequest(filters=self._sp_instance_filters)
-        response = DescribeInstancesResponse.parse_obj(self.ec2_client.describe_instances(**query.request_payload))
+    @TRACER.traced('aws.build_sp_configs')
+    def _build_sp_configs(self, instance_ids: Optional[List[str]] = None
+                          ) -> Dict[ServiceProviderInstance, ServiceProviderConfig]:
+        query = DescribeInstancesRequest(filters=self._sp_instance_filters, instance_ids=instance_ids)
+        inventory = load_inventory(self.ec2_client, query)
         sp_configs = {}
-        for reservation in response.reservations:
-            for instance in reservation.instances:
-                config = ServiceProviderConfig(
-                    instance_id=instance.instance_id,
-                    domain_suffix=self._zone_settings.name,
-                    ref=instance.get_tag('test_ref'),
-                    public_ip=instance.public_ip_address,
-                    last_known_state=instance.state.name
-                )
-                sp_configs[ServiceProviderInstance(config.ref)] = config
+        for sp in inventory.service_providers:
+            # If only terminated (or terminating) instances are left, the config says so, and the SP
+            # can't be used (see `_usable_config`).
+            instance = inventory.preferred(sp) or inventory.instances(sp)[0]
+            sp_configs[sp] =  ServiceProviderConfig(
+                instance_id=instance.instance_id,
+                domain_suffix=self._zone_settings.name,
+                ref=sp.value,
+                public_ip=instance.public_ip,
+                last_known_state=instance.state
+            )
         return sp_configs
 
-    def _get_record_sets(self):
-        client = self._get_lazy_cache_client('route53')
-        record_sets = client.list_resource_record_sets(
+    @property
+    def _sp_configs_cache_key(self) -> str:
+        query = DescribeInstancesRequest(filters=self._sp_instance_filters)
+        digest = hashlib.sha256(
+            json.dumps([query.request_payload, self._zone_settings.name], sort_keys=True).encode()).hexdigest()
+        return f'ec2.sp_configs:{digest[:16]}'
+
+    def _load_sp_configs(self) -> Dict[ServiceProviderInstance, ServiceProviderConfig]:
+        """The SP configs from the cache, if they are fresh; otherwise, from AWS."""
+        configs = self._cache.get(self._sp_configs_cache_key, lambda: self._dump_sp_configs(self._build_sp_configs()))
+        return {
+            ServiceProviderInstance(ref): ServiceProviderConfig.parse_obj(config) for ref, config in configs.items()
+        }
+
+    @staticmethod
+    def _dump_sp_configs(configs: Dict[ServiceProviderInstance, ServiceProviderConfig]) -> Dict[str, Dict]:
+        return {sp.value: json.loads(config.json()) for sp, config in configs.items()}
+
+    def _refresh_sp_configs(self, service_providers: Tuple[ServiceProviderInstance, ...] = ()):
+        """
+        Describes the given instances (or all of them) again, once our changes to them have finished,
+        and saves only what was described to the cache.
+        """
+        since = self._cache.generation()
+        if not service_providers:
+            self.service_providers = self._build_sp_configs()
+            self._cache.put(self._sp_configs_cache_key, self._dump_sp_configs(self.service_providers), since=since)
+            return
+        configs = self._build_sp_configs(self._get_instance_ids(service_providers))
+        self.service_providers.update(configs)
+        self._cache.update(self._sp_configs_cache_key, self._dump_sp_configs(configs), since=since)
+
+    def _a_record_cache_key(self, domain: str) -> str:
+        return f'route53.a_record:{self._zone_settings.id}:{domain}'
+
+    @TRACER.traced('aws.get_a_record')
+    def _get_a_record(self, domain: str) -> Optional[Dict]:
+        """Reads the domain's A record set (if it has one) by name, instead of listing the whole zone."""
+        response = self.route53_client.list_resource_record_sets(
             HostedZoneId=self._zone_settings.id,
+            StartRecordName=domain,
+            StartRecordType='A',
+            MaxItems='1',
         )
-        record_sets = record_sets['ResourceRecordSets']
+        for record in response['ResourceRecordSets']:
+            if record['Name'].rstrip('.') == domain and record['Type'] == 'A':
+                return record
+        return None
+
+    def a_record_sets(self, *service_providers: ServiceProviderInstance) -> List[Dict]:
+        """The A record sets of the given service providers (or all of them, if none are given)."""
+        service_providers = service_providers or tuple(self.service_providers.keys())
+        record_sets = []
+        for sp in service_providers:
+            domain = self._utils.service_provider_domain(sp)
+            record = self._cache.get(self._a_record_cache_key(domain), lambda: self._get_a_record(domain))
+            if record:
+                record_sets.append(record)
         return record_sets
 
+    @TRACER.traced('aws.get_record_sets')
+    def _get_record_sets(self):
+        paginator = self.route53_client.get_paginator('list_resource_record_sets')
+        return [
+            record
+            for page in paginator.paginate(HostedZoneId=self._zone_settings.id)
+            for record in page['ResourceRecordSets']
+        ]
+
     @property
     def record_sets(self) -> List[Dict]:
+        """Every record set in the zone. To check the SPs' records, use `a_record_sets` instead."""
         return self._get_record_sets()
 
+    def _usable_config(self, sp: ServiceProviderInstance) -> ServiceProviderConfig:
+        """The SP's config; raises a RuntimeError if it has no instance, or none that can be used."""
+        config = self.service_providers.get(sp)
+        if not config:
+            raise RuntimeError(f"Test service provider {sp.value} has no instance "
+                               f"(none is tagged {TEST_REF_TAG}={sp.value})")
+        if not is_usable(config.last_known_state):
+            state = config.last_known_state.value if config.last_known_state else 'in an unknown state'
+            raise RuntimeError(f"Test service provider {sp.value} has no instance that can be used "
+                               f"(its instance {config.instance_id} is {state})")
+        return config
+
+    def instance_is_usable(self, sp: ServiceProviderInstance) -> bool:
+        config = self.service_providers.get(sp)
+        return bool(config) and is_usable(config.last_known_state)
+
+    def _usable_service_providers(self) -> Tuple[ServiceProviderInstance, ...]:
+        """Every SP, for the operations that are done to all of them, except those that can't be used."""
+        return tuple(sp for sp in list(self.service_providers.keys()) if self.instance_is_usable(sp))
+
     def dns_record_requires_update(self, record_sets, service_provider):
-        sp = self.service_providers[service_provider]
+        sp = self._usable_config(service_provider)
         domain = self._utils.service_provider_domain(service_provider)
 
         for record in record_sets:
@@ -155,17 +336,19 @@ class ServiceProviderAWSOperations:
     def route53_client(self):
         return self._get_lazy_cache_client('route53')
 
-    def start_instances(self, *service_providers: ServiceProviderInstance, dry_run=False):
+    @TRACER.traced('aws.start_instances')
+    def start_instances(self, *service_providers: ServiceProviderInstance, dry_run=False, wait=True):
         """
         Starts the instances provided (or all of them, if none are provided).
         If dry_run=true, will only validate the call, and not actually
         change anything. This is a blocking function that will not return until the given instances are running
-        (or until the AWS-vended waiter times out).
+        (or until the AWS-vended waiter times out), unless wait=False; in that case, use
+        "wait_for_instances_running()" to wait for them.
 
         Note that this does _not_ change DNS settings, only starts the instances. See "update_instance_a_record()."
         """
         service_providers = service_providers or tuple([
-            sp for sp in self.service_providers.keys() if not self.instance_is_started(sp)
+            sp for sp in self._usable_service_providers() if not self.instance_is_started(sp)
         ])
         if not service_providers:
             logger.info("All instances are already running. Nothing to do!")
@@ -180,22 +363,38 @@ class ServiceProviderAWSOperations:
         with dry_runnable_operation(dry_run):
             self.ec2_client.start_instances(
                 **StartInstancesRequest(instance_ids=instance_ids, dry_run=dry_run).dict(by_alias=True))
+        if not dry_run:
+            self._cache.invalidate(self._sp_configs_cache_key)
 
+        if not wait:
+            return
         logger.info("Waiting for instances to become active.")
         if not dry_run:
-            waiter = self.ec2_client.get_waiter('instance_running')
-            waiter.wait(InstanceIds=instance_ids)
-
-        self.service_providers = self._build_sp_configs()
+            self.wait_for_instances_running(*service_providers)
+        else:
+            self.service_providers = self._build_sp_configs()
         logger.info("All requested instances have started.")
 
+    @TRACER.traced('aws.wait_for_instances_running')
+    def wait_for_instances_running(self, *service_providers: ServiceProviderInstance):
+        """
+        Blocks until the given instances are running, then refreshes what we know about them
+        (e.g., their new public IP addresses). Only the given instances' configs are updated, so this is
+        safe to call for different instances from different threads.
+        """
+        instance_ids = self._get_instance_ids(service_providers)
+        waiter = self.ec2_client.get_waiter('instance_running')
+        waiter.wait(InstanceIds=instance_ids)
+        self._refresh_sp_configs(service_providers)
+
+    @TRACER.traced('aws.stop_instances')
     def stop_instances(self, *service_providers: ServiceProviderInstance, dry_run=False):
         """
         Stops the instances provided (or all of them, if none are provided). If dry_run=True, will only
         validate the call, and not actually change anything. this is a blocking function that will not return until
         the given instances are stopped (or until the AWS-vended waiter times out).
         """
-        service_providers = service_providers or tuple(self.service_providers.keys())
+        service_providers = service_providers or self._usable_service_providers()
         instance_ids = self._get_instance_ids(service_providers)
         logger.info(f"Requesting stop of instances: {instance_ids}")
 
@@ -205,20 +404,22 @@ class ServiceProviderAWSOperations:
 
         logger.info("Waiting for instances to shut down.")
         if not dry_run:
+            self._cache.invalidate(self._sp_configs_cache_key)
             waiter = self.ec2_client.get_waiter('instance_stopped')
             waiter.wait(InstanceIds=instance_ids)
-
-        self.service_providers = self._build_sp_configs()
+            self._refresh_sp_configs()
         logger.info("All requested instances have stopped.")
 
     def _get_instance_ids(self, service_providers: Tuple[ServiceProviderInstance]):
-        return [self.service_providers[sp].instance_id for sp in service_providers]
+        return [self._usable_config(sp).instance_id for sp in service_providers]
 
-    def update_instance_a_records(self, *service_providers: ServiceProviderInstance, dry_run: bool = False):
+    @TRACER.traced('aws.update_instance_a_records')
+    def update_instance_a_records(self, *service_providers: ServiceProviderInstance, dry_run: bool = False,
+                                  wait: bool = True):
         """
         When starting instances, there is no guarantee it will have the same IP address as it had before; this will
         update DNS records for the test service providers and wait for those new IPs to be resolvable before
-        returning.
+        returning (unless wait=False).
 
         If dry_run is true, the changes will be calculated and the payload created, but no call will be submitted
         to AWS (AWS Route53 does not support dry runs like EC2 does).
@@ -226,15 +427,16 @@ class ServiceProviderAWSOperations:
         NB: It may be that this also waits for the changes to have propagated, but if so, is not documented. This call
         sometimes takes a few minutes, but it is unknown whether this is the reason why.
         """
-        service_providers = service_providers or tuple(self.service_providers.keys())
+        service_providers = service_providers or self._usable_service_providers()
+        configs = [self._usable_config(sp) for sp in service_providers]
 
         changes = [
             AWSRoute53RecordSetChange(resource_record_set=AWSRoute53RecordSet(
-                name=self.service_providers[sp].domain,
+                name=config.domain,
                 ttl=60,
-                resource_records=[AWSRoute53ResourceRecord(value=self.service_providers[sp].public_ip)]
+                resource_records=[AWSRoute53ResourceRecord(value=config.public_ip)]
             ))
-            for sp in service_providers
+            for config in configs
         ]
 
         for change in changes:
@@ -249,43 +451,56 @@ class ServiceProviderAWSOperations:
             change_batch=AWSRoute53ChangeBatch(changes=changes),
         )
         response = self.route53_client.change_resource_record_sets(**request.request_payload)
+        self._cache.invalidate(*(self._a_record_cache_key(config.domain) for config in configs))
         request_id = response['ChangeInfo']['Id']
+        if not wait:
+            return
         logger.info("Waiting for DNS configuration to complete.")
         waiter = self.route53_client.get_waiter('resource_record_sets_changed')
         waiter.wait(Id=request_id)
 
+    @TRACER.traced('aws.wait_for_ip_propagation')
     def wait_for_ip_propagation(self, *service_providers: ServiceProviderInstance, dry_run=False):
         """
         Ensures that, for each service provider given (or all of them, if none are given), the SP
-        resolves to the IP address assigned by AWS. This waits for as long as the TTL setting in settings.yaml says it
-        should, plus 10% longer to account for any timing jitter. If the domain still doesn't resolve the provided IP
+        resolves to the IP address assigned by AWS. All of them are checked at the same time (see
+        tests/dns_propagation.py), for as long as the TTL setting in settings.yaml says it should take,
+        plus 10% longer to account for any timing jitter. If a domain still doesn't resolve the provided IP
         address, an error will be raised.
         """
-        service_providers = service_providers or tuple(self.service_providers.keys())
+        service_providers = service_providers or self._usable_service_providers()
         logger.info("Waiting for test service provider DNS settings to propagate")
-        # A TTL of 300 will check every 30 seconds
-        wait_seconds = (self._zone_settings.ttl / 10)
-        # We add wait_seconds to our TTL to account for edge cases with polling and TTL cycles.
-        wait_timeout = self._zone_settings.ttl + wait_seconds
+        targets = {}
         for sp in service_providers:
-            waiter = wait(wait_seconds, wait_timeout)
+            config = self._usable_config(sp)
             # This winds up as something like diafine6.sandbox.iam.s.uw.edu
-            domain = self.service_providers[sp].domain
-            desired_ip = self.service_providers[sp].public_ip
+            domain = config.domain
+            desired_ip = config.public_ip
             logger.info(f"Waiting for {domain} ({desired_ip})")
-            if dry_run:
-                continue
-            try:
-                waiter.poll(lambda ip: ip == desired_ip, lookup_domain_ip, domain)
-            except StopIteration:
-                raise TimeoutError(f"IP address for {domain} never updated to {desired_ip}")
+            targets[domain] = desired_ip
+        if dry_run:
+            return
+        propagation_seconds = wait_for_propagation(targets, zone=self._zone_settings.name, ttl=self._zone_settings.ttl,
+                                                   resolver_factory=self._resolver_factory)
+        for seconds in propagation_seconds.values():
+            METRICS.record('dns.propagation_seconds', seconds)
         logger.info("All requested changes have propagated.")
 
+    def host_pins(self) -> Dict[str, str]:
+        """{domain: public IP} for each running service provider."""
+        return {
+            config.domain: config.public_ip
+            for config in list(self.service_providers.values())
+            if config.public_ip and config.last_known_state == AWSEC2InstanceStateName.RUNNING
+        }
+
     def instance_is_started(self, sp: ServiceProviderInstance):
-        return self.service_providers[sp].last_known_state == AWSEC2InstanceStateName.RUNNING
+        config = self.service_providers.get(sp)
+        return bool(config) and config.last_known_state == AWSEC2InstanceStateName.RUNNING
 
     def instance_is_stopped(self, sp: ServiceProviderInstance):
-        return self.service_providers[sp].last_known_state == AWSEC2InstanceStateName.STOPPED
+        config = self.service_providers.get(sp)
+        return bool(config) and config.last_known_state == AWSEC2InstanceStateName.STOPPED
 
 
 class WebTestUtils:
@@ -300,10 +515,15 @@ class WebTestUtils:
         utils.do_work()
     ```
     """
-    def __init__(self, settings: WebTestSettings, secrets: TestSecrets):
+    def __init__(self, settings: WebTestSettings, secrets: TestSecrets,
+                 aws_clients: Optional[Dict[str, Any]] = None, resolver_factory: ResolverFactory = dns_resolver):
         self._settings = settings
         self._secrets = secrets
+        self._aws_clients = aws_clients
+        self._resolver_factory = resolver_factory
         self._sp_aws_ops = None
+        # Set by the manage_test_service_providers fixture while SPs are being started in the background.
+        self.sp_bootstrap = None
 
     @property
     def sp_aws_operations(self) -> ServiceProviderAWSOperations:
@@ -312,24 +532,49 @@ class WebTestUtils:
                 self._secrets,
                 self._settings.service_provider_instance_filters,
                 self._settings.aws_hosted_zone,
-                self)
+                self,
+                aws_clients=self._aws_clients,
+                resolver_factory=self._resolver_factory)
         return self._sp_aws_ops
 
     @property
     def settings(self):
         return self._settings
 
+    @property
+    def pins_sp_hosts(self) -> bool:
+        return self._settings.test_options.pin_sp_hosts
+
+    def sp_host_pins(self) -> Dict[str, str]:
+        """
+        With `--pin-sp-hosts`, {domain: IP address} for each running test service provider, for
+        browsers and HTTP clients to use instead of DNS. Otherwise, empty.
+        """
+        return self.sp_aws_operations.host_pins() if self.pins_sp_hosts else {}
+
+    def ensure_test_sps_ready(self, *service_providers: ServiceProviderInstance):
+        """
+        Ensures that the given test service providers are turned on.
+        If an SP is being started in the background, this only waits for that SP to be ready.
+        """
+        if self.sp_bootstrap:
+            with METRICS.timer('sp_gate.wait_seconds'):
+                for sp in service_providers:
+                    self.sp_bootstrap.wait_until_ready(sp)
+        need_to_start = [sp for sp in service_providers if not self.sp_aws_operations.instance_is_started(sp)]
+        if need_to_start:
+            self.sp_aws_operations.start_instances(*need_to_start)
+            self.sp_aws_operations.update_instance_a_records(*need_to_start, wait=not self.pins_sp_hosts)
+
     @contextmanager
     def using_test_sp(self, *service_providers: ServiceProviderInstance):
         """
         Ensures that the test service_providers is turned on before the test executes.
+        If the SP is being started in the background, this only waits for that SP to be ready.
         :param service_providers:
         :return:
         """
-        need_to_start = [sp for sp in service_providers if not self.sp_aws_operations.instance_is_started(sp)]
-        if need_to_start:
-            self.sp_aws_operations.start_instances(*need_to_start)
-            self.sp_aws_operations.update_instance_a_records(*need_to_start)
+        self.ensure_test_sps_ready(*service_providers)
         yield
 
     def service_provider_domain(self, service_provider: ServiceProviderInstance) -> str:
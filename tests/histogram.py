@@ -0,0 +1,140 @@
+"""
+Latency histograms in the style of HdrHistogram: values are counted in log-linear buckets
+that are never more than 1% wide (relative to the values in them), so percentiles stay
+accurate no matter how many values are recorded, in a small and bounded amount of memory.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict
+
+# Values below this many microseconds each get their own bucket; above it, buckets double
+# in width every time the values double in size.
+_SUB_BUCKET_COUNT = 256
+_SUB_BUCKET_BITS = _SUB_BUCKET_COUNT.bit_length() - 1
+_HALF_SUB_BUCKET_COUNT = _SUB_BUCKET_COUNT // 2
+
+
+def _bucket_index(micros: int) -> int:
+    if micros < _SUB_BUCKET_COUNT:
+        return micros
+    shift = micros.bit_length() - _SUB_BUCKET_BITS
+    return _SUB_BUCKET_COUNT + (shift - 1) * _HALF_SUB_BUCKET_COUNT + (micros >> shift) - _HALF_SUB_BUCKET_COUNT
+
+
+def _bucket_value(index: int) -> int:
+    """The midpoint of the bucket, in microseconds."""
+    if index < _SUB_BUCKET_COUNT:
+        return index
+    shift, top = divmod(index - _SUB_BUCKET_COUNT, _HALF_SUB_BUCKET_COUNT)
+    shift += 1
+    lowest = (top + _HALF_SUB_BUCKET_COUNT) << shift
+    return lowest + (1 << shift) // 2
+
+
+class LatencyHistogram:
+    """Records durations (in seconds) with microsecond resolution. Safe to record from many threads."""
+    def __init__(self):
+        self._counts: Dict[int, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds: float):
+        index = _bucket_index(max(0, int(seconds * 1e6)))
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def merge(self, other: LatencyHistogram):
+        """Adds the values recorded by the other histogram to this one."""
+        with other._lock:
+            counts = dict(other._counts)
+            count, total, max_seconds = other.count, other.total_seconds, other.max_seconds
+        with self._lock:
+            for index, n in counts.items():
+                self._counts[index] += n
+            self.count += count
+            self.total_seconds += total
+            self.max_seconds = max(self.max_seconds, max_seconds)
+
+    def percentile(self, pct: float) -> float:
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank = max(1, round(pct / 100 * self.count))
+            seen = 0
+            for index in sorted(self._counts):
+                seen += self._counts[index]
+                if seen >= rank:
+                    # The max is exact, so don't report a percentile above it.
+                    return min(_bucket_value(index) / 1e6, self.max_seconds)
+        return self.max_seconds
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'mean': self.total_seconds / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max_seconds,
+        }
+
+
+class StepLatencies:
+    """
+    A histogram and an error count for each named step of a flow:
+
+        steps = StepLatencies()
+        with steps.time('logout'):
+            browser.get(logout_url)
+    """
+    def __init__(self):
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._errors: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def _histogram(self, step: str) -> LatencyHistogram:
+        with self._lock:
+            if step not in self._histograms:
+                self._histograms[step] = LatencyHistogram()
+            return self._histograms[step]
+
+    @contextmanager
+    def time(self, step: str):
+        """Times the step, whether or not it succeeds; counts it as an error if it raises."""
+        histogram = self._histogram(step)
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                self._errors[step] += 1
+            raise
+        finally:
+            histogram.record(time.perf_counter() - start)
+
+    @classmethod
+    def merged(cls, *others: StepLatencies) -> StepLatencies:
+        merged = cls()
+        for other in others:
+            with other._lock:
+                histograms, errors = list(other._histograms.items()), dict(other._errors)
+            for step, histogram in histograms:
+                merged._histogram(step).merge(histogram)
+            for step, n in errors.items():
+                merged._errors[step] += n
+        return merged
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """{step: {count, errors, mean, p50, p90, p99, max}}, in seconds, in the order the steps were first seen."""
+        with self._lock:
+            steps = list(self._histograms.items())
+        return {step: dict(errors=self._errors.get(step, 0), **histogram.summary()) for step, histogram in steps}
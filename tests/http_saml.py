@@ -0,0 +1,258 @@
+"""
+A browserless SAML client, for tests that only need to sign in to an SP and read what it was given.
+
+It follows the same SP-initiated flow a browser does: the SP redirects to the IdP, the IdP's
+sign-in form is filled in and submitted, and the auto-submitting form that relays the SAMLResponse
+back to the SP is posted just as the browser's javascript would have. It can't get past Duo;
+tests that need Duo have to use a browser.
+
+Use:
+    engine = HttpSamlEngine()
+    client = engine.new_client()
+    client.log_in(sp_url, netid, password)
+    page = client.get(f'{sp_url}/server-vars.aspx')
+"""
+from __future__ import annotations
+
+import logging
+from html.parser import HTMLParser
+from typing import Callable, Dict, List, Optional, Set, Union
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from pydantic import BaseModel
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+NETID_INPUT_NAME = 'weblogin_netid'
+# The IdP sends users who need Duo to the Duo Universal Prompt, at https://api-<id>.duosecurity.com/frame/...
+DUO_DOMAIN = 'duosecurity.com'
+
+
+def is_duo_prompt(url: str) -> bool:
+    host = urlsplit(url).hostname or ''
+    return host == DUO_DOMAIN or host.endswith(f'.{DUO_DOMAIN}')
+
+
+class HttpSamlError(Exception):
+    pass
+
+
+class HtmlInput(BaseModel):
+    name: Optional[str]
+    type: str = 'text'
+    value: str = ''
+
+
+class HtmlForm(BaseModel):
+    action: Optional[str]
+    method: str = 'get'
+    inputs: List[HtmlInput] = []
+
+    def has_input(self, name: str) -> bool:
+        return any(i.name == name for i in self.inputs)
+
+    @property
+    def submits_itself(self) -> bool:
+        """True for forms with no visible inputs, which the IdP and SP submit with javascript on page load."""
+        return all(i.type in ('hidden', 'submit') for i in self.inputs)
+
+    def values(self, **overrides: str) -> Dict[str, str]:
+        values = {}
+        submit_seen = False
+        for i in self.inputs:
+            if not i.name:
+                continue
+            if i.type == 'submit':
+                # Like a browser, only send the button that was used to submit the form.
+                if submit_seen:
+                    continue
+                submit_seen = True
+            values[i.name] = i.value
+        values.update(overrides)
+        return values
+
+
+class HtmlPage(HTMLParser):
+    """Only extracts what the SAML flow needs: forms, headings, element ids, and <pre> blocks."""
+    def __init__(self, url: str, html: str):
+        super().__init__(convert_charrefs=True)
+        self.url = url
+        self.forms: List[HtmlForm] = []
+        self.headings: List[str] = []
+        self.pre_blocks: List[str] = []
+        self.element_ids: Set[str] = set()
+        self._text_target: Optional[List[str]] = None
+        self._text: List[str] = []
+        self.feed(html)
+        self.close()
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {k: v if v is not None else '' for k, v in attrs}
+        if attrs.get('id'):
+            self.element_ids.add(attrs['id'])
+        if tag == 'form':
+            self.forms.append(HtmlForm(action=attrs.get('action'), method=attrs.get('method', 'get').lower()))
+        elif tag in ('input', 'button') and self.forms:
+            input_type = attrs.get('type', 'submit' if tag == 'button' else 'text').lower()
+            self.forms[-1].inputs.append(
+                HtmlInput(name=attrs.get('name') or attrs.get('id'), type=input_type, value=attrs.get('value', '')))
+        elif tag in ('h1', 'h2', 'h3'):
+            self._text_target, self._text = self.headings, []
+        elif tag == 'pre':
+            self._text_target, self._text = self.pre_blocks, []
+
+    def handle_endtag(self, tag):
+        if self._text_target is not None and tag in ('h1', 'h2', 'h3', 'pre'):
+            self._text_target.append(''.join(self._text).strip())
+            self._text_target = None
+
+    def handle_data(self, data):
+        if self._text_target is not None:
+            self._text.append(data)
+
+
+def _sign_in_form(page: HtmlPage) -> Optional[HtmlForm]:
+    return next((f for f in page.forms if f.has_input(NETID_INPUT_NAME)), None)
+
+
+class HostPinningAdapter(HTTPAdapter):
+    """
+    Sends requests for the given hosts to fixed IP addresses, like an /etc/hosts entry would, while still
+    sending the real hostname (for SNI and virtual hosting) and verifying the certificate against it.
+    The pins can also be a function that returns the current pins, if they change over time.
+    """
+    def __init__(self, pins: Union[Dict[str, str], Callable[[], Dict[str, str]]], **kwargs):
+        self._get_pins = pins if callable(pins) else (lambda: pins)
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        ip = self._get_pins().get(url.hostname)
+        if not ip:
+            return super().send(request, **kwargs)
+        # Only this copy is sent to the IP; the session keeps the original for its cookies and redirects.
+        pinned = request.copy()
+        pinned.url = url._replace(netloc=f'{ip}:{url.port}' if url.port else ip).geturl()
+        pinned.headers['Host'] = url.netloc
+        response = super().send(pinned, **kwargs)
+        response.request = request
+        response.url = request.url
+        return response
+
+    def _tls_hostname_kwargs(self, url: str) -> Dict[str, str]:
+        ip = urlsplit(url).hostname
+        host = next((host for host, pinned_ip in self._get_pins().items() if pinned_ip == ip), None)
+        return {'server_hostname': host, 'assert_hostname': host} if host else {}
+
+    def get_connection(self, url, proxies=None):
+        pool_kwargs = self._tls_hostname_kwargs(url)
+        if not pool_kwargs or proxies:
+            return super().get_connection(url, proxies)
+        return self.poolmanager.connection_from_url(url, pool_kwargs=pool_kwargs)
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        # Used instead of get_connection by newer versions of requests.
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        pool_kwargs.update(self._tls_hostname_kwargs(request.url))
+        return host_params, pool_kwargs
+
+
+class HttpSamlClient:
+    """
+    Signs in to SPs over plain HTTP. Each client has its own cookie jar (and so its own IdP session),
+    but connections are pooled and kept alive across all clients from the same engine.
+    """
+    max_steps = 10
+
+    def __init__(self, adapter: HTTPAdapter, timeout: float = 30):
+        self._session = requests.Session()
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        self._timeout = timeout
+
+    def get(self, url: str) -> HtmlPage:
+        response = self._session.get(url, timeout=self._timeout)
+        response.raise_for_status()
+        return HtmlPage(response.url, response.text)
+
+    def _submit(self, page: HtmlPage, form: HtmlForm, **overrides: str) -> HtmlPage:
+        url = urljoin(page.url, form.action or page.url)
+        values = form.values(**overrides)
+        if form.method == 'post':
+            response = self._session.post(url, data=values, timeout=self._timeout)
+        else:
+            response = self._session.get(url, params=values, timeout=self._timeout)
+        response.raise_for_status()
+        return HtmlPage(response.url, response.text)
+
+    def log_in(self, url: str, netid: str, password: str) -> HtmlPage:
+        """
+        Visits the SP URL and signs in as the given netid when the IdP asks. Returns the page the
+        SP shows once the flow is done.
+        """
+        return self.sign_in(self.get(url), netid, password)
+
+    def sign_in(self, page: HtmlPage, netid: str, password: str) -> HtmlPage:
+        """
+        Continues the flow from a page that was already fetched (e.g., the IdP's sign-in page): signs in
+        as the given netid when the IdP asks, and relays any auto-submitted forms. Returns the page the SP
+        shows once the flow is done.
+        """
+        return self.relay(self.submit_password(page, netid, password), netid)
+
+    def submit_password(self, page: HtmlPage, netid: str, password: str) -> HtmlPage:
+        """
+        The first half of `sign_in`: follows any auto-submitted forms to the IdP's sign-in form, and
+        submits it as the given netid. Returns the IdP's answer, or, if the IdP didn't ask (e.g.,
+        because of an existing IdP session), the page the flow got to.
+        """
+        page = self._relay_until_sign_in_form(page, netid)
+        login_form = _sign_in_form(page)
+        if not login_form:
+            return page
+        password_input = next((i.name for i in login_form.inputs if i.type == 'password'), None)
+        if not password_input:
+            raise HttpSamlError(f"The sign-in form at {page.url} has no password input.")
+        return self._submit(page, login_form, **{NETID_INPUT_NAME: netid, password_input: password})
+
+    def relay(self, page: HtmlPage, netid: str) -> HtmlPage:
+        """
+        The second half of `sign_in`: relays the auto-submitted forms (e.g., the SAMLResponse) back to the
+        SP. Returns the page the SP shows once the flow is done.
+        """
+        page = self._relay_until_sign_in_form(page, netid)
+        if _sign_in_form(page):
+            raise HttpSamlError(f"The IdP did not accept the password for {netid}.")
+        return page
+
+    def _relay_until_sign_in_form(self, page: HtmlPage, netid: str) -> HtmlPage:
+        url = page.url
+        for _ in range(self.max_steps):
+            if is_duo_prompt(page.url):
+                raise HttpSamlError(f"{netid} was sent to the Duo prompt ({page.url}), which requires a browser.")
+            if _sign_in_form(page) or not (page.forms and page.forms[0].submits_itself):
+                return page
+            logger.debug(f"Relaying auto-submitted form from {page.url}")
+            page = self._submit(page, page.forms[0])
+        raise HttpSamlError(f"Gave up signing in from {url} after {self.max_steps} steps; last page was {page.url}")
+
+
+class HttpSamlEngine:
+    """
+    Creates clients that share a pool of keep-alive connections. If pins ({hostname: ip}) are given,
+    the clients' requests for those hosts go to those IP addresses, regardless of DNS.
+    """
+    def __init__(self, pool_size: int = 10,
+                 pins: Optional[Union[Dict[str, str], Callable[[], Dict[str, str]]]] = None):
+        if pins:
+            self._adapter = HostPinningAdapter(pins, pool_connections=pool_size, pool_maxsize=pool_size)
+        else:
+            self._adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+
+    def new_client(self) -> HttpSamlClient:
+        return HttpSamlClient(self._adapter)
+
+    def close(self):
+        self._adapter.close()
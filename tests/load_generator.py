@@ -0,0 +1,315 @@
+"""
+Puts sustained login load on the IdP, for use by tests/test_generate_requests.py.
+
+Each virtual user signs in to and out of the UW Directory in a loop, as its own test account
+(as long as there are enough of them), with its own browser (or HTTP session) and so its own cookies. Virtual users are scheduled on an asyncio event loop;
+their blocking browser and HTTP calls run on a thread pool with one thread per user, so
+`concurrency` users really are signing in at the same time.
+
+The time each step of a login/logout cycle takes is recorded in a histogram per step (see
+`tests/histogram.py`), so you can see which hop of the IdP flow slows down under load.
+
+Virtual users can also be spread across a list of IdP nodes, by pinning the IdP's hostname to
+a node's IP address for each virtual user; results are then reported for each node.
+"""
+from __future__ import annotations
+
+import abc
+import asyncio
+import json
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from webdriver_recorder.browser import BrowserRecorder, By, Locator
+
+from .helpers import lookup_domain_ip
+from .histogram import StepLatencies
+from .http_saml import HttpSamlClient, HttpSamlError
+from .metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+LOGIN_URL = 'https://directory.uw.edu/saml/login'
+LOGOUT_URL = 'https://directory.uw.edu/saml/logout'
+# Only present on the directory page when a user is signed in.
+SIGNED_IN_ELEMENT_ID = 'population-option-all'
+
+# The steps of a login/logout cycle, as they are named in the latency report.
+STEP_LOGIN_PAGE = 'login_page'  # Loading saml/login, through to the IdP's sign-in page
+STEP_SUBMIT_NETID = 'submit_netid'  # Submitting the weblogin_netid form
+STEP_SIGNED_IN = 'signed_in'  # Getting back to the directory as a signed-in user
+STEP_LOGOUT = 'logout'
+
+
+class VirtualUser(abc.ABC):
+    def __init__(self, netid: str, password: str, steps: StepLatencies):
+        self._netid = netid
+        self._password = password
+        self._steps = steps
+
+    @abc.abstractmethod
+    def log_in(self) -> bool:
+        """Returns whether the user ended up signed in."""
+
+    @abc.abstractmethod
+    def log_out(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class BrowserVirtualUser(VirtualUser):
+    def __init__(self, browser: BrowserRecorder, netid: str, password: str, steps: StepLatencies):
+        super().__init__(netid, password, steps)
+        self._browser = browser
+
+    def log_in(self) -> bool:
+        browser = self._browser
+        with self._steps.time(STEP_LOGIN_PAGE):
+            browser.get(LOGIN_URL)
+        try:  # User may not be prompted to sign in, that's OK, we're still going through the IdP
+            with self._steps.time(STEP_SUBMIT_NETID):
+                browser.click(Locator(search_method=By.ID, search_value='weblogin_netid'))
+                browser.send_inputs(self._netid, self._password)
+                browser.click(Locator(search_method=By.ID, search_value='submit_button'))
+        except Exception:
+            browser.snap()
+        try:
+            with self._steps.time(STEP_SIGNED_IN):
+                browser.wait_for(Locator(search_method=By.ID, search_value=SIGNED_IN_ELEMENT_ID))
+            return True
+        except Exception:
+            browser.snap()
+            return False
+
+    def log_out(self):
+        with self._steps.time(STEP_LOGOUT):
+            self._browser.get(LOGOUT_URL)
+        self._browser.snap()
+
+    def close(self):
+        self._browser.quit()
+
+
+class HttpVirtualUser(VirtualUser):
+    def __init__(self, client: HttpSamlClient, netid: str, password: str, steps: StepLatencies):
+        super().__init__(netid, password, steps)
+        self._client = client
+
+    def log_in(self) -> bool:
+        with self._steps.time(STEP_LOGIN_PAGE):
+            page = self._client.get(LOGIN_URL)
+        with self._steps.time(STEP_SUBMIT_NETID):
+            page = self._client.submit_password(page, self._netid, self._password)
+        # Like the browser's wait for the directory, this includes relaying the SAML response back to it.
+        with self._steps.time(STEP_SIGNED_IN):
+            page = self._client.relay(page, self._netid)
+            if SIGNED_IN_ELEMENT_ID not in page.element_ids:
+                raise HttpSamlError(f"{self._netid} is not signed in at {page.url}")
+        return True
+
+    def log_out(self):
+        with self._steps.time(STEP_LOGOUT):
+            self._client.get(LOGOUT_URL)
+
+
+class IdpNode:
+    """An IdP node that virtual users can be pinned to. With no ip, virtual users go wherever DNS sends them."""
+    def __init__(self, name: str, ip: Optional[str] = None):
+        self.name = name
+        self.ip = ip
+
+
+IDP_NODE_PATTERN = re.compile(r'^idp(eval)?[0-9]+$')
+
+
+def resolve_idp_nodes(hosts: List[str]) -> List[IdpNode]:
+    """
+    Accepts hosts in the form of idpXX (e.g., idp14, idpeval11), the same way as
+    scripts/get-idp-ip-address.sh, and looks up their IP addresses. IP addresses, and hosts that
+    were already resolved (idp14=10.0.0.14), are used as-is.
+    """
+    nodes = []
+    for host in hosts:
+        if '=' in host:
+            name, ip = (part.strip() for part in host.split('=', maxsplit=1))
+            if not (name and ip):
+                # Without its ip, the node's virtual users would silently go through the load balancer.
+                raise ValueError(f"Invalid IdP host: {host} (expected something like idp14=10.0.0.14)")
+            nodes.append(IdpNode(name, ip))
+            continue
+        if re.match(r'^[0-9.]+$', host):
+            nodes.append(IdpNode(host, host))
+            continue
+        if not IDP_NODE_PATTERN.match(host):
+            raise ValueError(f"Invalid IdP host format: {host} (expected something like idp14 or idpeval11)")
+        ip = lookup_domain_ip(f'{host}.s.uw.edu')
+        if not ip:
+            raise ValueError(f"No ip address found for {host}")
+        logger.info(f"Resolved IdP node {host} to {ip}")
+        nodes.append(IdpNode(host, ip))
+    return nodes
+
+
+class VirtualUserStats:
+    def __init__(self, user_id: int, netid: str, node: IdpNode):
+        self.user_id = user_id
+        self.netid = netid
+        self.node = node
+        self.cycles = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+
+    @property
+    def cycles_per_minute(self) -> float:
+        return 60 * self.cycles / self.busy_seconds if self.busy_seconds else 0.0
+
+
+class LoadReport:
+    def __init__(self, users: List[VirtualUserStats], nodes: List[IdpNode], steps_by_node: Dict[str, StepLatencies],
+                 elapsed_seconds: float):
+        self.users = users
+        self.nodes = nodes
+        self.steps_by_node = steps_by_node
+        self.steps = StepLatencies.merged(*steps_by_node.values())
+        self.elapsed_seconds = elapsed_seconds
+
+    def _totals(self, users: List[VirtualUserStats]) -> Dict[str, float]:
+        cycles = sum(u.cycles for u in users)
+        return {
+            'users': len(users),
+            'cycles': cycles,
+            'errors': sum(u.errors for u in users),
+            'cycles_per_minute': 60 * cycles / self.elapsed_seconds if self.elapsed_seconds else 0.0,
+        }
+
+    @property
+    def cycles(self) -> int:
+        return self._totals(self.users)['cycles']
+
+    @property
+    def errors(self) -> int:
+        return self._totals(self.users)['errors']
+
+    @property
+    def cycles_per_minute(self) -> float:
+        return self._totals(self.users)['cycles_per_minute']
+
+    @property
+    def error_rate(self) -> float:
+        """The fraction of login cycles that failed."""
+        return self.errors / self.cycles if self.cycles else 0.0
+
+    @staticmethod
+    def _step_lines(title: str, steps: StepLatencies) -> List[str]:
+        lines = [f'\n{title:<14} {"count":>6} {"errors":>7} {"p50":>8} {"p90":>8} {"p99":>8} {"max":>8}']
+        for step, stats in steps.summary().items():
+            lines.append(f'{step:<14} {stats["count"]:>6} {stats["errors"]:>7} {stats["p50"]:>8.3f} '
+                         f'{stats["p90"]:>8.3f} {stats["p99"]:>8.3f} {stats["max"]:>8.3f}')
+        return lines
+
+    def summary(self) -> str:
+        lines = [f'{"user":>6} {"netid":<10} {"node":<16} {"cycles":>7} {"errors":>7} {"cycles/min":>11}']
+        for u in self.users:
+            lines.append(f'{u.user_id:>6} {u.netid:<10} {u.node.name:<16} {u.cycles:>7} {u.errors:>7} '
+                         f'{u.cycles_per_minute:>11.2f}')
+        if len(self.nodes) > 1:
+            for node in self.nodes:
+                totals = self._totals([u for u in self.users if u.node is node])
+                lines.append(f'{"node":>6} {"":<10} {node.name:<16} {totals["cycles"]:>7} {totals["errors"]:>7} '
+                             f'{totals["cycles_per_minute"]:>11.2f}')
+        lines.append(f'{"total":>6} {"":<10} {"":<16} {self.cycles:>7} {self.errors:>7} '
+                     f'{self.cycles_per_minute:>11.2f} ({len(self.users)} users, {self.elapsed_seconds:.1f}s)')
+        if len(self.nodes) > 1:
+            for node in self.nodes:
+                lines.extend(self._step_lines(node.name, self.steps_by_node[node.name]))
+        lines.extend(self._step_lines('all steps' if len(self.nodes) > 1 else 'step', self.steps))
+        return '\n'.join(lines)
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'concurrency': len(self.users),
+            'elapsed_seconds': self.elapsed_seconds,
+            **{k: v for k, v in self._totals(self.users).items() if k != 'users'},
+            'error_rate': self.error_rate,
+            'steps': self.steps.summary(),
+            'nodes': {
+                node.name: {
+                    'ip': node.ip,
+                    **self._totals([u for u in self.users if u.node is node]),
+                    'steps': self.steps_by_node[node.name].summary(),
+                }
+                for node in self.nodes
+            },
+        }, indent=2)
+
+
+class LoadEngine:
+    """
+    Runs `concurrency` virtual users, each doing `num_loops` login/logout cycles, and
+    sleeping `sleep_time` seconds between cycles. The virtual users are given the netids in turn;
+    if there are fewer netids than virtual users, some netids are used by more than one.
+    If IdP nodes are given, virtual users are spread evenly across them, and latencies are kept
+    separately for each node. If given, `on_cycle` is called with the stats of every virtual user
+    each time one of them finishes a cycle.
+    """
+    def __init__(self, user_factory: Callable[[str, IdpNode, StepLatencies], VirtualUser], netids: List[str],
+                 concurrency: int, num_loops: int, sleep_time: float, nodes: Optional[List[IdpNode]] = None,
+                 on_cycle: Optional[Callable[[List[VirtualUserStats]], None]] = None):
+        if not netids:
+            raise ValueError("At least one netid is needed")
+        self._user_factory = user_factory
+        self._netids = netids
+        self._on_cycle = on_cycle
+        self._stats: List[VirtualUserStats] = []
+        self._nodes = nodes or [IdpNode('default')]
+        self._steps_by_node = {node.name: StepLatencies() for node in self._nodes}
+        self._concurrency = concurrency
+        self._num_loops = num_loops
+        self._sleep_time = sleep_time
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='virtual-user')
+
+    def run(self) -> LoadReport:
+        start = time.perf_counter()
+        try:
+            users = asyncio.run(self._run_all())
+        finally:
+            self._executor.shutdown()
+        return LoadReport(users, self._nodes, self._steps_by_node, time.perf_counter() - start)
+
+    async def _run_all(self) -> List[VirtualUserStats]:
+        return list(await asyncio.gather(*(self._run_user(i) for i in range(self._concurrency))))
+
+    async def _run_user(self, user_id: int) -> VirtualUserStats:
+        loop = asyncio.get_running_loop()
+        node = self._nodes[user_id % len(self._nodes)]
+        netid = self._netids[user_id % len(self._netids)]
+        stats = VirtualUserStats(user_id, netid, node)
+        self._stats.append(stats)
+        user = await loop.run_in_executor(self._executor, self._user_factory, netid, node,
+                                          self._steps_by_node[node.name])
+        try:
+            for i in range(self._num_loops):
+                start = time.perf_counter()
+                try:
+                    if not await loop.run_in_executor(self._executor, user.log_in):
+                        stats.errors += 1
+                    await loop.run_in_executor(self._executor, user.log_out)
+                except Exception as e:
+                    logger.warning(f"Virtual user {user_id} failed a login cycle: {e}")
+                    stats.errors += 1
+                elapsed = time.perf_counter() - start
+                stats.cycles += 1
+                stats.busy_seconds += elapsed
+                METRICS.record('load.cycle_seconds', elapsed)
+                if self._on_cycle:
+                    self._on_cycle(self._stats)
+                if i < self._num_loops - 1:
+                    await asyncio.sleep(self._sleep_time)
+        finally:
+            await loop.run_in_executor(self._executor, user.close)
+        return stats
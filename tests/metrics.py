@@ -0,0 +1,110 @@
+"""
+Timing measurements that are summarized at the end of a test session.
+
+Measurements are attached to the `user_properties` of the test that is running when they
+are recorded. Pytest copies these onto each test report, which lets them survive the trip
+from pytest-xdist workers back to the controlling process, where the summary is printed.
+
+Use:
+    from tests.metrics import METRICS
+
+    with METRICS.timer('some_operation_seconds'):
+        do_work()
+"""
+from __future__ import annotations
+
+import math
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import pytest
+
+METRIC_PROPERTY_PREFIX = 'idp_metric:'
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of the given (not necessarily sorted) values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class MetricsRecorder:
+    """
+    Registered as a pytest plugin in conftest.py. Keeps track of the test that is currently
+    running so that fixtures of any scope can attribute their measurements to it.
+    """
+    def __init__(self):
+        self._current_item: Optional[pytest.Item] = None
+        self._per_test_metrics = set()
+
+    def report_per_test(self, *names: str):
+        """In addition to the totals, the summary will list the tests with the highest values for these metrics."""
+        self._per_test_metrics.update(names)
+
+    def record(self, name: str, value: float):
+        """Attributes the value to the currently running test. Ignored outside of a test."""
+        if self._current_item is not None:
+            self._current_item.user_properties.append((f'{METRIC_PROPERTY_PREFIX}{name}', value))
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    @pytest.hookimpl(hookwrapper=True, tryfirst=True)
+    def pytest_runtest_protocol(self, item):
+        self._current_item = item
+        try:
+            yield
+        finally:
+            self._current_item = None
+
+    @staticmethod
+    def collect(terminalreporter) -> Dict[str, List[Tuple[str, float]]]:
+        """Returns {metric_name: [(test_nodeid, value), ...]} for every finished test."""
+        results = defaultdict(list)
+        for reports in terminalreporter.stats.values():
+            for report in reports:
+                # The teardown report is the last one produced for a test, so it
+                # holds every measurement that test recorded.
+                if getattr(report, 'when', None) != 'teardown':
+                    continue
+                for key, value in getattr(report, 'user_properties', []):
+                    if isinstance(key, str) and key.startswith(METRIC_PROPERTY_PREFIX):
+                        results[key[len(METRIC_PROPERTY_PREFIX):]].append((report.nodeid, value))
+        return results
+
+    def pytest_terminal_summary(self, terminalreporter):
+        results = self.collect(terminalreporter)
+        if not results:
+            return
+        terminalreporter.write_sep('=', 'idp test metrics')
+        terminalreporter.write_line(
+            f'{"metric":<44} {"count":>6} {"total":>10} {"mean":>9} {"p90":>9} {"max":>9}')
+        for name in sorted(results):
+            values = [value for _, value in results[name]]
+            terminalreporter.write_line(
+                f'{name:<44} {len(values):>6} {sum(values):>10.2f} {sum(values) / len(values):>9.3f} '
+                f'{percentile(values, 90):>9.3f} {max(values):>9.3f}'
+            )
+        for name in sorted(self._per_test_metrics & set(results)):
+            per_test = defaultdict(float)
+            for nodeid, value in results[name]:
+                per_test[nodeid] += value
+            top = sorted(per_test.items(), key=lambda kv: kv[1], reverse=True)[:10]
+            top = [(nodeid, value) for nodeid, value in top if value >= 0.01]
+            if top:
+                terminalreporter.write_line(f'\nHighest {name}:')
+                for nodeid, value in top:
+                    terminalreporter.write_line(f'  {value:>9.2f}  {nodeid}')
+
+
+METRICS = MetricsRecorder()
@@ -5,6 +5,8 @@ from typing import List, Dict, NoReturn, Optional, Any
 from pydantic import BaseModel, Field, Extra, BaseSettings, SecretStr, validator
 import inflection
 
+from .snap_policy import SnapPolicy
+
 
 # Enums
 
@@ -103,6 +105,27 @@ class TestEnvironment(Enum):
     eval = 'eval'
 
 
+class AttributeMode(Enum):
+    browser = 'browser'
+    http = 'http'
+
+
+class WaitEngine(Enum):
+    observe = 'observe'
+    poll = 'poll'
+
+
+class ScreenshotFormat(Enum):
+    png = 'png'
+    webp = 'webp'
+    jpeg = 'jpeg'
+
+
+class ScreenshotHash(Enum):
+    exact = 'exact'
+    perceptual = 'perceptual'
+
+
 class TestOptions(BaseSettings):
     class Config:
         use_enum_values = True
@@ -131,6 +154,51 @@ class TestOptions(BaseSettings):
     uwca_key_filename: Optional[str] = None
     
     reuse_chromedriver: int = 4444
+    aws_cache_seconds: int = Field(
+        60, description="How long the test SP instances and DNS records read from AWS are reused, by this and "
+                        "later runs (and sp_manager.py), unless we change them. Set to 0 to always read them. "
+                        "See tests/control_plane_cache.py")
+    pin_sp_hosts: bool = Field(
+        False, description="Send browsers and HTTP clients straight to each test SP's instance IP, as soon as it is "
+                           "running, instead of waiting for its DNS record to propagate. The DNS records are still "
+                           "updated, in the background.")
+    grid_max_sessions: int = Field(
+        0, description="The most browser sessions the test run may have on the selenium grid at once. If 0 (the "
+                       "default), the number of free slots the grid reports. See tests/grid_admission.py")
+    browser_pool_size: int = Field(
+        2, description="The number of warm browser sessions each test worker keeps available between tests. "
+                       "Set to 0 to create a new browser session for every test.")
+    browser_pool_max_leases: int = Field(
+        20, description="The number of tests a pooled browser session may be used for before it is replaced.")
+    attribute_mode: AttributeMode = Field(
+        AttributeMode.browser.value,
+        description="How attribute release tests sign in to SPs: 'browser', or 'http' to use a browserless "
+                    "HTTP client. Tests that need Duo always use a browser.")
+    attribute_fan_out_concurrency: int = Field(
+        3, description="The most browsers (or HTTP sessions) one attribute release test uses at the same time "
+                       "to read attributes from several SPs. Set to 1 to read them one after another.")
+    sso_session_max_age: int = Field(
+        900, description="How long (in seconds) an IdP SSO session recorded by one access control test may be "
+                         "reused by later ones, instead of signing in again. Set to 0 to always sign in. "
+                         "See tests/sso_sessions.py")
+    wait_engine: WaitEngine = Field(
+        WaitEngine.observe.value,
+        description="How browsers wait for elements: 'observe' (in the page, with a MutationObserver), or 'poll' "
+                    "(with WebDriverWait). See tests/dom_waits.py")
+    report_refresh_seconds: int = Field(
+        30, description="How often the report is re-rendered while the tests are running. See tests/report_stream.py")
+    snap_policy: str = Field(
+        'always', description="Which screenshots to take: 'always', 'on-failure' (only when a test fails), "
+                              "or 'sampled:N' (every Nth one). See tests/snap_policy.py")
+    screenshot_format: ScreenshotFormat = Field(
+        ScreenshotFormat.webp.value,
+        description="The format screenshots are stored in, in the report. See tests/screenshot_store.py")
+    screenshot_quality: int = Field(
+        80, description="The quality (1-100) of screenshots stored as webp or jpeg.")
+    screenshot_hash: ScreenshotHash = Field(
+        ScreenshotHash.exact.value,
+        description="'exact' to store identical screenshots once, or 'perceptual' to also store screenshots "
+                    "that look the same once.")
 
     @classmethod
     def parse_overrides(cls, test_config):
@@ -155,6 +223,10 @@ class TestOptions(BaseSettings):
             if option_type is bool:
                 action = 'store_false' if option_default is True else 'store_true'
                 kwargs['action'] = action
+            elif option_type in (int, float):
+                kwargs['type'] = option_type
+            elif isinstance(option_type, type) and issubclass(option_type, Enum):
+                kwargs['choices'] = [member.value for member in option_type]
 
             parser.addoption(option_name, **kwargs)
 
@@ -164,6 +236,17 @@ class TestOptions(BaseSettings):
             raise ValueError("use_local_secrets is on, but no local filename was provided.")
         return v
 
+    @validator('screenshot_quality')
+    def validate_screenshot_quality(cls, v):
+        if not 1 <= v <= 100:
+            raise ValueError(f"screenshot_quality must be between 1 and 100, not {v}")
+        return v
+
+    @validator('snap_policy')
+    def validate_snap_policy(cls, v):
+        SnapPolicy.parse(v)
+        return v
+
 
 class WebTestSettings(BaseSettings):
     """See settings.yaml for documentation on these settings"""
@@ -0,0 +1,214 @@
+"""
+Times the test SP orchestration end to end, against the AWS stand-in (see `tests/aws_standin.py`)
+instead of AWS, for 1 up to N service providers, so that changes to the orchestration can be
+compared offline. Each run starts from a fresh fleet in which every SP instance is stopped (or, for
+`sp-manager-stop`, running) and every SP's DNS record has an old address.
+
+Scenarios:
+    bootstrap:         What `manage_test_service_providers` does: a ServiceProviderBootstrap,
+                       until every SP's gate is open.
+    bootstrap-pinned:  The same, with `--pin-sp-hosts`.
+    lazy:              What tests do with `--skip-test-service-provider-start`: each SP is
+                       started by `using_test_sp`, one after the other.
+    sp-manager-start:  `python -m tests.sp_manager start`
+    sp-manager-stop:   `python -m tests.sp_manager stop`
+
+Use:
+    python -m tests.orchestration_benchmark orchestration --max-service-providers 7 --boot-seconds 45
+
+`python -m tests.orchestration_benchmark inventory` times how long reading the SP inventory from
+`describe_instances` (see `tests/sp_inventory.py`) takes for fleets of 10, 100, and 1000 instances,
+compared with validating the whole response with `DescribeInstancesResponse`.
+"""
+from __future__ import annotations
+
+import itertools
+import json
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import click
+
+from .aws_standin import AwsStandIn, StandInLatencies
+from .helpers import WebTestUtils, load_settings
+from .models import (AWSEC2InstanceStateName, DescribeInstancesRequest, DescribeInstancesResponse,
+                     ServiceProviderInstance, TestSecrets)
+from .sp_bootstrap import ServiceProviderBootstrap
+from .sp_inventory import load_inventory
+from .sp_manager import start_service_providers
+
+logger = logging.getLogger(__name__)
+
+
+def _bootstrap(utils: WebTestUtils, service_providers: List[ServiceProviderInstance], pin_hosts: bool = False):
+    bootstrap = ServiceProviderBootstrap(utils.sp_aws_operations, service_providers, pin_hosts=pin_hosts)
+    bootstrap.start()
+    try:
+        for sp in service_providers:
+            bootstrap.wait_until_ready(sp)
+    finally:
+        bootstrap.shutdown()
+
+
+def _lazy(utils: WebTestUtils, service_providers: List[ServiceProviderInstance]):
+    for sp in service_providers:
+        with utils.using_test_sp(sp):
+            pass
+
+
+SCENARIOS: Dict[str, Callable[[WebTestUtils, List[ServiceProviderInstance]], None]] = {
+    'bootstrap': _bootstrap,
+    'bootstrap-pinned': lambda utils, sps: _bootstrap(utils, sps, pin_hosts=True),
+    'lazy': _lazy,
+    'sp-manager-start': lambda utils, sps: start_service_providers(utils.sp_aws_operations, *sps),
+    'sp-manager-stop': lambda utils, sps: utils.sp_aws_operations.stop_instances(*sps),
+}
+
+
+class BenchmarkResult:
+    def __init__(self, scenario: str, num_service_providers: int, seconds: float, calls: Dict[str, int]):
+        self.scenario = scenario
+        self.num_service_providers = num_service_providers
+        self.seconds = seconds
+        self.calls = calls
+
+    def to_dict(self) -> Dict:
+        return {'scenario': self.scenario, 'service_providers': self.num_service_providers,
+                'seconds': self.seconds, 'calls': self.calls}
+
+
+def run_scenario(settings_file: str, settings_env: str, scenario: str, num_service_providers: int,
+                 latencies: StandInLatencies) -> BenchmarkResult:
+    # Nothing from (or for) the real AWS account may end up in the shared control plane cache.
+    settings = load_settings(settings_file, settings_env, {'aws_cache_seconds': 0,
+                                                           'pin_sp_hosts': scenario == 'bootstrap-pinned'})
+    stand_in = AwsStandIn(settings.aws_hosted_zone, latencies)
+    initial_state = (AWSEC2InstanceStateName.RUNNING if scenario == 'sp-manager-stop'
+                     else AWSEC2InstanceStateName.STOPPED)
+    stand_in.add_service_providers(*ServiceProviderInstance, state=initial_state)
+    service_providers = list(ServiceProviderInstance)[:num_service_providers]
+    secrets = TestSecrets.construct(env={})
+    start = time.perf_counter()
+    utils = WebTestUtils(settings, secrets, aws_clients=stand_in.clients(), resolver_factory=stand_in.resolver)
+    SCENARIOS[scenario](utils, service_providers)
+    return BenchmarkResult(scenario, num_service_providers, time.perf_counter() - start, dict(stand_in.calls))
+
+
+def report(results: List[BenchmarkResult]) -> List[str]:
+    lines = [f'{"scenario":<18} {"SPs":>4} {"seconds":>9} {"AWS calls":>10}']
+    for result in results:
+        lines.append(f'{result.scenario:<18} {result.num_service_providers:>4} {result.seconds:>9.2f} '
+                     f'{sum(result.calls.values()):>10}')
+    return lines
+
+
+def _fleet(settings_file: str, settings_env: str, size: int,
+           page_size: int) -> Tuple[AwsStandIn, DescribeInstancesRequest]:
+    """
+    A fleet of `size` instances, tagged like the ones in the account: three quarters are replicas of
+    the test SPs, the rest belong to something else. Each has a handful of other tags, as ours do.
+    """
+    settings = load_settings(settings_file, settings_env)
+    stand_in = AwsStandIn(settings.aws_hosted_zone, StandInLatencies(api_seconds=0), describe_page_size=page_size)
+    sps = itertools.cycle(ServiceProviderInstance)
+    states = itertools.cycle([AWSEC2InstanceStateName.RUNNING, AWSEC2InstanceStateName.STOPPED])
+    for i in range(size):
+        tags = {'Name': f'instance-{i}', 'owner': 'iam', 'environment': 'sandbox', 'cost_center': 'uwit-iam',
+                'use_case': 'idp-web-tests', 'test_ref': next(sps).value if i % 4 else f'other-{i}'}
+        stand_in.add_instance(tags, next(states))
+    return stand_in, DescribeInstancesRequest(filters=settings.service_provider_instance_filters)
+
+
+def _validate_response(stand_in: AwsStandIn, query: DescribeInstancesRequest) -> int:
+    """How the inventory used to be read: a single page, validated with DescribeInstancesResponse."""
+    response = DescribeInstancesResponse.parse_obj(stand_in.describe_instances(**query.request_payload))
+    return sum(
+        1 for reservation in response.reservations for instance in reservation.instances
+        if instance.get_tag('test_ref') in ServiceProviderInstance.__members__
+    )
+
+
+def _best_seconds(func: Callable[[], object], repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--settings-file', default='settings.yaml')
+@click.option('--settings-env', default='base')
+@click.option('--fleet-size', 'fleet_sizes', multiple=True, type=int, default=(10, 100, 1000),
+              help="Can be given more than once.")
+@click.option('--page-size', default=500, help="The most instances the stand-in returns in a page.")
+@click.option('--repeat', default=5, help="Report the fastest of this many loads.")
+def inventory(settings_file: str, settings_env: str, fleet_sizes: List[int], page_size: int, repeat: int):
+    """
+    For each fleet size, reports how many SP instances were found, and how long the fastest load took,
+    both ways; the first page alone (validated) can miss instances.
+    """
+    click.echo(f'{"instances":>9} {"validated: SPs":>14} {"ms":>8} {"streamed: SPs":>13} {"pages":>5} {"ms":>8}')
+    for size in fleet_sizes:
+        stand_in, query = _fleet(settings_file, settings_env, size, page_size)
+        ec2_client = stand_in.clients()['ec2']
+        validated = _validate_response(stand_in, query)
+        streamed = load_inventory(ec2_client, query)
+        validated_seconds = _best_seconds(lambda: _validate_response(stand_in, query), repeat)
+        streamed_seconds = _best_seconds(lambda: load_inventory(ec2_client, query), repeat)
+        click.echo(f'{size:>9} {validated:>14} {validated_seconds * 1000:>8.2f} '
+                   f'{streamed.num_instances:>13} {streamed.num_pages:>5} {streamed_seconds * 1000:>8.2f}')
+
+
+@cli.command()
+@click.option('--settings-file', default='settings.yaml')
+@click.option('--settings-env', default='base')
+@click.option('--scenario', 'scenarios', multiple=True, type=click.Choice(list(SCENARIOS)),
+              help="Can be given more than once; all scenarios are run by default.")
+@click.option('--max-service-providers', default=len(ServiceProviderInstance),
+              type=click.IntRange(1, len(ServiceProviderInstance)))
+@click.option('--api-seconds', default=0.05, help="How long each AWS call takes.")
+@click.option('--boot-seconds', default=4.0, help="How long an instance takes to start running.")
+@click.option('--stop-seconds', default=2.0, help="How long an instance takes to stop.")
+@click.option('--change-sync-seconds', default=2.0, help="How long a Route53 change takes to sync.")
+@click.option('--propagation-seconds', default=3.0,
+              help="How long after syncing the local resolver keeps the old address.")
+@click.option('--ec2-waiter-seconds', default=1.0, help="How often EC2 waiters poll.")
+@click.option('--route53-waiter-seconds', default=2.0, help="How often Route53 waiters poll.")
+@click.option('--output', default=None, help="Also write the results, with the calls made to each AWS "
+                                             "operation, to this JSON file.")
+def orchestration(settings_file: str, settings_env: str, scenarios: List[str], max_service_providers: int,
+         api_seconds: float, boot_seconds: float, stop_seconds: float, change_sync_seconds: float,
+         propagation_seconds: float, ec2_waiter_seconds: float, route53_waiter_seconds: float,
+         output: Optional[str]):
+    latencies = StandInLatencies(
+        api_seconds=api_seconds, boot_seconds=boot_seconds, stop_seconds=stop_seconds,
+        change_sync_seconds=change_sync_seconds, propagation_seconds=propagation_seconds,
+        ec2_waiter_seconds=ec2_waiter_seconds, route53_waiter_seconds=route53_waiter_seconds,
+    )
+    results = []
+    for scenario in scenarios or SCENARIOS:
+        for n in range(1, max_service_providers + 1):
+            result = run_scenario(settings_file, settings_env, scenario, n, latencies)
+            logger.info(f"{scenario} with {n} service providers: {result.seconds:.2f}s")
+            results.append(result)
+    for line in report(results):
+        click.echo(line)
+    if output:
+        with open(output, 'w') as f:
+            json.dump([result.to_dict() for result in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s: %(message)s", level=logging.INFO)
+    logging.getLogger('tests').setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+    cli()
@@ -0,0 +1,198 @@
+"""
+Checks many conditions on a page with one WebDriver command, instead of one (or more)
+commands for each `wait_for_tag`, `find_element`, or `get_cookies`.
+
+    elements = check_page(
+        browser,
+        tag_with_text('h1', 'query parameters'),
+        element_with_text(Locator(search_method=By.XPATH, search_value='(//p)[2]'), 'fname = Joe'),
+        cookie('uw-rememberme-sptest03'),
+    )
+
+All conditions on the page are checked at once, in the page. If some aren't met yet, one
+more command waits for just those, in the page (see tests/dom_waits.py), for up to
+`timeout` seconds (the browser's default wait if not given; 0 to not wait at all).
+Cookies can't always be seen from the page (e.g., HttpOnly cookies), so cookie conditions
+are checked with `get_cookies`, and polled if they aren't met.
+
+If any condition isn't met in time, a BrowserError lists the ones that weren't. Otherwise,
+the element each condition found is returned, in order (None for cookie conditions). Like
+the browser's waits, a screenshot is taken afterwards, unless autocapture is off.
+"""
+from __future__ import annotations
+
+import time
+from typing import Any, Dict, List, Optional
+
+from selenium.common.exceptions import JavascriptException
+from webdriver_recorder.browser import BrowserRecorder, Locator, XPathWithSubstringLocator
+
+from .dom_waits import CLICKABLE, FIND_ELEMENT_JS, PRESENT, SCRIPT_TIMEOUT_MARGIN_SECONDS, VISIBLE, DomWaitMixin, \
+    page_lookup
+from .metrics import METRICS
+
+_CHECK_ELEMENT_JS = FIND_ELEMENT_JS + """
+function idpCheck(condition) {
+    var element = idpFindElement(condition.lookup, condition.state);
+    if (!element) {
+        return null;
+    }
+    if (condition.value !== null && element.value !== condition.value) {
+        return null;
+    }
+    if (condition.text !== null && (element.innerText || element.textContent || '').indexOf(condition.text) < 0) {
+        return null;
+    }
+    return element;
+}
+"""
+
+_CHECK_JS = _CHECK_ELEMENT_JS + """
+return arguments[0].map(idpCheck);
+"""
+
+_AWAIT_JS = _CHECK_ELEMENT_JS + """
+var conditions = arguments[0], timeoutMs = arguments[1], done = arguments[arguments.length - 1];
+var results = conditions.map(function () { return null; }), finished = false, observer, timer, interval;
+function finish() {
+    finished = true;
+    if (observer) { observer.disconnect(); }
+    clearTimeout(timer);
+    clearInterval(interval);
+    done(results);
+}
+function check() {
+    if (finished) { return; }
+    var pending = 0;
+    conditions.forEach(function (condition, i) {
+        results[i] = results[i] || idpCheck(condition);
+        if (!results[i]) { pending++; }
+    });
+    if (!pending) { finish(); }
+}
+check();
+if (!finished) {
+    observer = new MutationObserver(check);
+    observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    interval = setInterval(check, 250);
+    timer = setTimeout(function () { if (!finished) { finish(); } }, timeoutMs);
+}
+"""
+
+_COOKIE_POLL_SECONDS = 0.5
+
+
+class PageCondition:
+    def __init__(self, description: str, spec: Optional[Dict[str, Any]] = None, cookie_name: Optional[str] = None,
+                 cookie_present: bool = True):
+        self.description = description
+        self.spec = spec
+        self.cookie_name = cookie_name
+        self.cookie_present = cookie_present
+
+    @property
+    def in_page(self) -> bool:
+        return self.spec is not None
+
+
+def _element_spec(locator: Locator, state: str, value: Optional[str] = None, text: Optional[str] = None):
+    lookup = page_lookup(locator)
+    if not lookup:
+        raise ValueError(f"Can't check for {locator.description} in the page")
+    return dict(lookup=lookup, state=state, value=value, text=text)
+
+
+def tag_with_text(tag: str, text: str) -> PageCondition:
+    """The same as `browser.wait_for_tag(tag, text)`: a visible tag containing the text, in any case."""
+    locator = XPathWithSubstringLocator(tag=tag, displayed_substring=text)
+    return PageCondition(locator.description, _element_spec(locator, VISIBLE))
+
+
+def element(locator: Locator, state: str = VISIBLE) -> PageCondition:
+    """An element that is present, visible (the default), or clickable."""
+    if state not in (PRESENT, VISIBLE, CLICKABLE):
+        raise ValueError(f"Invalid element state: {state}")
+    return PageCondition(f'{locator.description} is {state}', _element_spec(locator, state))
+
+
+def element_with_text(locator: Locator, text: str) -> PageCondition:
+    """A visible element whose text contains the text (case-sensitive)."""
+    return PageCondition(f'{locator.description} contains "{text}"', _element_spec(locator, VISIBLE, text=text))
+
+
+def element_value(locator: Locator, value: str) -> PageCondition:
+    """An element (e.g., an input) whose value is the value."""
+    return PageCondition(f'{locator.description} has the value "{value}"', _element_spec(locator, PRESENT, value=value))
+
+
+def cookie(name: str, present: bool = True) -> PageCondition:
+    return PageCondition(f'cookie {name} is {"present" if present else "absent"}',
+                         cookie_name=name, cookie_present=present)
+
+
+def _check_in_page(browser: BrowserRecorder, conditions: List[PageCondition], deadline: float) -> List[Any]:
+    specs = [c.spec for c in conditions]
+    results = browser.execute_script(_CHECK_JS, specs)
+    while not all(results):
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        pending = [i for i, result in enumerate(results) if not result]
+        timeout = remaining + SCRIPT_TIMEOUT_MARGIN_SECONDS
+        if isinstance(browser, DomWaitMixin):
+            browser.ensure_script_timeout(timeout)
+        else:
+            browser.set_script_timeout(timeout)
+        try:
+            found = browser.execute_async_script(_AWAIT_JS, [specs[i] for i in pending], int(remaining * 1000))
+        except JavascriptException:
+            # The page navigated away while waiting; check again in the new page.
+            time.sleep(0.1)
+            results = browser.execute_script(_CHECK_JS, specs)
+            continue
+        for i, result in zip(pending, found):
+            results[i] = result
+        break
+    return results
+
+
+def _check_cookies(browser: BrowserRecorder, conditions: List[PageCondition], deadline: float) -> List[bool]:
+    while True:
+        names = {c['name'] for c in browser.get_cookies()}
+        results = [(c.cookie_name in names) == c.cookie_present for c in conditions]
+        if all(results) or time.perf_counter() + _COOKIE_POLL_SECONDS > deadline:
+            return results
+        time.sleep(_COOKIE_POLL_SECONDS)
+
+
+def check_page(browser: BrowserRecorder, *conditions: PageCondition, timeout: Optional[float] = None,
+               caption: Optional[str] = None) -> List[Any]:
+    timeout = browser.default_wait if timeout is None else timeout
+    start = time.perf_counter()
+    deadline = start + timeout
+    commands_before = getattr(browser, 'command_count', 0)
+    description = '; '.join(c.description for c in conditions)
+    results: List[Any] = [None] * len(conditions)
+    met = [False] * len(conditions)
+    with browser.wrap_exception(f'Checking that {description}'):
+        passed = False
+        try:
+            in_page = [i for i, c in enumerate(conditions) if c.in_page]
+            if in_page:
+                for i, result in zip(in_page, _check_in_page(browser, [conditions[i] for i in in_page], deadline)):
+                    results[i] = result
+                    met[i] = bool(result)
+            cookies = [i for i, c in enumerate(conditions) if not c.in_page]
+            if cookies:
+                for i, result in zip(cookies, _check_cookies(browser, [conditions[i] for i in cookies], deadline)):
+                    met[i] = result
+            unmet = [c.description for c, m in zip(conditions, met) if not m]
+            if unmet:
+                raise AssertionError(f"Not met after {timeout}s: {'; '.join(unmet)}")
+            passed = True
+        finally:
+            METRICS.record('page_check.commands', getattr(browser, 'command_count', 0) - commands_before)
+            METRICS.record('page_check.seconds', time.perf_counter() - start)
+            if browser.autocapture or not passed:
+                browser.snap(caption=caption or f'Check that {description}', is_error=not passed)
+    return results
@@ -0,0 +1,173 @@
+"""
+Writes the test report as the tests run, instead of only at the end of the session.
+
+webdriver_recorder keeps every test's result in memory until the session is over. Instead,
+as each test finishes, its result is appended to `<report dir>/results/<worker>.jsonl` and
+dropped from memory, and every `--report-refresh-seconds`, `index.html` is re-rendered from
+the results of all workers so far. A partial report can be opened while the run is still
+going. Each results file is only read as far as it has grown since the last render.
+
+While a test is running, the report is also re-rendered every `--report-refresh-seconds`, with
+an entry for the running test (and its screenshots so far), so that a single long test (e.g.,
+the login request generator) has a partial report too. Tests can describe their progress in
+that entry with `describe_progress`.
+
+At the end of the session, each worker hands its results back (parsing only what it hasn't
+already), so that webdriver_recorder can produce the final report as usual.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import pytest
+from webdriver_recorder.browser import BrowserRecorder
+from webdriver_recorder.models import Outcome, Report, TestResult
+from webdriver_recorder.report_exporter import ReportExporter
+
+logger = logging.getLogger(__name__)
+
+RESULTS_DIRECTORY = 'results'
+RESULTS_SUFFIX = '.jsonl'
+
+
+class StreamingReportWriter:
+    """
+    Registered as a pytest plugin in conftest.py, and started by the `report_stream` fixture.
+    """
+    def __init__(self):
+        self._report: Optional[Report] = None
+        self._report_dir: Optional[str] = None
+        self._results_file: Optional[str] = None
+        self._refresh_seconds = 30
+        self._last_render = 0.0
+        self._exporter: Optional[ReportExporter] = None
+        self._render_lock = threading.Lock()
+        # The results read from each results file so far, and how far into the file they go.
+        self._parsed: Dict[str, List[TestResult]] = {}
+        self._offsets: Dict[str, int] = {}
+        self._running: Optional[TestResult] = None
+
+    @property
+    def _results_dir(self) -> str:
+        return os.path.join(self._report_dir, RESULTS_DIRECTORY)
+
+    def start(self, report_dir: str, report: Report, refresh_seconds: int):
+        self._report = report
+        self._report_dir = report_dir
+        self._refresh_seconds = refresh_seconds
+        os.makedirs(self._results_dir, exist_ok=True)
+        worker = os.environ.get('PYTEST_XDIST_WORKER', 'main')
+        self._results_file = os.path.join(self._results_dir, f'{worker}{RESULTS_SUFFIX}')
+        if os.path.exists(self._results_file):  # Left behind by an earlier run that didn't finish
+            os.remove(self._results_file)
+        self._exporter = ReportExporter()
+        self._exporter.export_static(report_dir)
+        self._last_render = time.monotonic()
+
+    def _flush(self):
+        results = self._report.results
+        if not results:
+            return
+        with open(self._results_file, 'a') as f:
+            for result in results:
+                f.write(result.json(exclude={'pngs': {'__all__': {'base64'}}}) + '\n')
+        results.clear()
+
+    def _read_results(self, filename: str) -> List[TestResult]:
+        """All the results in the file, parsing only the lines added since it was last read."""
+        results = self._parsed.setdefault(filename, [])
+        offset = self._offsets.get(filename, 0)
+        try:
+            with open(filename, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:  # Another worker finished in the meantime; what was read is still good.
+            return results
+        # The worker may be halfway through writing its last line.
+        complete = data.rfind(b'\n') + 1
+        results.extend(TestResult.parse_raw(line) for line in data[:complete].splitlines() if line.strip())
+        self._offsets[filename] = offset + complete
+        return results
+
+    def describe_progress(self, description: str):
+        """Shown for the running test in the partial report; e.g., how far along it is."""
+        if self._running:
+            self._running.test_description = description
+
+    def render(self):
+        """Re-renders index.html with the results of all workers so far, and the running test's, if any."""
+        with self._render_lock:
+            filenames = {
+                os.path.join(self._results_dir, f) for f in os.listdir(self._results_dir)
+                if f.endswith(RESULTS_SUFFIX)
+            }
+            results = [result for filename in sorted(filenames | set(self._parsed))
+                       for result in self._read_results(filename)]
+            running = self._running
+            if running:
+                # The report template needs an end time; the running test's is 'so far'.
+                results.append(running.copy(update={'pngs': list(BrowserRecorder.pngs), 'end_time': datetime.now()}))
+            partial = self._report.copy(update={
+                'results': results,
+                'title': f'{self._report.title} (in progress)',
+            })
+            temp_filename = f'index.html.{os.getpid()}.tmp'
+            self._exporter.export_html(partial, self._report_dir, dest_filename=temp_filename)
+            os.replace(os.path.join(self._report_dir, temp_filename), os.path.join(self._report_dir, 'index.html'))
+            self._last_render = time.monotonic()
+
+    def finish(self):
+        """Gives this worker's results back to webdriver_recorder, for the final report."""
+        if not self._report:
+            return
+        self._flush()
+        with self._render_lock:
+            self._report.results[:] = self._read_results(self._results_file)
+            self._parsed.clear()
+            self._offsets.clear()
+        if os.path.exists(self._results_file):
+            os.remove(self._results_file)
+        self._report = None
+
+    def _render_while_running(self, done: threading.Event):
+        while not done.wait(self._refresh_seconds):
+            try:
+                self.render()
+            except Exception as e:
+                logger.warning(f"Could not update the report: {e}")
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item):
+        if not self._report:
+            yield
+            return
+        self._running = TestResult(test_name=item.nodeid, test_description='Still running',
+                                   outcome=Outcome.never_started)
+        done = threading.Event()
+        threading.Thread(target=self._render_while_running, args=(done,), name='report-stream', daemon=True).start()
+        try:
+            yield
+        finally:
+            done.set()
+            self._running = None
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_teardown(self, item):
+        yield
+        # webdriver_recorder has added the test's result by now.
+        if not self._report:
+            return
+        self._flush()
+        if time.monotonic() - self._last_render >= self._refresh_seconds:
+            try:
+                self.render()
+            except Exception as e:
+                logger.warning(f"Could not update the report: {e}")
+
+
+REPORT_STREAM = StreamingReportWriter()
@@ -0,0 +1,47 @@
+"""
+The directories that the processes of a test run (the pytest-xdist controller and its workers) use
+to coordinate with each other: the SP bootstrap's gates, account leases, and grid admission.
+
+Each is `<tmp>/uw-idp-web-tests/<kind>/<run id>`. The controller picks the run id before the workers
+start (see `start_test_run`), and removes the run's directories when the run ends (`end_test_run`).
+"""
+import os
+import shutil
+import tempfile
+import uuid
+
+ROOT = os.path.join(tempfile.gettempdir(), 'uw-idp-web-tests')
+KINDS = ('sp-bootstrap', 'account-leases', 'grid-admission')
+
+_RUN_ID_VARIABLE = 'PYTEST_XDIST_TESTRUNUID'
+
+
+def run_id() -> str:
+    """The id shared by every process of the test run."""
+    value = os.environ.get(_RUN_ID_VARIABLE)
+    if os.environ.get('PYTEST_XDIST_WORKER'):
+        # Without it, every worker would coordinate only with itself.
+        assert value, f"{_RUN_ID_VARIABLE} must be set for pytest-xdist workers"
+    return value or str(os.getpid())
+
+
+def run_dir(kind: str) -> str:
+    assert kind in KINDS, kind
+    return os.path.join(ROOT, kind, run_id())
+
+
+def start_test_run(config):
+    """
+    For the controller (or the only process, without xdist): picks the run id, and hands it to the
+    workers (as `--testrunuid`, which xdist passes on as PYTEST_XDIST_TESTRUNUID).
+    """
+    value = getattr(config.option, 'testrunuid', None) or os.environ.get(_RUN_ID_VARIABLE) or uuid.uuid4().hex
+    if hasattr(config.option, 'testrunuid'):
+        config.option.testrunuid = value
+    os.environ[_RUN_ID_VARIABLE] = value
+
+
+def end_test_run():
+    """For the controller: removes the run's directories, once every worker is done with them."""
+    for kind in KINDS:
+        shutil.rmtree(run_dir(kind), ignore_errors=True)
@@ -0,0 +1,149 @@
+"""
+Stores the screenshots in a test report once for each distinct image, in a compact format.
+
+Storyboards hold many copies of the same frames (e.g., the IdP's sign-in page, and Duo),
+so at the end of each test, every screenshot it took is keyed by a hash of its contents
+and pointed at `screenshots/<hash>.<format>`. Only the first screenshot with a given key is
+written; it is re-encoded (to WebP or JPEG, at `--screenshot-quality`) by a background
+thread while the tests keep running.
+
+With `--screenshot-hash exact` (the default), only byte-for-byte identical screenshots share
+a file. With `--screenshot-hash perceptual`, screenshots of the same size that look the
+same when scaled down (see `perceptual_hash`) share a file too; this also catches frames
+that only differ by a blinking cursor or a spinner.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import io
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import pytest
+from PIL import Image as PILImage
+from webdriver_recorder.browser import BrowserRecorder
+from webdriver_recorder.models import Image
+
+from .models import ScreenshotFormat, ScreenshotHash
+
+logger = logging.getLogger(__name__)
+
+SCREENSHOTS_DIRECTORY = 'screenshots'
+_PERCEPTUAL_REDUCTION = 4
+
+
+def perceptual_hash(image: PILImage.Image) -> str:
+    """
+    A hash of the image scaled down to a quarter of its size, in 16 shades of gray. Small
+    differences (a cursor, anti-aliasing) mostly disappear in the thumbnail; text does not.
+    """
+    thumbnail = image.convert('L').reduce(_PERCEPTUAL_REDUCTION).point(lambda p: p >> 4)
+    return f'{hashlib.sha256(thumbnail.tobytes()).hexdigest()}-{image.width}x{image.height}'
+
+
+def encode(png: bytes, image_format: ScreenshotFormat, quality: int) -> bytes:
+    if image_format is ScreenshotFormat.png:
+        return png
+    image = PILImage.open(io.BytesIO(png))
+    output = io.BytesIO()
+    if image_format is ScreenshotFormat.jpeg:
+        image.convert('RGB').save(output, format='JPEG', quality=quality, optimize=True)
+    else:
+        image.save(output, format='WEBP', quality=quality, method=4)
+    return output.getvalue()
+
+
+class ScreenshotStore:
+    """
+    Registered as a pytest plugin in conftest.py, and started by the `screenshot_store` fixture
+    once the settings are known. Until then, screenshots are left for webdriver_recorder to save.
+    """
+    def __init__(self):
+        self._directory: Optional[str] = None
+        self._image_format = ScreenshotFormat.png
+        self._quality = 80
+        self._hash = ScreenshotHash.exact
+        self._urls: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: List[Future] = []
+        self.screenshots = 0
+        self.original_bytes = 0
+        self.stored_bytes = 0
+
+    @staticmethod
+    def clean(report_dir: str):
+        """Removes the screenshots of an earlier run."""
+        directory = os.path.join(report_dir, SCREENSHOTS_DIRECTORY)
+        if os.path.isdir(directory):
+            for filename in os.listdir(directory):
+                os.remove(os.path.join(directory, filename))
+
+    def start(self, report_dir: str, image_format: ScreenshotFormat, quality: int, hash_mode: ScreenshotHash):
+        self._directory = os.path.join(report_dir, SCREENSHOTS_DIRECTORY)
+        os.makedirs(self._directory, exist_ok=True)
+        self._image_format = ScreenshotFormat(image_format)
+        self._quality = quality
+        self._hash = ScreenshotHash(hash_mode)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='screenshot-store')
+
+    def add(self, image: Image):
+        """Points the image at its file in the store, and drops its image data from memory."""
+        if not self._executor or not image.base64:
+            return
+        png = base64.b64decode(image.base64.encode('UTF-8'))
+        if self._hash is ScreenshotHash.perceptual:
+            key = perceptual_hash(PILImage.open(io.BytesIO(png)))
+        else:
+            key = hashlib.sha256(png).hexdigest()
+        with self._lock:
+            self.screenshots += 1
+            self.original_bytes += len(png)
+            url = self._urls.get(key)
+            if url is None:
+                url = self._urls[key] = f'{SCREENSHOTS_DIRECTORY}/{key}.{self._image_format.value}'
+                self._pending.append(self._executor.submit(self._write, png, url))
+        image.url = url
+        image.base64 = None
+
+    def _write(self, png: bytes, url: str):
+        filename = os.path.join(os.path.dirname(self._directory), url)
+        if os.path.exists(filename):  # Already stored by another pytest-xdist worker
+            return
+        data = encode(png, self._image_format, self._quality)
+        temp_filename = f'{filename}.{os.getpid()}.tmp'
+        with open(temp_filename, 'wb') as f:
+            f.write(data)
+        os.replace(temp_filename, filename)
+        with self._lock:
+            self.stored_bytes += len(data)
+
+    def flush(self):
+        """Waits for the screenshots that are still being encoded to be written."""
+        if not self._executor:
+            return
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for future in pending:
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Could not store a screenshot: {e}")
+        self._executor.shutdown()
+        self._executor = None
+        logger.info(f"Stored {self.screenshots} screenshots as {len(self._urls)} {self._image_format.value} files; "
+                    f"{self.original_bytes / 1e6:.1f}MB of PNG data became {self.stored_bytes / 1e6:.1f}MB")
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_teardown(self, item):
+        # webdriver_recorder gathers up the test's screenshots during teardown.
+        for image in BrowserRecorder.pngs:
+            self.add(image)
+        yield
+
+
+SCREENSHOT_STORE = ScreenshotStore()
@@ -11,6 +11,7 @@ from pydantic import BaseModel
 
 from tests.helpers import load_settings
 from tests.models import SecretManagerSettings
+from tests.tracing import TRACER
 
 SecretModelType = TypeVar('SecretModelType', bound=BaseModel)
 
@@ -34,6 +35,7 @@ class SecretManager:
         )
         return self.client.add_secret_version(request=request)
 
+    @TRACER.traced('secret_manager.get_secret_data')
     def get_secret_data(self, model_type: Optional[Type[SecretModelType]] = None) -> SecretModelType:
         response = self.client.access_secret_version(name=self._settings.canonical_version_name)
         data = response.payload.data.decode('UTF-8')
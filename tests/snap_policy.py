@@ -0,0 +1,216 @@
+"""
+Decides which of the screenshots that tests (and webdriver_recorder, after every page load and
+wait) ask for are actually taken. Each screenshot resizes the window and sends a full-page PNG
+over the wire, so a green run that takes hundreds of them spends a lot of its time doing that.
+Set the policy with `--snap-policy`:
+
+    always        Take every screenshot (the default).
+    on-failure    Only take screenshots of errors. For the last few screenshots that were skipped,
+                  only the caption and URL are kept; if the test fails, they are written to
+                  <report dir>/pages/<test>/trail.txt, along with the source of the page the test
+                  failed on (page.html), and a screenshot of that page is added to the report.
+    sampled:N     Take the first screenshot, and every Nth one after that, plus all screenshots
+                  of errors. Skipped screenshots are handled as for on-failure.
+
+Browsers created by the `get_fresh_browser` fixture follow the policy. The number of screenshots
+taken and the time spent taking them are included in the `idp test metrics` summary.
+
+A test can use several browsers at once, on threads of its own (e.g., the attribute fan-out). The
+pages each browser visited are kept separately, screenshots are taken one at a time, and the failure
+is saved for the browser passed to `blame_on_failure` whose block raised, if any; otherwise for
+the browser that last asked for a screenshot on the main thread.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import re
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional
+
+import pytest
+from selenium.common.exceptions import WebDriverException
+from webdriver_recorder.browser import BrowserRecorder
+from webdriver_recorder.models import Image
+
+from .metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+ALWAYS = 'always'
+ON_FAILURE = 'on-failure'
+SAMPLED = 'sampled'
+
+# The number of skipped pages remembered for each test.
+RECENT_PAGE_COUNT = 5
+
+
+class SnapPolicy:
+    def __init__(self, name: str, every: int = 1):
+        self.name = name
+        self.every = every
+
+    def __str__(self):
+        return f'{self.name}:{self.every}' if self.name == SAMPLED else self.name
+
+    @classmethod
+    def parse(cls, value: str) -> SnapPolicy:
+        value = (value or ALWAYS).strip()
+        if value in (ALWAYS, ON_FAILURE):
+            return cls(value)
+        match = re.match(rf'^{SAMPLED}:([0-9]+)$', value)
+        if match and int(match.group(1)) > 0:
+            return cls(SAMPLED, int(match.group(1)))
+        raise ValueError(f"Invalid snap policy: {value} (expected '{ALWAYS}', '{ON_FAILURE}' or '{SAMPLED}:N')")
+
+    def should_capture(self, requested: int) -> bool:
+        """Whether to take the `requested`th (counting from 1) screenshot a test asks for."""
+        if self.name == ALWAYS:
+            return True
+        if self.name == SAMPLED:
+            return (requested - 1) % self.every == 0
+        return False
+
+
+class RecentPage:
+    def __init__(self, caption: Optional[str], url: str):
+        self.caption = caption
+        self.url = url
+
+
+class SnapshotController:
+    """
+    Registered as a pytest plugin in conftest.py. Counts the screenshots each test asks for,
+    and remembers where the ones that were skipped would have been taken until the test is over.
+    """
+    def __init__(self):
+        self.policy = SnapPolicy(ALWAYS)
+        self._lock = threading.Lock()
+        # BrowserRecorder.pngs is shared by every browser, so only one screenshot is taken at a time.
+        self._capture_lock = threading.Lock()
+        self._requested = 0
+        self._recent_pages: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._last_browser: Optional[weakref.ref] = None
+        self._failed_browser: Optional[weakref.ref] = None
+        # The pages the failed browser visited, kept in case it is gone by the time the failure is saved.
+        self._failed_pages: List[RecentPage] = []
+        self._capture_listeners: List[Callable[[Image], None]] = []
+
+    def configure(self, policy: str):
+        self.policy = SnapPolicy.parse(policy)
+
+    def on_capture(self, listener: Callable[[Image], None]):
+        """The listener is called with each screenshot, as soon as it is taken."""
+        self._capture_listeners.append(listener)
+
+    def snap(self, browser: BrowserRecorder, capture, caption: Optional[str], is_error: bool):
+        """Takes the screenshot (by calling `capture`) if the policy says so."""
+        with self._lock:
+            self._requested += 1
+            take = is_error or self.policy.should_capture(self._requested)
+            if threading.current_thread() is threading.main_thread():
+                self._last_browser = weakref.ref(browser)
+        start = time.perf_counter()
+        if take:
+            with self._capture_lock:
+                pngs = BrowserRecorder.pngs
+                taken = len(pngs)
+                capture()
+                images = pngs[taken:]
+            for image in images:
+                for listener in self._capture_listeners:
+                    listener(image)
+            METRICS.record('snap.count', 1)
+            METRICS.record('snap.capture_seconds', time.perf_counter() - start)
+            return
+        try:
+            page = RecentPage(caption, browser.current_url)
+        except WebDriverException as e:
+            logger.debug(f"Could not keep the page for a skipped screenshot: {e}")
+        else:
+            with self._lock:
+                pages = self._recent_pages.setdefault(browser, deque(maxlen=RECENT_PAGE_COUNT))
+                pages.append(page)
+        METRICS.record('snap.skipped_seconds', time.perf_counter() - start)
+
+    @contextmanager
+    def blame_on_failure(self, browser: BrowserRecorder) -> Iterator[None]:
+        """
+        For browsers used off the main thread: if the block raises, the failure of the test is saved for
+        this browser (the first one to fail, if several do).
+        """
+        try:
+            yield
+        except BaseException:
+            with self._lock:
+                if self._failed_browser is None:
+                    self._failed_browser = weakref.ref(browser)
+                    self._failed_pages = list(self._recent_pages.get(browser, ()))
+            raise
+
+    def _reset(self):
+        with self._lock:
+            self._requested = 0
+            self._recent_pages.clear()
+            self._last_browser = None
+            self._failed_browser = None
+            self._failed_pages = []
+
+    def _save_failure(self, item: pytest.Item):
+        with self._lock:
+            if self._failed_browser:
+                browser, pages = self._failed_browser(), self._failed_pages
+            else:
+                browser = self._last_browser() if self._last_browser else None
+                pages = list(self._recent_pages.get(browser, ())) if browser is not None else []
+            self._recent_pages.clear()
+        source = None
+        if browser is not None:
+            try:
+                browser.snap(caption='The page when the test failed', is_error=True)
+            except WebDriverException as e:
+                logger.warning(f"Could not take a screenshot of the failure: {e}")
+            try:
+                source = browser.page_source
+            except WebDriverException as e:
+                logger.warning(f"Could not get the source of the page the test failed on: {e}")
+        if not pages and source is None:
+            return
+        directory = os.path.join(item.config.getoption('report_dir'), 'pages', re.sub(r'[^\w.-]+', '_', item.nodeid))
+        os.makedirs(directory, exist_ok=True)
+        if pages:
+            with open(os.path.join(directory, 'trail.txt'), 'w') as f:
+                f.writelines(f'{page.url}  {page.caption or ""}\n' for page in pages)
+        if source is not None:
+            with open(os.path.join(directory, 'page.html'), 'w') as f:
+                f.write(source)
+        logger.info(f"Saved the last {len(pages)} pages {item.nodeid} visited, and the page it failed on, "
+                    f"to {directory}")
+
+    @pytest.hookimpl(hookwrapper=True, tryfirst=True)
+    def pytest_runtest_protocol(self, item):
+        self._reset()
+        try:
+            yield
+        finally:
+            self._reset()
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(self, item, call):
+        outcome = yield
+        report = outcome.get_result()
+        # webdriver_recorder collects the test's screenshots during teardown, so this is still in time.
+        if report.failed and report.when in ('setup', 'call') and self.policy.name != ALWAYS:
+            self._save_failure(item)
+
+
+SNAPSHOTS = SnapshotController()
+
+
+class SnapPolicyMixin:
+    def snap(self, caption: Optional[str] = None, is_error: bool = False):
+        SNAPSHOTS.snap(self, lambda: super(SnapPolicyMixin, self).snap(caption, is_error), caption, is_error)
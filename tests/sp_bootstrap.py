@@ -0,0 +1,315 @@
+"""
+Brings up the test service providers in the background, so that tests don't have to wait for all of
+them before any test can run.
+
+Each service provider gets a readiness gate, which opens once its instance is running and its DNS
+record resolves to the instance's IP address (or, with `--pin-sp-hosts`, as soon as its instance
+is running; its DNS record is then updated in the background). `WebTestUtils.using_test_sp` waits
+only on the gates of the service providers a test uses, so tests whose service providers are
+already running start right away.
+
+DNS records that need updating are updated together, in as few Route53 changes as possible: an SP
+whose record is out of date waits a few seconds (`_BATCH_WINDOW_SECONDS`) for the others still
+being brought up to join its change (see `_RecordUpdateBatcher`).
+
+When running in parallel, only one pytest-xdist worker (the first to ask) brings up the service
+providers, for the whole test run (see `join_test_run_bootstrap`); it publishes each gate as a file
+in a directory shared by the run, and the other workers wait on those files instead.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional
+
+import pytest
+
+from .models import ServiceProviderInstance
+from .run_dirs import run_dir
+from .tracing import TRACER
+
+if TYPE_CHECKING:
+    from .helpers import ServiceProviderAWSOperations
+
+logger = logging.getLogger(__name__)
+
+_LEADER_FILE = 'leader'
+_POLL_SECONDS = 0.5
+_BATCH_WINDOW_SECONDS = 5.0
+
+
+class _RecordUpdateBatch:
+    def __init__(self):
+        self.service_providers: List[ServiceProviderInstance] = []
+        self.is_full = threading.Event()
+        self.is_done = threading.Event()
+        self.error: Optional[BaseException] = None
+
+
+class _RecordUpdateBatcher:
+    """
+    Collects the SPs whose DNS records need updating into a single Route53 change. The first SP to
+    ask opens a batch and sends it once every SP that might still join has (or has said it won't),
+    or after `window_seconds`; the others wait for the batch they joined.
+    """
+    def __init__(self, sp_aws_operations: ServiceProviderAWSOperations,
+                 service_providers: Iterable[ServiceProviderInstance], window_seconds: float):
+        self._ops = sp_aws_operations
+        self._undecided = set(service_providers)
+        self._window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._open: Optional[_RecordUpdateBatch] = None
+
+    def _decide(self, sp: ServiceProviderInstance):
+        self._undecided.discard(sp)
+        if self._open and not self._undecided:
+            self._open.is_full.set()
+
+    def skip(self, sp: ServiceProviderInstance):
+        """The SP's record doesn't need updating; batches no longer wait for it."""
+        with self._lock:
+            self._decide(sp)
+
+    def update(self, sp: ServiceProviderInstance):
+        """Updates the SP's record, along with those of any other SPs that need it soon; blocks until in sync."""
+        with self._lock:
+            batch = self._open
+            is_sender = batch is None
+            if is_sender:
+                batch = self._open = _RecordUpdateBatch()
+            batch.service_providers.append(sp)
+            self._decide(sp)
+        if is_sender:
+            batch.is_full.wait(self._window_seconds)
+            with self._lock:
+                self._open = None
+            try:
+                with TRACER.span('sp_bootstrap.update_dns_records', count=len(batch.service_providers)):
+                    self._ops.update_instance_a_records(*batch.service_providers)
+            except BaseException as e:
+                batch.error = e
+            finally:
+                batch.is_done.set()
+        else:
+            batch.is_done.wait()
+        if batch.error:
+            raise batch.error
+
+
+class ServiceProviderBootstrap:
+    def __init__(self, sp_aws_operations: ServiceProviderAWSOperations,
+                 service_providers: Iterable[ServiceProviderInstance], pin_hosts: bool = False,
+                 state_dir: Optional[str] = None):
+        """
+        :param state_dir: If given, each gate is also published there when it opens, for the
+            other workers of the test run (see BootstrapFollower).
+        """
+        self._ops = sp_aws_operations
+        self._pin_hosts = pin_hosts
+        self._state_dir = state_dir
+        self._service_providers = list(service_providers)
+        self._gates: Dict[ServiceProviderInstance, threading.Event] = {
+            sp: threading.Event() for sp in self._service_providers
+        }
+        self._errors: Dict[ServiceProviderInstance, BaseException] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._record_updates = _RecordUpdateBatcher(sp_aws_operations, self._service_providers,
+                                                    _BATCH_WINDOW_SECONDS)
+
+    def __contains__(self, sp: ServiceProviderInstance) -> bool:
+        return sp in self._gates
+
+    def start(self):
+        """Starts bringing up the service providers and returns immediately."""
+        # An SP that can't be used fails at its own gate (see `_bring_up`), instead of failing the request for the rest.
+        need_to_start = [sp for sp in self._service_providers
+                         if self._ops.instance_is_usable(sp) and not self._ops.instance_is_started(sp)]
+        if need_to_start:
+            # A single request for all of them; each gate then only waits for its own instance.
+            self._ops.start_instances(*need_to_start, wait=False)
+        record_sets = self._ops.a_record_sets(*self._service_providers)
+        self._executor = ThreadPoolExecutor(max_workers=max(len(self._service_providers), 1),
+                                            thread_name_prefix='sp-bootstrap')
+        for sp in self._service_providers:
+            self._executor.submit(self._bring_up, sp, sp in need_to_start, record_sets)
+
+    def _bring_up(self, sp: ServiceProviderInstance, was_stopped: bool, record_sets: List[Dict]):
+        start = time.perf_counter()
+        try:
+            with TRACER.span('sp_bootstrap.bring_up', sp=sp.value):
+                self._bring_up_instance(sp, was_stopped, record_sets)
+            logger.info(f"{sp.value} is ready after {time.perf_counter() - start:.1f}s")
+        except BaseException as e:
+            logger.error(f"{sp.value} could not be brought up: {e}")
+            self._errors[sp] = e
+            self._record_updates.skip(sp)
+        finally:
+            self._publish(sp)
+            self._gates[sp].set()
+
+    def _publish(self, sp: ServiceProviderInstance):
+        if not self._state_dir:
+            return
+        temp_filename = os.path.join(self._state_dir, f'{sp.value}.{os.getpid()}.tmp')
+        with open(temp_filename, 'w') as f:
+            f.write(str(self._errors[sp]) if sp in self._errors else '')
+        os.replace(temp_filename, os.path.join(self._state_dir, f'{sp.value}.ready'))
+
+    def _bring_up_instance(self, sp: ServiceProviderInstance, was_stopped: bool, record_sets: List[Dict]):
+        if was_stopped:
+            self._ops.wait_for_instances_running(sp)
+        if not self._ops.dns_record_requires_update(record_sets, sp):
+            self._record_updates.skip(sp)
+            return
+        if self._pin_hosts:
+            # Tests go straight to the instance's IP; the record is only updated for everyone else.
+            self._executor.submit(self._update_dns_record, sp)
+            return
+        self._record_updates.update(sp)
+        self._ops.wait_for_ip_propagation(sp)
+
+    def _update_dns_record(self, sp: ServiceProviderInstance):
+        try:
+            with TRACER.span('sp_bootstrap.update_dns_record', sp=sp.value):
+                self._record_updates.update(sp)
+        except Exception as e:
+            logger.warning(f"Could not update the DNS record of {sp.value}: {e}")
+
+    def is_ready(self, sp: ServiceProviderInstance) -> bool:
+        """True once the service provider is ready, or has failed to become ready."""
+        return sp not in self._gates or self._gates[sp].is_set()
+
+    def wait_until_ready(self, sp: ServiceProviderInstance):
+        """Blocks until the service provider is ready. Raises the error that kept it from becoming ready, if any."""
+        if sp not in self._gates:
+            return
+        self._gates[sp].wait()
+        if sp in self._errors:
+            raise RuntimeError(f"Test service provider {sp.value} could not be started") from self._errors[sp]
+
+    def shutdown(self):
+        if self._executor:
+            # Threads blocked in an AWS waiter can't be interrupted; don't hold up the session for them.
+            self._executor.shutdown(wait=False)
+
+
+class BootstrapFollower:
+    """
+    The gates of a bootstrap that another worker of the test run is doing. Once a gate opens,
+    what this worker knows about the SP's instance (e.g., its IP address) is refreshed.
+    """
+    def __init__(self, sp_aws_operations: ServiceProviderAWSOperations,
+                 service_providers: Iterable[ServiceProviderInstance], state_dir: str):
+        self._ops = sp_aws_operations
+        self._service_providers = set(service_providers)
+        self._state_dir = state_dir
+        self._refresh_locks: Dict[ServiceProviderInstance, threading.Lock] = {
+            sp: threading.Lock() for sp in self._service_providers
+        }
+        self._is_refreshed = set()
+
+    def __contains__(self, sp: ServiceProviderInstance) -> bool:
+        return sp in self._service_providers
+
+    def _gate_file(self, sp: ServiceProviderInstance) -> str:
+        return os.path.join(self._state_dir, f'{sp.value}.ready')
+
+    def is_ready(self, sp: ServiceProviderInstance) -> bool:
+        return sp not in self._service_providers or os.path.exists(self._gate_file(sp))
+
+    def _leader_is_alive(self) -> bool:
+        with open(os.path.join(self._state_dir, _LEADER_FILE)) as f:
+            pid = f.read().strip()
+        if not pid:
+            return True  # It hasn't written its pid yet.
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def wait_until_ready(self, sp: ServiceProviderInstance):
+        if sp not in self._service_providers:
+            return
+        while not self.is_ready(sp):
+            if not self._leader_is_alive():
+                raise RuntimeError(f"The worker bringing up test service provider {sp.value} has exited")
+            time.sleep(_POLL_SECONDS)
+        with open(self._gate_file(sp)) as f:
+            error = f.read()
+        if error:
+            raise RuntimeError(f"Test service provider {sp.value} could not be started: {error}")
+        with self._refresh_locks[sp]:
+            if sp not in self._is_refreshed:
+                self._ops.wait_for_instances_running(sp)
+                self._is_refreshed.add(sp)
+
+    def shutdown(self):
+        pass
+
+
+def join_test_run_bootstrap(sp_aws_operations: ServiceProviderAWSOperations,
+                            service_providers: Iterable[ServiceProviderInstance], pin_hosts: bool = False):
+    """
+    For pytest-xdist workers: the first worker of the test run to call this gets a started
+    ServiceProviderBootstrap; the others get a BootstrapFollower of it.
+    """
+    state_dir = run_dir('sp-bootstrap')
+    os.makedirs(state_dir, exist_ok=True)
+    try:
+        fd = os.open(os.path.join(state_dir, _LEADER_FILE), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        logger.info("Another worker is bringing up the test service providers")
+        return BootstrapFollower(sp_aws_operations, service_providers, state_dir)
+    with os.fdopen(fd, 'w') as f:
+        f.write(str(os.getpid()))
+    bootstrap = ServiceProviderBootstrap(sp_aws_operations, service_providers, pin_hosts=pin_hosts,
+                                         state_dir=state_dir)
+    bootstrap.start()
+    return bootstrap
+
+
+class ReadyFirstScheduler:
+    """
+    Registered as a pytest plugin while a bootstrap is in progress. Before each test, the tests that have not
+    started yet are reordered so that the ones whose service providers are ready run first. Tests in the
+    same module are moved together and keep their order, so that module (and class) fixtures are
+    only set up once.
+
+    The test after the current one is never moved, because pytest has already used it to decide which
+    fixtures to tear down.
+    """
+    def __init__(self, bootstrap: ServiceProviderBootstrap,
+                 required: Dict[str, Iterable[ServiceProviderInstance]]):
+        self._bootstrap = bootstrap
+        self._required = required
+
+    @staticmethod
+    def _unit(item: pytest.Item):
+        return item.module
+
+    def _is_ready(self, item: pytest.Item) -> bool:
+        return all(self._bootstrap.is_ready(sp) for sp in self._required.get(item.nodeid, ()))
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtest_protocol(self, item):
+        items = item.session.items
+        start = items.index(item) + 2
+        while 0 < start < len(items) and self._unit(items[start]) is self._unit(items[start - 1]):
+            start += 1
+        units: List[List[pytest.Item]] = []
+        for pending in items[start:]:
+            if units and self._unit(units[-1][-1]) is self._unit(pending):
+                units[-1].append(pending)
+            else:
+                units.append([pending])
+        ready = [unit for unit in units if all(self._is_ready(i) for i in unit)]
+        if not ready or len(ready) == len(units):
+            return
+        waiting = [unit for unit in units if not all(self._is_ready(i) for i in unit)]
+        items[start:] = [i for unit in ready + waiting for i in unit]
@@ -0,0 +1,133 @@
+"""
+Reads the test SP instances from EC2, one page of `describe_instances` at a time, and indexes them
+by their `test_ref` tag and by their state as it goes.
+
+Only the few fields we use are read from each instance (its ID, state, public IP address, and
+`test_ref` tag), straight from the response, instead of validating the whole response with
+`DescribeInstancesResponse`; instances whose `test_ref` isn't a `ServiceProviderInstance` are
+skipped (and counted). Every page is read, so large fleets, in which there can be several
+instances (replicas) with the same `test_ref`, aren't cut off at the first page.
+
+Use:
+    inventory = load_inventory(ec2_client, DescribeInstancesRequest(filters=filters))
+    inventory.instances(ServiceProviderInstance.diafine6, AWSEC2InstanceStateName.RUNNING)
+"""
+from __future__ import annotations
+
+import logging
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional
+
+from .models import AWSEC2InstanceStateName, DescribeInstancesRequest, ServiceProviderInstance
+
+logger = logging.getLogger(__name__)
+
+TEST_REF_TAG = 'test_ref'
+# The most instances EC2 returns in a page.
+MAX_PAGE_SIZE = 1000
+
+_KNOWN_REFS = {sp.value: sp for sp in ServiceProviderInstance}
+# The states an instance can be used in, best first; terminated (and terminating) instances can't be.
+_PREFERRED_STATES = (
+    AWSEC2InstanceStateName.RUNNING,
+    AWSEC2InstanceStateName.PENDING,
+    AWSEC2InstanceStateName.STOPPED,
+    AWSEC2InstanceStateName.STOPPING,
+)
+
+
+def is_usable(state: Optional[AWSEC2InstanceStateName]) -> bool:
+    """Whether an instance in this state can be used (i.e., started, or is already running)."""
+    return state in _PREFERRED_STATES
+
+
+class InventoryInstance:
+    __slots__ = ('instance_id', 'sp', 'state', 'public_ip')
+
+    def __init__(self, instance_id: str, sp: ServiceProviderInstance, state: AWSEC2InstanceStateName,
+                 public_ip: Optional[str]):
+        self.instance_id = instance_id
+        self.sp = sp
+        self.state = state
+        self.public_ip = public_ip
+
+
+def _test_ref(instance: Dict[str, Any]) -> Optional[str]:
+    for tag in instance.get('Tags', ()):
+        if tag['Key'] == TEST_REF_TAG:
+            return tag['Value']
+    return None
+
+
+class SpInventory:
+    def __init__(self):
+        self._by_sp: Dict[ServiceProviderInstance, List[InventoryInstance]] = defaultdict(list)
+        self._by_state: Dict[AWSEC2InstanceStateName, List[InventoryInstance]] = defaultdict(list)
+        self.num_instances = 0
+        self.skipped_refs: Dict[Optional[str], int] = defaultdict(int)
+        self.num_pages = 0
+
+    def add_page(self, response: Dict[str, Any]):
+        """Indexes the instances in one `describe_instances` response."""
+        self.num_pages += 1
+        for reservation in response.get('Reservations', ()):
+            for instance in reservation.get('Instances', ()):
+                ref = _test_ref(instance)
+                sp = _KNOWN_REFS.get(ref)
+                if not sp:
+                    self.skipped_refs[ref] += 1
+                    continue
+                entry = InventoryInstance(instance['InstanceId'], sp,
+                                          AWSEC2InstanceStateName(instance['State']['Name']),
+                                          instance.get('PublicIpAddress'))
+                self._by_sp[sp].append(entry)
+                self._by_state[entry.state].append(entry)
+                self.num_instances += 1
+
+    def instances(self, sp: Optional[ServiceProviderInstance] = None,
+                  state: Optional[AWSEC2InstanceStateName] = None) -> List[InventoryInstance]:
+        """The instances of the service provider (or of all of them), in the state (or in any state)."""
+        if sp is None:
+            return list(self._by_state.get(state, ())) if state else [i for v in self._by_sp.values() for i in v]
+        return [i for i in self._by_sp.get(sp, ()) if state is None or i.state == state]
+
+    @property
+    def service_providers(self) -> List[ServiceProviderInstance]:
+        return list(self._by_sp.keys())
+
+    def preferred(self, sp: ServiceProviderInstance) -> Optional[InventoryInstance]:
+        """
+        The instance to use for the service provider: if it has replicas, the first that is running,
+        otherwise the first that is starting, stopped, or stopping, in that order. Instances that are
+        terminated, or shutting down, are never used; if those are all it has, there is none.
+        """
+        instances = self._by_sp.get(sp, ())
+        for state in _PREFERRED_STATES:
+            for instance in instances:
+                if instance.state == state:
+                    return instance
+        return None
+
+
+def iter_pages(ec2_client, query: DescribeInstancesRequest) -> Iterator[Dict[str, Any]]:
+    """Yields the `describe_instances` responses for the query, one page at a time."""
+    payload = query.request_payload
+    if not query.instance_ids:
+        # EC2 doesn't allow a page size when asking for instances by ID.
+        payload['MaxResults'] = MAX_PAGE_SIZE
+    while True:
+        response = ec2_client.describe_instances(**payload)
+        yield response
+        if not response.get('NextToken'):
+            return
+        payload['NextToken'] = response['NextToken']
+
+
+def load_inventory(ec2_client, query: DescribeInstancesRequest) -> SpInventory:
+    inventory = SpInventory()
+    for page in iter_pages(ec2_client, query):
+        inventory.add_page(page)
+    if inventory.skipped_refs:
+        skipped = ', '.join(f'{ref} ({count})' for ref, count in sorted(inventory.skipped_refs.items(), key=str))
+        logger.debug(f"Skipped instances with unknown test_ref tags: {skipped}")
+    return inventory
@@ -16,7 +16,9 @@ common_options = [
                  type=click.Choice([sp.value for sp in ServiceProviderInstance])),
     click.option('--settings-file', default='settings.yaml'),
     click.option('--settings-env', default='base'),
-    click.option('--dry-run/--no-dry-run', default=False)
+    click.option('--dry-run/--no-dry-run', default=False),
+    click.option('--aws-cache-seconds', default=None, type=int,
+                 help="How long to reuse instance and DNS record data read from AWS, in seconds"),
 ]
 
 
@@ -28,6 +30,25 @@ def add_options(options):
     return _add_options
 
 
+def _option_overrides(aws_cache_seconds: Optional[int]):
+    return {} if aws_cache_seconds is None else {'aws_cache_seconds': aws_cache_seconds}
+
+
+def start_service_providers(op: ServiceProviderAWSOperations, *service_providers: ServiceProviderInstance,
+                            dry_run: bool = False):
+    """Starts the service providers (or all of them), and waits for their DNS records to be up to date."""
+    op.start_instances(*service_providers, dry_run=dry_run)
+    service_providers = service_providers or tuple(op.service_providers.keys())
+    record_sets = op.a_record_sets(*service_providers)
+    outdated_dns_records = [
+        sp for sp in service_providers
+        if op.dns_record_requires_update(record_sets, sp)
+    ]
+    if outdated_dns_records:
+        op.update_instance_a_records(*outdated_dns_records, dry_run=dry_run)
+        op.wait_for_ip_propagation(*outdated_dns_records, dry_run=dry_run)
+
+
 def print_dry_run_disclaimer():
     click.echo("[DRY RUN MODE] No changes will be made to live resources.")
 
@@ -40,40 +61,24 @@ def cli(ctx):
 
 @cli.command()
 @add_options(common_options)
-def start(service_providers, settings_file, settings_env, dry_run):
-    settings = load_settings(settings_file, settings_env)
+def start(service_providers, settings_file, settings_env, dry_run, aws_cache_seconds):
+    settings = load_settings(settings_file, settings_env, _option_overrides(aws_cache_seconds))
     secrets = SecretManager(settings.secret_manager).get_secret_data(TestSecrets)
     if dry_run:
         print_dry_run_disclaimer()
-    utils = WebTestUtils(settings, secrets)
-    op = ServiceProviderAWSOperations(secrets,
-                                      settings.service_provider_instance_filters,
-                                      settings.aws_hosted_zone,
-                                      utils)
-    op.start_instances(*service_providers, dry_run=dry_run)
-    record_sets = utils.sp_aws_operations.record_sets
-    outdated_dns_records = [
-        sp for sp in service_providers
-        if utils.sp_aws_operations.dns_record_requires_update(record_sets, sp)
-    ]
-    if outdated_dns_records:
-        op.update_instance_a_records(*outdated_dns_records, dry_run=dry_run)
-        op.wait_for_ip_propagation(*outdated_dns_records, dry_run=dry_run)
+    op = WebTestUtils(settings, secrets).sp_aws_operations
+    start_service_providers(op, *(ServiceProviderInstance(sp) for sp in service_providers), dry_run=dry_run)
 
 
 @cli.command()
 @add_options(common_options)
-def stop(service_providers, settings_file, settings_env, dry_run):
-    settings = load_settings(settings_file, settings_env)
+def stop(service_providers, settings_file, settings_env, dry_run, aws_cache_seconds):
+    settings = load_settings(settings_file, settings_env, _option_overrides(aws_cache_seconds))
     secrets = SecretManager(settings.secret_manager).get_secret_data(TestSecrets)
     if dry_run:
         print_dry_run_disclaimer()
-    utils = WebTestUtils(settings, secrets)
-    op = ServiceProviderAWSOperations(secrets,
-                                      settings.service_provider_instance_filters,
-                                      settings.aws_hosted_zone,
-                                      utils)
-    op.stop_instances(*service_providers, dry_run=dry_run)
+    op = WebTestUtils(settings, secrets).sp_aws_operations
+    op.stop_instances(*(ServiceProviderInstance(sp) for sp in service_providers), dry_run=dry_run)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,196 @@
+"""
+Reuses IdP single sign-on sessions across tests, instead of signing in again just to set one up.
+
+Many access control tests sign in to diafine6 (with a password, or with a password and Duo)
+only so that there is an existing SSO session when they go on to the SP they are really
+testing. The first time a session is established for a netid at an auth level (see
+`SsoSessionCache.establish`), the IdP's cookies are recorded once the sign-in has succeeded.
+Later tests that need the same session get those cookies injected into their browser instead;
+a single visit to the SP then confirms that the IdP still accepts them.
+
+A snapshot is dropped, and the sign-in done again, when it is older than
+`--sso-session-max-age` seconds, when one of its cookies has expired, or when the IdP rejects
+it (the visit to the SP doesn't end in success). If the IdP keeps rejecting snapshots (e.g.,
+because it ties its sessions to the client's address), they aren't used for the rest of the
+run. Set `--sso-session-max-age 0` to always sign in.
+
+How often a snapshot was reused (`sso_session.hit`; its mean is the hit rate), and how long
+establishing a session took (`sso_session.seconds`), are included in the `idp test metrics`
+summary.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from selenium.common.exceptions import WebDriverException
+from webdriver_recorder.browser import BrowserRecorder
+
+from .browser_pool import execute_cdp_command
+from .metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+PASSWORD = 'password'
+TWO_FACTOR = '2fa'
+
+# A snapshot whose cookies expire sooner than this is not worth restoring.
+EXPIRY_MARGIN_SECONDS = 60
+# After this many rejected snapshots in a row, the IdP is assumed not to accept them at all.
+MAX_REJECTIONS = 3
+
+# The cookie fields that Network.setCookies accepts (and that matter for a session).
+_CDP_COOKIE_FIELDS = ('name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'sameSite')
+
+
+def _from_webdriver(cookie: dict) -> dict:
+    """Converts a cookie from `get_cookies` to the DevTools format snapshots are kept in."""
+    converted = {field: cookie[field] for field in _CDP_COOKIE_FIELDS if field in cookie}
+    converted['expires'] = cookie.get('expiry', -1)
+    converted['session'] = 'expiry' not in cookie
+    return converted
+
+
+def _is_parent_domain(domain: str, host: str) -> bool:
+    """Whether a cookie for the domain (e.g., .u.washington.edu) can be set from the host; never for a TLD."""
+    domain = domain.lstrip('.')
+    return '.' in domain and (host == domain or host.endswith(f'.{domain}'))
+
+
+def _to_webdriver(cookie: dict, host: str) -> dict:
+    """
+    Converts a cookie from a snapshot for `add_cookie`, on a page of the host. Cookies that were set for
+    a domain (rather than only for the host that set them) keep it, so they are restored the same way.
+    """
+    converted = {field: cookie[field] for field in ('name', 'value', 'path', 'secure', 'httpOnly', 'sameSite')
+                 if field in cookie}
+    domain = cookie.get('domain', '')
+    if domain.startswith('.') and _is_parent_domain(domain, host):
+        converted['domain'] = domain
+    if not cookie.get('session'):
+        converted['expiry'] = int(cookie['expires'])
+    return converted
+
+
+def _to_cdp(cookie: dict) -> dict:
+    converted = {field: cookie[field] for field in _CDP_COOKIE_FIELDS if field in cookie}
+    if not cookie.get('session'):
+        converted['expires'] = cookie['expires']
+    return converted
+
+
+class SsoSnapshot:
+    def __init__(self, cookies: List[dict]):
+        self.cookies = cookies
+        self.recorded_at = time.time()
+
+    def is_fresh(self, max_age: int) -> bool:
+        now = time.time()
+        if now - self.recorded_at >= max_age:
+            return False
+        return all(
+            cookie.get('session') or cookie['expires'] > now + EXPIRY_MARGIN_SECONDS
+            for cookie in self.cookies
+        )
+
+
+class SsoSessionCache:
+    """
+    Created by the `sso_sessions` fixture; one for each test worker. Access control tests use
+    it through `AccessControlTestBase.establish_sso_session`.
+    """
+    def __init__(self, idp_origin: str, max_age: int):
+        self._idp_origin = idp_origin
+        self._idp_host = idp_origin.split('://', 1)[-1]
+        self._max_age = max_age
+        self._snapshots: Dict[Tuple[str, str], SsoSnapshot] = {}
+        self._consecutive_rejections = 0
+        self.hits = 0
+        self.misses = 0
+        self.num_expired = 0
+        self.num_rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_age > 0 and self._consecutive_rejections < MAX_REJECTIONS
+
+    def _is_idp_cookie(self, cookie: dict) -> bool:
+        domain = cookie.get('domain', '').lstrip('.')
+        return bool(domain) and (self._idp_host == domain or self._idp_host.endswith(f'.{domain}'))
+
+    def _record(self, browser: BrowserRecorder) -> List[dict]:
+        try:
+            cookies = execute_cdp_command(browser, 'Network.getAllCookies')['cookies']
+        except WebDriverException:
+            # Without devtools, the IdP's cookies can only be read from one of its pages.
+            browser.get(f'{self._idp_origin}/idp')
+            cookies = [_from_webdriver(cookie) for cookie in browser.get_cookies()]
+        return [cookie for cookie in cookies if self._is_idp_cookie(cookie)]
+
+    def _restore(self, browser: BrowserRecorder, snapshot: SsoSnapshot):
+        try:
+            execute_cdp_command(browser, 'Network.setCookies',
+                                {'cookies': [_to_cdp(cookie) for cookie in snapshot.cookies]})
+        except WebDriverException:
+            browser.get(f'{self._idp_origin}/idp')
+            for cookie in snapshot.cookies:
+                browser.add_cookie(_to_webdriver(cookie, self._idp_host))
+
+    def _clear(self, browser: BrowserRecorder):
+        try:
+            execute_cdp_command(browser, 'Network.clearBrowserCookies')
+        except WebDriverException:
+            browser.get(f'{self._idp_origin}/idp')
+            browser.delete_all_cookies()
+
+    def _lookup(self, key: Tuple[str, str]) -> Optional[SsoSnapshot]:
+        snapshot = self._snapshots.get(key)
+        if snapshot and not snapshot.is_fresh(self._max_age):
+            logger.info(f"The SSO session snapshot for {key[0]} ({key[1]}) has expired")
+            self.num_expired += 1
+            del self._snapshots[key]
+            return None
+        return snapshot
+
+    def establish(self, browser: BrowserRecorder, netid: str, auth_level: str,
+                  sign_in: Callable[[], None], verify: Callable[[], bool]):
+        """
+        Leaves the browser with an SSO session for the netid at the auth level (PASSWORD or
+        TWO_FACTOR). `sign_in` sets one up from scratch (and must assert that it succeeded);
+        `verify` visits an SP with a restored session, and returns whether the IdP let the
+        browser in without asking it to sign in again.
+        """
+        key = (netid, auth_level)
+        start = time.perf_counter()
+        snapshot = self._lookup(key) if self.enabled else None
+        if snapshot:
+            self._restore(browser, snapshot)
+            if verify():
+                self.hits += 1
+                self._consecutive_rejections = 0
+                METRICS.record('sso_session.hit', 1)
+                METRICS.record('sso_session.seconds', time.perf_counter() - start)
+                return
+            logger.info(f"The IdP rejected the SSO session snapshot for {netid} ({auth_level}); signing in again")
+            self.num_rejected += 1
+            self._consecutive_rejections += 1
+            del self._snapshots[key]
+            self._clear(browser)
+            if not self.enabled:
+                logger.warning(f"The IdP rejected {MAX_REJECTIONS} SSO session snapshots in a row; "
+                               f"they won't be used for the rest of this run.")
+        self.misses += 1
+        METRICS.record('sso_session.hit', 0)
+        sign_in()
+        if self.enabled:
+            self._snapshots[key] = SsoSnapshot(self._record(browser))
+        METRICS.record('sso_session.seconds', time.perf_counter() - start)
+
+    def close(self):
+        lookups = self.hits + self.misses
+        if lookups:
+            logger.info(
+                f"Reused SSO sessions for {self.hits} of {lookups} sign-ins ({self.hits / lookups:.0%}); "
+                f"{self.num_expired} snapshots expired and {self.num_rejected} were rejected by the IdP."
+            )
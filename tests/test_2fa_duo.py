@@ -9,9 +9,11 @@ https://wiki.cac.washington.edu/display/SMW/IAM+Team+Wiki
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from webdriver_recorder.browser import Chrome
+from webdriver_recorder.browser import Chrome, Locator
+from tests.dom_waits import PRESENT
 from tests.helpers import Locators
 from tests.models import ServiceProviderInstance
+from tests.page_checks import check_page, cookie, element, tag_with_text
 import pytest
 
 
@@ -166,8 +168,12 @@ class Test2FASessionCRNs:
             self.browser.get(self.shib_mfa_url)
             self.browser.send_inputs(netid10, self.password)
             self.browser.click(Locators.submit_button)
-            self.browser.wait_for_tag('div', 'Select a UW NetID for 2nd factor authentication.')
-            self.browser.find_element_by_xpath("//input[@value='sptest07']").click()
+            _, crn = check_page(
+                self.browser,
+                tag_with_text('div', 'Select a UW NetID for 2nd factor authentication.'),
+                element(Locator(search_method=By.XPATH, search_value="//input[@value='sptest07']"), PRESENT),
+            )
+            crn.click()
             self.browser.click(Locators.submit_button)
             enter_duo_passcode(self.browser, match_service_provider=self.sp)
 
@@ -249,12 +255,8 @@ def test_forget_me_self_service(utils, sp_url, sp_domain, secrets, netid3, test_
         enter_duo_passcode(browser, match_service_provider=sp)
         # go to an idp site to retrieve the rememberme cookie
         browser.get(f'https://idp{idp_env}.u.washington.edu/idp')
-        browser.wait_for_tag('h1', 'not found')
-
-        cookies_names = list(c['name'] for c in browser.get_cookies())
-        assert cookie_name in cookies_names
+        check_page(browser, tag_with_text('h1', 'not found'), cookie(cookie_name))
 
         browser.get(f'https://idp{idp_env}.u.washington.edu/forgetme')
-        browser.wait_for_tag('p', 'setting has been removed from this browser.')
-        cookies_names = list(c['name'] for c in browser.get_cookies())
-        assert cookie_name not in cookies_names
+        check_page(browser, tag_with_text('p', 'setting has been removed from this browser.'),
+                   cookie(cookie_name, present=False))
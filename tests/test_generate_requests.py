@@ -1,49 +1,66 @@
-import time
+import logging
+import os
 
-from webdriver_recorder.browser import Locator, By
+from tests.http_saml import HttpSamlEngine
+from tests.load_generator import BrowserVirtualUser, HttpVirtualUser, LoadEngine, resolve_idp_nodes
+from tests.models import AccountNetid
 
 
-def test_make_continuous_requests(request, browser, netid, secrets):
+def test_make_continuous_requests(request, get_fresh_browser, account_leases, secrets, report_dir, test_env,
+                                  report_stream):
     """
     By default this test will exit successfully without doing anything.
     Test runners must set "--lb-num-loops" in order for this test to
     do anything.
+
+    Each of the "--lb-concurrency" virtual users does "--lb-num-loops" login/logout cycles
+    with its own browser (or, with "--lb-user-mode http", its own HTTP session), as one of the
+    "--lb-accounts" (sptest01 by default), in turn. Only password-only accounts can be used; the
+    virtual users can't get past Duo or CRN selection.
+    If "--lb-idp-hosts" are given, the virtual users are spread evenly across those IdP nodes.
+    Latencies for each step of the cycle are written to login-latencies.json in the report directory.
+    If "--lb-max-error-rate" is given, the test fails if more than that fraction of the login cycles fail.
     """
     num_loops = int(request.config.getoption('lb_num_loops', default=0))
     sleep_time = int(request.config.getoption('lb_sleep_time', default=60))
+    concurrency = int(request.config.getoption('lb_concurrency', default=1))
+    user_mode = request.config.getoption('lb_user_mode', default='browser')
+    idp_hosts = [h.strip() for h in request.config.getoption('lb_idp_hosts', default='').split(',') if h.strip()]
+    accounts = [AccountNetid(a.strip()) for a in request.config.getoption('lb_accounts', default='sptest01').split(',')
+                if a.strip()]
+    max_error_rate = request.config.getoption('lb_max_error_rate', default=None)
+    if not num_loops:
+        return
+
+    password = secrets.test_accounts.password.get_secret_value()
+    idp_hostname = 'idp-eval.u.washington.edu' if test_env == 'eval' else 'idp.u.washington.edu'
+    nodes = resolve_idp_nodes(idp_hosts)
+    http_engines = {}
+
+    def show_progress(users):
+        cycles = sum(u.cycles for u in users)
+        errors = sum(u.errors for u in users)
+        report_stream.describe_progress(f"{cycles} of {concurrency * num_loops} login cycles done, {errors} failed")
+
+    def new_user(netid, node, steps):
+        if user_mode == 'http':
+            if node.name not in http_engines:
+                pins = {idp_hostname: node.ip} if node.ip else None
+                http_engines[node.name] = HttpSamlEngine(pool_size=concurrency, pins=pins)
+            return HttpVirtualUser(http_engines[node.name].new_client(), netid, password, steps)
+        chrome_arguments = [f'--host-resolver-rules=MAP {idp_hostname} {node.ip}'] if node.ip else []
+        return BrowserVirtualUser(get_fresh_browser(*chrome_arguments), netid, password, steps)
 
-    def log_in_user():
-        browser.get('https://directory.uw.edu/saml/login')
-        try:  # User may not be prompted to sign in, that's OK, we're still going through the IdP
-            browser.click(Locator(
-                search_method=By.ID,
-                search_value='weblogin_netid',
-            ))
-            browser.send_inputs(
-                netid,
-                secrets.test_accounts.password.get_secret_value(),
-            )
-            browser.click(Locator(
-                search_method=By.ID,
-                search_value='submit_button',
-            ))
-        except Exception:
-            browser.snap()
-        finally:
-            try:  # The population-option-all element is only present when a user is signed in
-                browser.wait_for(Locator(
-                    search_method=By.ID,
-                    search_value='population-option-all',
-                ))
-            except Exception:
-                browser.snap()
-                pass
-
-    def log_out_user():
-        browser.get('https://directory.uw.edu/saml/logout')
-        browser.snap()
-
-    for _ in range(num_loops):
-        log_in_user()
-        log_out_user()
-        time.sleep(sleep_time)
+    try:
+        with account_leases.hold_accounts(accounts):
+            report = LoadEngine(new_user, [a.value for a in accounts], concurrency, num_loops, sleep_time,
+                                nodes=nodes, on_cycle=show_progress).run()
+    finally:
+        for engine in http_engines.values():
+            engine.close()
+    logging.info(f"Login request generator results:\n{report.summary()}")
+    with open(os.path.join(report_dir, 'login-latencies.json'), 'w') as f:
+        f.write(report.to_json())
+    if max_error_rate is not None:
+        assert report.error_rate <= max_error_rate, (
+            f"{report.errors} of {report.cycles} login cycles failed (more than {max_error_rate:.0%})")
@@ -11,10 +11,11 @@ PWD-10	Blacklisted cookie (disuser case) is not covered here. This comment can b
 from functools import partial
 
 import pytest
-from webdriver_recorder.browser import Chrome
+from webdriver_recorder.browser import By, Chrome, Locator
 
 from tests.helpers import Locators
 from tests.models import ServiceProviderInstance
+from tests.page_checks import check_page, element_with_text, tag_with_text
 
 
 def add_suffix(suffix: str, netid: str) -> str:
@@ -145,9 +146,11 @@ def test_idp_initiated_sign_in(netid, utils, sp_url, secrets, sp_domain, test_en
         fresh_browser.click(Locators.submit_button)
         fresh_browser.wait_for_tag('h1', 'Diafine6 IdP Testing Platform')
         fresh_browser.get(f'{sp_url(sp)}/Shibboleth.sso/Session')
-        fresh_browser.wait_for_tag('u', 'Miscellaneous')
-        with fresh_browser.autocapture_off():
-            fresh_browser.wait_for_tag('strong', 'Session Expiration (barring inactivity):')
+        check_page(
+            fresh_browser,
+            tag_with_text('u', 'Miscellaneous'),
+            tag_with_text('strong', 'Session Expiration (barring inactivity):'),
+        )
 
 
 @pytest.mark.parametrize('login_transform', [
@@ -207,7 +210,9 @@ class TestNetIDCaseInsensitivityAndURLQueryParams:
         with self.utils.using_test_sp(self.sp):
             self.browser.snap()
             self.browser.get(url)
-            self.browser.wait_for_tag('h1', 'query parameters')
-            element = self.browser.find_elements_by_tag_name('p')
-            for snippet in ('fname = Joe', 'lname = Smith', 'age = 30'):
-                assert (snippet in element[1].text)
+            parameters = Locator(search_method=By.XPATH, search_value='(//p)[2]')
+            check_page(
+                self.browser,
+                tag_with_text('h1', 'query parameters'),
+                *(element_with_text(parameters, snippet) for snippet in ('fname = Joe', 'lname = Smith', 'age = 30')),
+            )
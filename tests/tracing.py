@@ -0,0 +1,200 @@
+"""
+Trace spans for the test session, written to a file in the Jaeger JSON format, so that a slow run
+can be opened as a flame chart (e.g., with "Upload JSON" in the Jaeger UI) to find its critical path.
+Enable it with `--trace-file <path>`; under pytest-xdist, each worker writes its own file
+(e.g., trace.gw0.json), and all of them share a trace id.
+
+Spans nest within whatever span is open in the same thread. Spans started in other threads (e.g.,
+the SP bootstrap threads) are children of the session span.
+
+Use:
+    from tests.tracing import TRACER
+
+    with TRACER.span('some_operation', sp='diafine6'):
+        do_work()
+
+    @TRACER.traced('aws.some_call')
+    def some_call(...):
+        ...
+"""
+from __future__ import annotations
+
+import functools
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+import pytest
+
+SERVICE_NAME = 'uw-idp-web-tests'
+
+
+class Span:
+    def __init__(self, name: str, parent: Optional[Span], tags: Dict[str, Any]):
+        self.name = name
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.parent_id = parent.span_id if parent else None
+        self.tags = tags
+        self.start_micros = int(time.time() * 1e6)
+        self._start = time.perf_counter()
+        self.duration_micros: Optional[int] = None
+
+    def finish(self):
+        self.duration_micros = int((time.perf_counter() - self._start) * 1e6)
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.trace_id = ''
+        self._spans: List[Span] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._root: Optional[Span] = None
+
+    def configure(self, run_id: str):
+        self.enabled = True
+        self.trace_id = hashlib.md5(run_id.encode()).hexdigest()
+
+    @property
+    def _stack(self) -> List[Span]:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def start_span(self, name: str, **tags) -> Optional[Span]:
+        """Starts a span as a child of the current one. Prefer `span()` unless the span can't be a `with` block."""
+        if not self.enabled:
+            return None
+        stack = self._stack
+        span = Span(name, stack[-1] if stack else self._root, tags)
+        if self._root is None:
+            self._root = span
+        stack.append(span)
+        with self._lock:
+            self._spans.append(span)
+        return span
+
+    def finish_span(self, span: Optional[Span]):
+        if span is None:
+            return
+        span.finish()
+        stack = self._stack
+        if span in stack:
+            stack.remove(span)
+
+    @contextmanager
+    def span(self, name: str, **tags):
+        span = self.start_span(name, **tags)
+        try:
+            yield span
+        except BaseException as e:
+            if span:
+                span.tags.update(error=True, exception=repr(e)[:200])
+            raise
+        finally:
+            self.finish_span(span)
+
+    def traced(self, name: Optional[str] = None):
+        """Decorates a function so that each call is a span. Enum arguments (e.g., SPs) are added as a tag."""
+        def decorator(func):
+            span_name = name or func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                values = [a.value for a in args if isinstance(a, Enum)]
+                tags = {'args': ','.join(map(str, values))} if values else {}
+                with self.span(span_name, **tags):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def to_jaeger(self, process_tags: Dict[str, str]) -> Dict:
+        with self._lock:
+            spans = list(self._spans)
+        return {'data': [{
+            'traceID': self.trace_id,
+            'spans': [
+                {
+                    'traceID': self.trace_id,
+                    'spanID': span.span_id,
+                    'operationName': span.name,
+                    'references': [
+                        {'refType': 'CHILD_OF', 'traceID': self.trace_id, 'spanID': span.parent_id}
+                    ] if span.parent_id else [],
+                    'startTime': span.start_micros,
+                    # Spans that never finished (e.g., a thread that was still running) end when the file is written.
+                    'duration': span.duration_micros if span.duration_micros is not None
+                    else int(time.time() * 1e6) - span.start_micros,
+                    'tags': [{'key': k, 'type': 'string', 'value': str(v)} for k, v in span.tags.items()],
+                    'logs': [],
+                    'processID': 'p1',
+                }
+                for span in spans
+            ],
+            'processes': {'p1': {
+                'serviceName': SERVICE_NAME,
+                'tags': [{'key': k, 'type': 'string', 'value': v} for k, v in process_tags.items()],
+            }},
+        }]}
+
+
+TRACER = Tracer()
+
+
+class TracingPlugin:
+    """Registered as a pytest plugin in conftest.py when `--trace-file` is given."""
+    def __init__(self, trace_file: str):
+        self._trace_file = trace_file
+        self._worker = os.environ.get('PYTEST_XDIST_WORKER')
+        self._session_span: Optional[Span] = None
+
+    def pytest_sessionstart(self, session):
+        TRACER.configure(os.environ.get('PYTEST_XDIST_TESTRUNUID', f'{os.getpid()}-{time.time()}'))
+        self._session_span = TRACER.start_span(f'pytest session ({self._worker})' if self._worker else 'pytest session')
+
+    @pytest.hookimpl(hookwrapper=True, tryfirst=True)
+    def pytest_runtest_protocol(self, item):
+        with TRACER.span(item.nodeid, test=item.name):
+            yield
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_setup(self, item):
+        with TRACER.span('setup'):
+            yield
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item):
+        with TRACER.span('call'):
+            yield
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_teardown(self, item):
+        with TRACER.span('teardown'):
+            yield
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef, request):
+        with TRACER.span(f'fixture {fixturedef.argname}', scope=fixturedef.scope):
+            yield
+
+    def pytest_sessionfinish(self, session):
+        TRACER.finish_span(self._session_span)
+        path = self._trace_file
+        if self._worker:
+            base, ext = os.path.splitext(path)
+            path = f'{base}.{self._worker}{ext or ".json"}'
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        process_tags = {'worker': self._worker or 'main'}
+        with open(path, 'w') as f:
+            json.dump(TRACER.to_jaeger(process_tags), f)
@@ -0,0 +1,55 @@
+"""
+The tests in this directory check the test harness itself (the SP orchestration and what it is
+built on) against the AWS stand-in (see `tests/aws_standin.py`), so they need no AWS account,
+secrets, browser, or IdP, and take a few seconds:
+
+    pytest tests/unit
+
+The session fixtures that tests/conftest.py uses for every test (which start the test SPs and
+store screenshots) are replaced here with ones that do nothing.
+"""
+import pytest
+
+from tests.aws_standin import AwsStandIn, StandInLatencies
+from tests.helpers import WebTestUtils, load_settings
+from tests.models import TestSecrets, WebTestSettings
+
+# Short enough that a test finishes in a second or two, long enough that things still happen in order.
+FAST_LATENCIES = StandInLatencies(
+    api_seconds=0, boot_seconds=0.3, stop_seconds=0.2, change_sync_seconds=0.2, propagation_seconds=0.2,
+    ec2_waiter_seconds=0.05, route53_waiter_seconds=0.05,
+)
+
+
+@pytest.fixture(scope='session')
+def settings(request) -> WebTestSettings:
+    # Nothing from (or for) the stand-in may end up in the shared control plane cache.
+    return load_settings(request.config.getoption('--settings-file'), request.config.getoption('--settings-profile'),
+                         {'aws_cache_seconds': 0})
+
+
+@pytest.fixture(scope='session')
+def screenshot_store():
+    """Replaces the fixture in tests/conftest.py; nothing here takes screenshots."""
+
+
+@pytest.fixture(scope='session')
+def report_stream():
+    """Replaces the fixture in tests/conftest.py."""
+
+
+@pytest.fixture(scope='session')
+def manage_test_service_providers():
+    """Replaces the fixture in tests/conftest.py; the tests here bring up their own (stand-in) SPs."""
+
+
+@pytest.fixture
+def stand_in(settings) -> AwsStandIn:
+    return AwsStandIn(settings.aws_hosted_zone, FAST_LATENCIES)
+
+
+@pytest.fixture
+def utils(settings, stand_in) -> WebTestUtils:
+    """A WebTestUtils whose AWS clients (and DNS lookups) are the stand-in's."""
+    return WebTestUtils(settings, TestSecrets.construct(env={}), aws_clients=stand_in.clients(),
+                        resolver_factory=stand_in.resolver)
@@ -0,0 +1,81 @@
+"""Account leases and the order tests are dispatched in (see `tests/account_leases.py`)."""
+import threading
+from typing import List, Optional
+
+import pytest
+
+from tests.account_leases import EXCLUSIVE, AccountLeaseManager, schedule_for_concurrency
+from tests.models import AccountNetid
+
+
+class FakeItem:
+    def __init__(self, name: str, *fixturenames: str, group: Optional[str] = None, mode: Optional[str] = None):
+        self.name = name
+        self.fixturenames = list(fixturenames)
+        self._markers = {}
+        if group:
+            self._markers['xdist_group'] = pytest.mark.xdist_group(name=group).mark
+        if mode:
+            self._markers['account_lease'] = pytest.mark.account_lease(mode).mark
+
+    def get_closest_marker(self, name: str):
+        return self._markers.get(name)
+
+
+def names(items: List[FakeItem]) -> List[str]:
+    return [item.name for item in items]
+
+
+def test_tests_needing_the_same_account_are_spread_apart():
+    items = [
+        FakeItem('a', 'netid4', 'enter_duo_passcode'),
+        FakeItem('b', 'netid4', 'enter_duo_passcode'),
+        FakeItem('c', 'netid'),
+        FakeItem('d', 'netid2'),
+    ]
+    assert names(schedule_for_concurrency(items, 2)) == ['a', 'c', 'b', 'd']
+
+
+def test_shared_leases_are_not_spread_apart():
+    items = [FakeItem('a', 'netid'), FakeItem('b', 'netid'), FakeItem('c', 'netid2')]
+    assert names(schedule_for_concurrency(items, 2)) == ['a', 'b', 'c']
+
+
+def test_groups_are_kept_together_and_in_order():
+    items = [
+        FakeItem('a1', 'netid4', group='A', mode=EXCLUSIVE),
+        FakeItem('b', 'netid4', mode=EXCLUSIVE),
+        FakeItem('a2', 'netid', group='A'),
+        FakeItem('c', 'netid2'),
+    ]
+    assert names(schedule_for_concurrency(items, 2)) == ['a1', 'a2', 'c', 'b']
+
+
+def test_a_test_takes_its_leases_in_the_same_order_as_everyone_else(tmp_path):
+    leases = AccountLeaseManager(str(tmp_path))
+    # Asks for sptest07 before sptest01; the load generator holds sptest01, then waits for sptest07.
+    item = FakeItem('test_nameid', 'netid7', 'netid', mode=EXCLUSIVE)
+    generator_has_first = threading.Event()
+    generator_done = threading.Event()
+
+    def generator():
+        with leases.hold_accounts([AccountNetid.sptest01], EXCLUSIVE):
+            generator_has_first.set()
+            with leases.hold_accounts([AccountNetid.sptest07], EXCLUSIVE):
+                generator_done.set()
+
+    with leases.hold_for_test(item):
+        thread = threading.Thread(target=generator, daemon=True)
+        thread.start()
+        assert not generator_has_first.wait(0.2)
+    thread.join(5)
+    assert generator_done.is_set()
+
+
+def test_a_class_holds_its_tests_accounts(tmp_path):
+    leases = AccountLeaseManager(str(tmp_path))
+    items = [FakeItem('a', 'netid', mode=EXCLUSIVE), FakeItem('b', 'netid')]
+    with leases.hold_for_class(items):
+        # Leasing sptest01 again would wait on the class's own exclusive lease.
+        with leases.hold_for_test(items[1]):
+            pass
@@ -0,0 +1,58 @@
+"""The control plane cache (see `tests/control_plane_cache.py`), with a state file of its own."""
+import pytest
+
+from tests.control_plane_cache import ControlPlaneCache
+
+
+@pytest.fixture
+def cache(tmp_path) -> ControlPlaneCache:
+    return ControlPlaneCache(60, state_file=str(tmp_path / 'control-plane-cache.json'))
+
+
+def test_get_fetches_only_once(cache):
+    fetches = []
+    assert cache.get('ec2.sp_configs', lambda: fetches.append(1) or {'diafine6': 'running'}) == {'diafine6': 'running'}
+    assert cache.get('ec2.sp_configs', lambda: fetches.append(1) or {}) == {'diafine6': 'running'}
+    assert len(fetches) == 1
+
+
+def test_invalidate_drops_only_matching_keys(cache):
+    cache.put('ec2.sp_configs', {'diafine6': 'running'})
+    cache.put('route53.a_record:diafine6', '198.18.0.1')
+    cache.invalidate('ec2.')
+    assert cache.get('ec2.sp_configs', lambda: {}) == {}
+    assert cache.get('route53.a_record:diafine6', lambda: None) == '198.18.0.1'
+
+
+def test_read_started_before_an_invalidation_is_not_cached(cache):
+    def fetch_while_instances_start():
+        cache.invalidate('ec2.')
+        return {'diafine6': 'stopped'}
+
+    assert cache.get('ec2.sp_configs', fetch_while_instances_start) == {'diafine6': 'stopped'}
+    assert cache.get('ec2.sp_configs', lambda: {'diafine6': 'running'}) == {'diafine6': 'running'}
+
+
+def test_put_since_an_older_generation_is_dropped(cache):
+    since = cache.generation()
+    cache.invalidate('ec2.')
+    cache.put('ec2.sp_configs', {'diafine6': 'stopped'}, since=since)
+    cache.put('ec2.other', {}, since=cache.generation())
+    assert cache.get('ec2.sp_configs', lambda: None) is None
+    assert cache.get('ec2.other', lambda: None) == {}
+
+
+def test_update_merges_into_a_cached_dict_only(cache):
+    cache.update('ec2.sp_configs', {'diafine6': 'running'})
+    assert cache.get('ec2.sp_configs', lambda: None) is None
+
+    cache.put('ec2.sp_configs', {'diafine6': 'stopped', 'diafine7': 'stopped'})
+    since = cache.generation()
+    cache.update('ec2.sp_configs', {'diafine6': 'running'}, since=since)
+    assert cache.get('ec2.sp_configs', lambda: None) == {'diafine6': 'running', 'diafine7': 'stopped'}
+
+
+def test_disabled_cache_always_fetches(tmp_path):
+    cache = ControlPlaneCache(0, state_file=str(tmp_path / 'control-plane-cache.json'))
+    cache.put('ec2.sp_configs', {'diafine6': 'running'})
+    assert cache.get('ec2.sp_configs', lambda: {}) == {}
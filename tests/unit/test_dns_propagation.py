@@ -0,0 +1,42 @@
+"""Waiting for A records to propagate (see `tests/dns_propagation.py`), against the AWS stand-in's DNS."""
+import time
+
+import pytest
+
+from tests.dns_propagation import wait_for_propagation
+
+
+def upsert(stand_in, domain: str, ip: str, ttl: int):
+    stand_in.change_resource_record_sets(HostedZoneId=stand_in.zone.id, ChangeBatch={'Changes': [{
+        'Action': 'UPSERT',
+        'ResourceRecordSet': {'Name': domain, 'Type': 'A', 'TTL': ttl, 'ResourceRecords': [{'Value': ip}]},
+    }]})
+
+
+def test_waits_until_the_local_resolver_has_the_new_address(stand_in):
+    zone = stand_in.zone.name
+    domains = [f'diafine6.{zone}', f'diafine7.{zone}']
+    for domain, ip in zip(domains, ['10.0.0.1', '10.0.0.2']):
+        upsert(stand_in, domain, '10.9.9.9', ttl=1)
+        upsert(stand_in, domain, ip, ttl=1)
+    start = time.monotonic()
+    seconds = wait_for_propagation({domains[0]: '10.0.0.1', domains[1]: '10.0.0.2'}, zone=zone, ttl=5,
+                                   resolver_factory=stand_in.resolver)
+    elapsed = time.monotonic() - start
+    assert set(seconds) == set(domains)
+    assert all(stand_in.lookup_domain_ip(domain) == ip for domain, ip in zip(domains, ['10.0.0.1', '10.0.0.2']))
+    # The local resolver held on to the old addresses for a while, and both domains were waited for at once.
+    assert min(seconds.values()) > 0.2
+    assert elapsed < sum(seconds.values())
+
+
+def test_a_domain_that_never_updates_times_out(stand_in):
+    zone = stand_in.zone.name
+    upsert(stand_in, f'diafine6.{zone}', '10.0.0.1', ttl=1)
+    with pytest.raises(TimeoutError, match=f'diafine7.{zone} never updated to 10.0.0.2'):
+        wait_for_propagation({f'diafine7.{zone}': '10.0.0.2'}, zone=zone, ttl=0.5,
+                             resolver_factory=stand_in.resolver)
+
+
+def test_no_targets_need_no_lookups(stand_in):
+    assert wait_for_propagation({}, zone=stand_in.zone.name, ttl=300, resolver_factory=stand_in.resolver) == {}
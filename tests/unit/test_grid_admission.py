@@ -0,0 +1,60 @@
+"""Reading the selenium grid's status, and how many sessions a run admits (see `tests/grid_admission.py`)."""
+import pytest
+
+from tests import grid_admission
+from tests.grid_admission import GridAdmission, GridStatus
+
+
+def node(*slots, availability='UP'):
+    return {'availability': availability, 'slots': list(slots)}
+
+
+def slot(browser_name='chrome', busy=False):
+    return {'stereotype': {'browserName': browser_name}, 'session': {'sessionId': 'abc'} if busy else None}
+
+
+def test_parse_counts_the_chrome_slots_of_available_nodes():
+    status = GridStatus.parse({'value': {'ready': True, 'nodes': [
+        node(slot(), slot(busy=True), slot('firefox')),
+        node(slot(busy=True)),
+        node(slot(), availability='DRAINING'),
+    ]}})
+    assert (status.ready, status.total_slots, status.free_slots) == (True, 3, 1)
+
+
+def test_parse_without_nodes_is_none():
+    # e.g., a standalone Selenium 3 server
+    assert GridStatus.parse({'value': {'ready': True, 'message': 'Server is running'}}) is None
+    assert GridStatus.parse({}) is None
+
+
+@pytest.fixture
+def admission(tmp_path, monkeypatch):
+    monkeypatch.setattr(grid_admission, 'run_dir', lambda kind: str(tmp_path))
+    admission = GridAdmission()
+    admission.configure('grid:4444')
+    return admission
+
+
+def grid_with(monkeypatch, total: int, free: int):
+    monkeypatch.setattr(GridStatus, 'fetch', classmethod(lambda cls, server: GridStatus(True, total, free)))
+
+
+def test_sessions_that_are_not_the_runs_are_left_their_slots(admission, monkeypatch):
+    grid_with(monkeypatch, total=4, free=4)
+    first, second = admission.acquire(), admission.acquire()
+    # The run's two sessions, and one that isn't the run's.
+    grid_with(monkeypatch, total=4, free=1)
+    monkeypatch.setattr(grid_admission, 'CAPACITY_REFRESH_SECONDS', -1)
+    assert admission.capacity == 3
+    first.release()
+    second.release()
+
+
+def test_capacity_is_checked_again_once_it_is_out_of_date(admission, monkeypatch):
+    grid_with(monkeypatch, total=4, free=1)
+    assert admission.capacity == 1
+    grid_with(monkeypatch, total=4, free=4)
+    assert admission.capacity == 1
+    monkeypatch.setattr(grid_admission, 'CAPACITY_REFRESH_SECONDS', -1)
+    assert admission.capacity == 4
@@ -0,0 +1,54 @@
+"""Latency histograms (see `tests/histogram.py`)."""
+import pytest
+
+from tests.histogram import LatencyHistogram, StepLatencies
+
+
+def test_percentiles_are_within_one_percent():
+    histogram = LatencyHistogram()
+    for ms in range(1, 1001):
+        histogram.record(ms / 1000)
+    assert histogram.count == 1000
+    assert histogram.max_seconds == 1.0
+    for pct, expected in ((50, 0.5), (90, 0.9), (99, 0.99)):
+        assert histogram.percentile(pct) == pytest.approx(expected, rel=0.01)
+    assert histogram.summary()['mean'] == pytest.approx(0.5005)
+
+
+def test_percentiles_never_exceed_the_max():
+    histogram = LatencyHistogram()
+    for seconds in (1.2289, 1.2290):
+        histogram.record(seconds)
+    # Both are in the same bucket, whose midpoint is above the larger one.
+    assert histogram.percentile(50) == histogram.percentile(99) == 1.2290
+
+
+def test_empty_histogram():
+    assert LatencyHistogram().summary() == {'count': 0, 'mean': 0.0, 'p50': 0.0, 'p90': 0.0, 'p99': 0.0, 'max': 0.0}
+
+
+def test_merge_adds_the_other_histograms_values():
+    fast, slow = LatencyHistogram(), LatencyHistogram()
+    for _ in range(9):
+        fast.record(0.01)
+    slow.record(2.0)
+    fast.merge(slow)
+    assert fast.count == 10
+    assert fast.percentile(50) == pytest.approx(0.01, rel=0.01)
+    assert fast.percentile(100) == 2.0
+
+
+def test_step_latencies_count_errors_and_still_time_them():
+    steps = StepLatencies()
+    with steps.time('login_page'):
+        pass
+    with pytest.raises(RuntimeError):
+        with steps.time('signed_in'):
+            raise RuntimeError('not signed in')
+    other = StepLatencies()
+    with other.time('login_page'):
+        pass
+    summary = StepLatencies.merged(steps, other).summary()
+    assert list(summary) == ['login_page', 'signed_in']
+    assert (summary['login_page']['count'], summary['login_page']['errors']) == (2, 0)
+    assert (summary['signed_in']['count'], summary['signed_in']['errors']) == (1, 1)
@@ -0,0 +1,123 @@
+"""Parsing pages and signing in without a browser (see `tests/http_saml.py`), against a fake SP and IdP."""
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import parse_qs
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from tests.http_saml import HtmlPage, HttpSamlClient, HttpSamlError, is_duo_prompt
+
+SP_URL = 'https://sp.example.edu/'
+ACS_URL = 'https://sp.example.edu/Shibboleth.sso/SAML2/POST'
+IDP_URL = 'https://idp.example.edu/idp/profile/SAML2/Redirect/SSO'
+DUO_URL = 'https://api-1234.duosecurity.com/frame/v4/auth/prompt'
+
+SIGN_IN_PAGE = f"""
+<html><body>
+<h1>Sign in</h1>
+<form action="{IDP_URL}" method="POST" id="login">
+  <input type="text" name="weblogin_netid">
+  <input type="password" name="weblogin_password">
+  <input type="hidden" name="csrf" value="token">
+  <button type="submit" name="_eventId_proceed" value="">Sign in</button>
+  <button type="submit" name="_eventId_cancel" value="">Cancel</button>
+</form>
+</body></html>
+"""
+
+RELAY_PAGE = f"""
+<html><body onload="document.forms[0].submit()">
+<form action="{ACS_URL}" method="post">
+  <input type="hidden" name="SAMLResponse" value="PHNhbWxwOlJlc3BvbnNlLz4=">
+  <input type="hidden" name="RelayState" value="ss:mem:1">
+  <noscript><input type="submit" value="Continue"></noscript>
+</form>
+</body></html>
+"""
+
+SP_PAGE = "<html><body><h2>Attributes &amp; values</h2><pre>eppn: sptest01@washington.edu</pre></body></html>"
+
+
+class FakeSite(HTTPAdapter):
+    """Answers requests from the given routes: {(method, url): handler(form data) -> (final url, html)}."""
+    def __init__(self, routes: Dict[Tuple[str, str], Callable[[Dict[str, str]], Tuple[str, str]]]):
+        super().__init__()
+        self.routes = routes
+        self.requests: List[Tuple[str, str, Dict[str, str]]] = []
+
+    def send(self, request, **kwargs):
+        url = request.url.split('?')[0]
+        data = {k: v[0] for k, v in parse_qs(request.body or '', keep_blank_values=True).items()}
+        self.requests.append((request.method, url, data))
+        final_url, html = self.routes[(request.method, url)](data)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = html.encode()
+        response.encoding = 'utf-8'
+        response.url = final_url
+        response.request = request
+        return response
+
+
+def idp(password: str = 'right', duo_netids=()) -> FakeSite:
+    def sign_in(data):
+        if data.get('weblogin_netid') in duo_netids:
+            return DUO_URL, '<html><body><h1>Duo</h1></body></html>'
+        if data.get('weblogin_password') != password:
+            return IDP_URL, SIGN_IN_PAGE
+        return IDP_URL, RELAY_PAGE
+
+    return FakeSite({
+        ('GET', SP_URL): lambda data: (IDP_URL, SIGN_IN_PAGE),
+        ('POST', IDP_URL): sign_in,
+        ('POST', ACS_URL): lambda data: (SP_URL, SP_PAGE),
+    })
+
+
+def test_html_page_extracts_forms_headings_and_pre_blocks():
+    page = HtmlPage(IDP_URL, SIGN_IN_PAGE + SP_PAGE)
+    assert page.headings == ['Sign in', 'Attributes & values']
+    assert page.pre_blocks == ['eppn: sptest01@washington.edu']
+    assert 'login' in page.element_ids
+    form = page.forms[0]
+    assert form.method == 'post' and form.has_input('weblogin_netid')
+    assert not form.submits_itself
+    # Only the first submit button is sent, like a browser does when it is clicked.
+    assert form.values(weblogin_netid='sptest01') == {
+        'weblogin_netid': 'sptest01', 'weblogin_password': '', 'csrf': 'token', '_eventId_proceed': ''}
+
+
+def test_relay_form_submits_itself():
+    assert HtmlPage(IDP_URL, RELAY_PAGE).forms[0].submits_itself
+
+
+def test_sign_in_relays_the_saml_response_to_the_sp():
+    site = idp()
+    page = HttpSamlClient(site).log_in(SP_URL, 'sptest01', 'right')
+    assert page.url == SP_URL
+    assert page.pre_blocks == ['eppn: sptest01@washington.edu']
+    method, url, data = site.requests[-1]
+    assert (method, url, data['SAMLResponse']) == ('POST', ACS_URL, 'PHNhbWxwOlJlc3BvbnNlLz4=')
+
+
+def test_sign_in_with_the_wrong_password_fails():
+    with pytest.raises(HttpSamlError, match='did not accept the password'):
+        HttpSamlClient(idp()).log_in(SP_URL, 'sptest01', 'wrong')
+
+
+def test_sign_in_stops_at_the_duo_prompt():
+    with pytest.raises(HttpSamlError, match='Duo prompt'):
+        HttpSamlClient(idp(duo_netids=['sptest04'])).log_in(SP_URL, 'sptest04', 'right')
+
+
+def test_sign_in_form_without_a_password_input_fails():
+    site = FakeSite({('GET', SP_URL): lambda data: (IDP_URL, SIGN_IN_PAGE.replace('type="password"', 'type="text"'))})
+    with pytest.raises(HttpSamlError, match='no password input'):
+        HttpSamlClient(site).log_in(SP_URL, 'sptest01', 'right')
+
+
+def test_is_duo_prompt():
+    assert is_duo_prompt(DUO_URL)
+    assert not is_duo_prompt('https://duosecurity.com.example.edu/')
+    assert not is_duo_prompt(IDP_URL)
@@ -0,0 +1,45 @@
+"""Running virtual users (see `tests/load_generator.py`), without an IdP."""
+from typing import List
+
+import pytest
+
+from tests.histogram import StepLatencies
+from tests.load_generator import IdpNode, LoadEngine, VirtualUser, resolve_idp_nodes
+
+
+def test_resolve_idp_nodes_uses_given_addresses_as_is():
+    nodes = resolve_idp_nodes(['idp11=10.0.0.11', '10.0.0.12'])
+    assert [(n.name, n.ip) for n in nodes] == [('idp11', '10.0.0.11'), ('10.0.0.12', '10.0.0.12')]
+
+
+@pytest.mark.parametrize('host', ['idp11=', '=10.0.0.11', 'idp11= ', 'directory.uw.edu'])
+def test_resolve_idp_nodes_rejects_hosts_without_an_address(host):
+    with pytest.raises(ValueError):
+        resolve_idp_nodes([host])
+
+
+class FakeUser(VirtualUser):
+    def __init__(self, netid: str, node: IdpNode, steps: StepLatencies, log: List):
+        super().__init__(netid, 'password', steps)
+        self._node = node
+        self._log = log
+
+    def log_in(self) -> bool:
+        with self._steps.time('login_page'):
+            self._log.append((self._netid, self._node.name))
+        return self._netid != 'sptest03'
+
+    def log_out(self):
+        pass
+
+
+def test_load_engine_hands_out_accounts_and_nodes_in_turn():
+    log = []
+    nodes = [IdpNode('idp11', '10.0.0.11'), IdpNode('idp12', '10.0.0.12')]
+    report = LoadEngine(lambda netid, node, steps: FakeUser(netid, node, steps, log), ['sptest01', 'sptest03'],
+                        concurrency=3, num_loops=2, sleep_time=0, nodes=nodes).run()
+    assert sorted(set(log)) == [('sptest01', 'idp11'), ('sptest03', 'idp12')]
+    assert [(u.netid, u.node.name) for u in report.users] == [
+        ('sptest01', 'idp11'), ('sptest03', 'idp12'), ('sptest01', 'idp11')]
+    assert (report.cycles, report.errors) == (6, 2)
+    assert report.error_rate == pytest.approx(2 / 6)
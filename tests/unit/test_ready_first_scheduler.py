@@ -0,0 +1,56 @@
+"""Running the tests whose service providers are ready first (see `ReadyFirstScheduler` in `tests/sp_bootstrap.py`)."""
+from types import SimpleNamespace
+from typing import List
+
+from tests.models import ServiceProviderInstance
+from tests.sp_bootstrap import ReadyFirstScheduler
+
+diafine6 = ServiceProviderInstance.diafine6
+diafine7 = ServiceProviderInstance.diafine7
+
+
+class FakeBootstrap:
+    def __init__(self, *ready: ServiceProviderInstance):
+        self.ready = set(ready)
+
+    def is_ready(self, sp: ServiceProviderInstance) -> bool:
+        return sp in self.ready
+
+
+def session_of(*modules_and_names) -> List[SimpleNamespace]:
+    """Items named `<module>.<name>`, in one session."""
+    session = SimpleNamespace(items=[])
+    modules = {}
+    for nodeid in modules_and_names:
+        module = modules.setdefault(nodeid.split('.')[0], SimpleNamespace())
+        session.items.append(SimpleNamespace(nodeid=nodeid, module=module, session=session))
+    return session.items
+
+
+def nodeids(items) -> List[str]:
+    return [item.nodeid for item in items]
+
+
+def test_ready_modules_move_ahead_of_waiting_ones():
+    items = session_of('a.1', 'b.1', 'c.1', 'c.2', 'd.1')
+    required = {'c.1': [diafine6], 'c.2': [diafine6], 'd.1': [diafine7]}
+    scheduler = ReadyFirstScheduler(FakeBootstrap(diafine7), required)
+    scheduler.pytest_runtest_protocol(items[0])
+    # b.1 is next, so it stays where it is; d.1 is ready, c is still waiting for diafine6.
+    assert nodeids(items) == ['a.1', 'b.1', 'd.1', 'c.1', 'c.2']
+
+
+def test_the_rest_of_the_next_module_is_not_split():
+    items = session_of('a.1', 'b.1', 'b.2', 'c.1')
+    required = {'b.2': [diafine6]}
+    scheduler = ReadyFirstScheduler(FakeBootstrap(), required)
+    scheduler.pytest_runtest_protocol(items[0])
+    assert nodeids(items) == ['a.1', 'b.1', 'b.2', 'c.1']
+
+
+def test_nothing_moves_once_everything_is_ready():
+    items = session_of('a.1', 'b.1', 'c.1', 'd.1')
+    required = {'c.1': [diafine6], 'd.1': [diafine7]}
+    scheduler = ReadyFirstScheduler(FakeBootstrap(diafine6, diafine7), required)
+    scheduler.pytest_runtest_protocol(items[0])
+    assert nodeids(items) == ['a.1', 'b.1', 'c.1', 'd.1']
@@ -0,0 +1,85 @@
+"""The screenshot policy (see `tests/snap_policy.py`), with fake browsers."""
+import threading
+from types import SimpleNamespace
+
+import pytest
+from webdriver_recorder.browser import BrowserRecorder
+
+from tests.snap_policy import ON_FAILURE, SnapPolicy, SnapshotController
+
+
+class FakeBrowser:
+    def __init__(self, name: str, controller: SnapshotController):
+        self.name = name
+        self.current_url = f'https://{name}.example.edu/'
+        self.page_source = f'<html>{name}</html>'
+        self._controller = controller
+
+    def visit(self, page: str):
+        self.current_url = f'https://{self.name}.example.edu/{page}'
+        self.snap(caption=page)
+
+    def snap(self, caption=None, is_error=False):
+        self._controller.snap(self, lambda: BrowserRecorder.pngs.append((self.name, caption)), caption, is_error)
+
+
+@pytest.fixture
+def controller() -> SnapshotController:
+    controller = SnapshotController()
+    controller.configure(ON_FAILURE)
+    pngs = list(BrowserRecorder.pngs)
+    yield controller
+    BrowserRecorder.pngs[:] = pngs
+
+
+def failing_item(tmp_path):
+    return SimpleNamespace(nodeid='tests/test_x.py::test_y', config=SimpleNamespace(getoption=lambda name: tmp_path))
+
+
+def test_sampled_policy():
+    policy = SnapPolicy.parse('sampled:3')
+    assert [policy.should_capture(i) for i in range(1, 8)] == [True, False, False, True, False, False, True]
+    with pytest.raises(ValueError):
+        SnapPolicy.parse('sampled:0')
+
+
+def test_failure_is_saved_for_the_browser_that_failed(controller, tmp_path):
+    main = FakeBrowser('main', controller)
+    main.visit('start')
+    # Like the browser pool, keeps the lanes' browsers around after the lanes are done with them.
+    browsers = []
+
+    def lane(name: str, fails: bool):
+        browser = FakeBrowser(name, controller)
+        browsers.append(browser)
+        try:
+            with controller.blame_on_failure(browser):
+                browser.visit('sign-in')
+                browser.visit('attributes')
+                if fails:
+                    raise AssertionError('wrong attribute')
+        except AssertionError:
+            pass
+
+    threads = [threading.Thread(target=lane, args=('good', False)), threading.Thread(target=lane, args=('bad', True))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    controller._save_failure(failing_item(tmp_path))
+
+    directory = tmp_path / 'pages' / 'tests_test_x.py_test_y'
+    assert (directory / 'trail.txt').read_text().split() == [
+        'https://bad.example.edu/sign-in', 'sign-in', 'https://bad.example.edu/attributes', 'attributes']
+    assert (directory / 'page.html').read_text() == '<html>bad</html>'
+    assert BrowserRecorder.pngs[-1] == ('bad', 'The page when the test failed')
+
+
+def test_failure_is_saved_for_the_main_threads_browser_by_default(controller, tmp_path):
+    main = FakeBrowser('main', controller)
+    main.visit('start')
+    thread = threading.Thread(target=lambda: FakeBrowser('other', controller).visit('elsewhere'))
+    thread.start()
+    thread.join()
+    controller._save_failure(failing_item(tmp_path))
+    assert (tmp_path / 'pages' / 'tests_test_x.py_test_y' / 'page.html').read_text() == '<html>main</html>'
@@ -0,0 +1,64 @@
+"""Reading the SP inventory (see `tests/sp_inventory.py`) from the AWS stand-in's fleet."""
+import pytest
+
+from tests.aws_standin import AwsStandIn
+from tests.models import AWSEC2InstanceStateName, DescribeInstancesRequest, ServiceProviderInstance
+from tests.sp_bootstrap import ServiceProviderBootstrap
+from tests.sp_inventory import load_inventory
+
+diafine6 = ServiceProviderInstance.diafine6
+diafine7 = ServiceProviderInstance.diafine7
+diafine8 = ServiceProviderInstance.diafine8
+
+
+def inventory_of(stand_in: AwsStandIn):
+    return load_inventory(stand_in.clients()['ec2'], DescribeInstancesRequest(filters=[]))
+
+
+def test_every_page_is_read(settings):
+    stand_in = AwsStandIn(settings.aws_hosted_zone, describe_page_size=2)
+    stand_in.add_service_providers(*ServiceProviderInstance)
+    stand_in.add_instance({'test_ref': 'something-else'})
+    inventory = inventory_of(stand_in)
+    assert inventory.num_pages == (len(ServiceProviderInstance) + 1 + 1) // 2
+    assert inventory.num_instances == len(ServiceProviderInstance)
+    assert set(inventory.service_providers) == set(ServiceProviderInstance)
+    assert inventory.skipped_refs == {'something-else': 1}
+
+
+def test_preferred_is_the_running_replica(stand_in):
+    stand_in.add_service_providers(diafine6, replicas=2)
+    running_id = stand_in.add_instance({'test_ref': diafine6.value}, AWSEC2InstanceStateName.RUNNING)
+    assert inventory_of(stand_in).preferred(diafine6).instance_id == running_id
+
+
+def test_preferred_is_never_terminated(stand_in):
+    stand_in.add_instance({'test_ref': diafine6.value}, AWSEC2InstanceStateName.TERMINATED)
+    assert inventory_of(stand_in).preferred(diafine6) is None
+
+    stopped_id = stand_in.add_instance({'test_ref': diafine6.value}, AWSEC2InstanceStateName.STOPPED)
+    assert inventory_of(stand_in).preferred(diafine6).instance_id == stopped_id
+
+
+def test_a_service_provider_without_a_usable_instance_is_named(stand_in, utils):
+    stand_in.add_service_providers(diafine6, state=AWSEC2InstanceStateName.TERMINATED)
+    with pytest.raises(RuntimeError, match=r'diafine6 has no instance that can be used \(.* is terminated\)'):
+        utils.ensure_test_sps_ready(diafine6)
+    with pytest.raises(RuntimeError, match='diafine8 has no instance'):
+        utils.ensure_test_sps_ready(diafine8)
+    assert stand_in.calls['ec2.StartInstances'] == 0
+
+
+def test_the_bootstrap_starts_the_others(stand_in, utils):
+    stand_in.add_service_providers(diafine6, state=AWSEC2InstanceStateName.TERMINATED)
+    stand_in.add_service_providers(diafine7)
+    bootstrap = ServiceProviderBootstrap(utils.sp_aws_operations, [diafine6, diafine7])
+    bootstrap.start()
+    try:
+        bootstrap.wait_until_ready(diafine7)
+        with pytest.raises(RuntimeError, match='diafine6 could not be started') as error:
+            bootstrap.wait_until_ready(diafine6)
+    finally:
+        bootstrap.shutdown()
+    assert 'is terminated' in str(error.value.__cause__)
+    assert utils.sp_aws_operations.instance_is_started(diafine7)
@@ -0,0 +1,81 @@
+"""
+Starting the test SPs, and updating their DNS records, the ways a test run (`ServiceProviderBootstrap`)
+and `python -m tests.sp_manager start` do it, against the AWS stand-in.
+"""
+from typing import Dict
+
+from tests.aws_standin import AwsStandIn
+from tests.helpers import WebTestUtils
+from tests.models import AWSEC2InstanceStateName, ServiceProviderInstance
+from tests.sp_bootstrap import ServiceProviderBootstrap
+from tests.sp_manager import start_service_providers
+
+diafine6 = ServiceProviderInstance.diafine6
+diafine7 = ServiceProviderInstance.diafine7
+diafine8 = ServiceProviderInstance.diafine8
+
+
+def instance_states(stand_in: AwsStandIn,
+                    utils: WebTestUtils) -> Dict[ServiceProviderInstance, AWSEC2InstanceStateName]:
+    configs = utils.sp_aws_operations.service_providers
+    states = stand_in.instance_states([config.instance_id for config in configs.values()])
+    return dict(zip(configs, states))
+
+
+def resolves_to_instance(stand_in: AwsStandIn, utils: WebTestUtils, sp: ServiceProviderInstance) -> bool:
+    instance_id = utils.sp_aws_operations.service_providers[sp].instance_id
+    instance = stand_in.describe_instances(InstanceIds=[instance_id])['Reservations'][0]['Instances'][0]
+    return stand_in.lookup_domain_ip(utils.service_provider_domain(sp)) == instance['PublicIpAddress']
+
+
+def test_start_service_providers_starts_only_those_given(stand_in, utils):
+    stand_in.add_service_providers(*ServiceProviderInstance)
+    start_service_providers(utils.sp_aws_operations, diafine6, diafine7)
+
+    states = instance_states(stand_in, utils)
+    assert states.pop(diafine6) == states.pop(diafine7) == AWSEC2InstanceStateName.RUNNING
+    assert set(states.values()) == {AWSEC2InstanceStateName.STOPPED}
+    assert resolves_to_instance(stand_in, utils, diafine6)
+    assert resolves_to_instance(stand_in, utils, diafine7)
+
+
+def test_start_service_providers_updates_only_stale_records(stand_in, utils):
+    stand_in.add_service_providers(diafine6, state=AWSEC2InstanceStateName.RUNNING, dns_up_to_date=True)
+    stand_in.add_service_providers(diafine7, state=AWSEC2InstanceStateName.RUNNING)
+    start_service_providers(utils.sp_aws_operations, diafine6, diafine7)
+
+    assert stand_in.record_changes == [[utils.service_provider_domain(diafine7)]]
+    assert resolves_to_instance(stand_in, utils, diafine6)
+    assert resolves_to_instance(stand_in, utils, diafine7)
+
+
+def test_bootstrap_updates_only_stale_records_in_one_change(stand_in, utils):
+    stand_in.add_service_providers(diafine6, state=AWSEC2InstanceStateName.RUNNING, dns_up_to_date=True)
+    stand_in.add_service_providers(diafine7, state=AWSEC2InstanceStateName.RUNNING)
+    stand_in.add_service_providers(diafine8)
+    bootstrap = ServiceProviderBootstrap(utils.sp_aws_operations, [diafine6, diafine7, diafine8])
+    bootstrap.start()
+    try:
+        for sp in (diafine6, diafine7, diafine8):
+            bootstrap.wait_until_ready(sp)
+    finally:
+        bootstrap.shutdown()
+
+    stale = [utils.service_provider_domain(diafine7), utils.service_provider_domain(diafine8)]
+    assert [sorted(names) for names in stand_in.record_changes] == [stale]
+    assert all(resolves_to_instance(stand_in, utils, sp) for sp in (diafine6, diafine7, diafine8))
+    assert stand_in.calls['ec2.StartInstances'] == 1
+
+
+def test_bootstrap_starts_only_needed_service_providers(stand_in, utils):
+    stand_in.add_service_providers(*ServiceProviderInstance)
+    bootstrap = ServiceProviderBootstrap(utils.sp_aws_operations, [diafine8])
+    bootstrap.start()
+    try:
+        bootstrap.wait_until_ready(diafine8)
+    finally:
+        bootstrap.shutdown()
+
+    states = instance_states(stand_in, utils)
+    assert states.pop(diafine8) == AWSEC2InstanceStateName.RUNNING
+    assert set(states.values()) == {AWSEC2InstanceStateName.STOPPED}
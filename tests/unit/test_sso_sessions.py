@@ -0,0 +1,42 @@
+"""Recording and restoring IdP SSO sessions (see `tests/sso_sessions.py`), with fake browsers."""
+from typing import List
+
+from selenium.common.exceptions import WebDriverException
+
+from tests.sso_sessions import SsoSessionCache, SsoSnapshot
+
+IDP_ORIGIN = 'https://idp.u.washington.edu'
+
+
+class BrowserWithoutDevtools:
+    def __init__(self):
+        self.visited: List[str] = []
+        self.cookies: List[dict] = []
+
+    def execute_cdp_cmd(self, command, params):
+        raise WebDriverException('devtools are not available')
+
+    def get(self, url: str):
+        self.visited.append(url)
+
+    def add_cookie(self, cookie: dict):
+        self.cookies.append(cookie)
+
+
+def test_restoring_without_devtools_keeps_parent_domains():
+    snapshot = SsoSnapshot([
+        {'name': 'shib_idp_session', 'value': 'a', 'domain': 'idp.u.washington.edu', 'path': '/idp',
+         'secure': True, 'session': True},
+        {'name': 'uw_sso', 'value': 'b', 'domain': '.washington.edu', 'path': '/', 'expires': 2000000000.5},
+        {'name': 'tld', 'value': 'c', 'domain': '.edu', 'path': '/', 'session': True},
+    ])
+    browser = BrowserWithoutDevtools()
+    SsoSessionCache(IDP_ORIGIN, 3600)._restore(browser, snapshot)
+
+    assert browser.visited == [f'{IDP_ORIGIN}/idp']
+    assert browser.cookies == [
+        # Host-only, as it was.
+        {'name': 'shib_idp_session', 'value': 'a', 'path': '/idp', 'secure': True},
+        {'name': 'uw_sso', 'value': 'b', 'domain': '.washington.edu', 'path': '/', 'expiry': 2000000000},
+        {'name': 'tld', 'value': 'c', 'path': '/'},
+    ]